@@ -1 +1,2 @@
 from blueque.client import Client  # noqa: F401
+from blueque.async_client import AsyncClient  # noqa: F401
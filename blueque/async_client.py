@@ -0,0 +1,46 @@
+from blueque.async_listener import AsyncListener
+from blueque.async_processor import AsyncProcessor
+from blueque.async_queue import AsyncQueue
+from blueque.async_redis_queue import AsyncRedisQueue
+from blueque.async_redis_task import AsyncRedisTask
+from blueque.async_task import AsyncTask
+
+import redis.asyncio
+
+
+class AsyncClient(object):
+    def __init__(self, url, metrics=None, **kwargs):
+        super(AsyncClient, self).__init__()
+
+        self._redis = redis.asyncio.StrictRedis.from_url(url, decode_responses=True, **kwargs)
+        self._metrics = metrics
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._redis.aclose()
+
+    def get_queue(self, name):
+        redis_queue = AsyncRedisQueue(name, self._redis, self._metrics)
+        return AsyncQueue(name, redis_queue)
+
+    async def get_task(self, task_id):
+        redis_task = AsyncRedisTask(task_id, self._redis)
+        return AsyncTask(task_id, redis_task, await redis_task.get_task_data())
+
+    async def get_listener(self, queue_name, **kwargs):
+        redis_queue = AsyncRedisQueue(queue_name, self._redis, self._metrics)
+        listener = AsyncListener(redis_queue, self.get_task, **kwargs)
+
+        await listener.register()
+
+        return listener
+
+    def get_processor(self, task, **kwargs):
+        redis_queue = AsyncRedisQueue(task.queue, self._redis, self._metrics)
+
+        return AsyncProcessor(task, redis_queue, metrics=self._metrics, **kwargs)
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import socket
+
+
+class AsyncListener(object):
+    # How long a subscribed listener without a dequeue_timeout waits
+    # for a notification before trying to dequeue a task again.
+    notification_timeout = 60
+
+    def __init__(self, queue, task_factory, dequeue_timeout=None, subscribe=False):
+        super(AsyncListener, self).__init__()
+
+        # BRPOPLPUSH blocks for ever with a timeout of 0.
+        if dequeue_timeout is not None and dequeue_timeout <= 0:
+            raise ValueError("A dequeue timeout must be greater than 0")
+
+        self._hostname = socket.getfqdn()
+        self._pid = os.getpid()
+        self._name = "_".join((self._hostname, str(self._pid)))
+        self._queue = queue
+        self._task_factory = task_factory
+        self._dequeue_timeout = dequeue_timeout
+        self._subscribe = subscribe
+
+    async def register(self):
+        await self._queue.add_listener(self._name)
+
+    async def _listen_subscribed(self):
+        task_id = await self._queue.dequeue(self._name)
+        if task_id is not None:
+            return task_id
+
+        subscription = await self._queue.subscribe()
+
+        async with subscription:
+            while True:
+                # Try again once subscribed, in case a task was
+                # enqueued before the subscription took effect.
+                task_id = await self._queue.dequeue(self._name)
+                if task_id is not None:
+                    return task_id
+
+                await subscription.get_message(
+                    timeout=self._dequeue_timeout or self.notification_timeout)
+
+    async def listen(self):
+        if self._subscribe:
+            return await self._task_factory(await self._listen_subscribed())
+
+        while True:
+            task_id = await self._queue.dequeue(self._name, timeout=self._dequeue_timeout)
+            if task_id is not None:
+                return await self._task_factory(task_id)
+            elif self._dequeue_timeout is None:
+                await asyncio.sleep(1)
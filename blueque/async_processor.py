@@ -0,0 +1,24 @@
+from blueque.processor import Processor
+
+
+# Shares its state, and metrics, with Processor, but awaits an
+# AsyncRedisQueue, and has no heartbeat.
+class AsyncProcessor(Processor):
+    def __init__(self, task, redis_queue, result_ttl=None, metrics=None):
+        super(AsyncProcessor, self).__init__(
+            task, redis_queue, result_ttl=result_ttl, metrics=metrics)
+
+    async def start(self, pid):
+        self._pid = pid
+        await self._redis_queue.start(self._task_id, self._listener_id, self._pid)
+        self._observe_start()
+
+    async def complete(self, result):
+        await self._redis_queue.complete(
+            self._task_id, self._listener_id, self._pid, result, self._result_ttl)
+        self._observe_finish("complete")
+
+    async def fail(self, error):
+        await self._redis_queue.fail(
+            self._task_id, self._listener_id, self._pid, error, self._result_ttl)
+        self._observe_finish("failed")
@@ -0,0 +1,36 @@
+class AsyncQueue(object):
+    def __init__(self, name, redis_queue):
+        super(AsyncQueue, self).__init__()
+
+        self._name = name
+        self._redis_queue = redis_queue
+
+    async def enqueue(self, parameters, timeout=None):
+        return await self._redis_queue.enqueue(parameters, timeout)
+
+    async def enqueue_many(self, parameters_list, chunk_size=1000, timeout=None):
+        return await self._redis_queue.enqueue_many(parameters_list, chunk_size, timeout)
+
+    async def schedule(self, parameters, eta, timeout=None):
+        return await self._redis_queue.schedule(parameters, eta, timeout)
+
+    async def schedule_many(self, scheduled_tasks, chunk_size=1000, timeout=None):
+        return await self._redis_queue.schedule_many(scheduled_tasks, chunk_size, timeout)
+
+    async def enqueue_due_tasks(self, limit=1000):
+        return await self._redis_queue.enqueue_due_tasks(limit)
+
+    async def delete_task(self, task):
+        if task.queue != self._name:
+            raise ValueError("Task %s is not in queue %s" % (task.id, self._name))
+
+        await self._redis_queue.delete_task(task.id, task.status)
+
+    async def purge_finished(self, older_than, batch_size=1000):
+        return await self._redis_queue.purge_finished(older_than, batch_size)
+
+    async def get_finished(self, task_status, start="-inf", end="+inf", limit=None):
+        return await self._redis_queue.get_finished(task_status, start, end, limit)
+
+    async def migrate_finished(self, batch_size=1000):
+        return await self._redis_queue.migrate_finished(batch_size)
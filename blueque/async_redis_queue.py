@@ -0,0 +1,246 @@
+from blueque.redis_queue import RedisQueue
+
+import time
+
+
+# The keys, scripts and pipelines are all built by RedisQueue; this
+# only awaits them on a redis.asyncio client. Every public method of
+# RedisQueue is overridden here, as none of them work on that client.
+class AsyncRedisQueue(RedisQueue):
+    async def add_listener(self, node_id):
+        async with self._redis.pipeline() as pipeline:
+            self._add_listener(pipeline, node_id)
+            await pipeline.execute()
+
+    async def remove_listener(self, node_id):
+        removed = await self._remove_listener(node_id)
+
+        if removed > 0:
+            self._log("removed listener")
+
+        return removed
+
+    async def get_listeners(self):
+        return await self._redis.smembers(self._listeners_key)
+
+    async def get_host_listeners(self, host):
+        return await self._redis.smembers(self._host_listeners_key(host))
+
+    async def index_host_listeners(self, batch_size):
+        indexed = 0
+        batch = []
+
+        async for listener in self._redis.sscan_iter(self._listeners_key, count=batch_size):
+            batch.append(listener)
+
+            if len(batch) == batch_size:
+                indexed += await self._index_host_listeners(batch)
+                batch = []
+
+        if len(batch) > 0:
+            indexed += await self._index_host_listeners(batch)
+
+        self._log("indexed %i listeners by host" % (indexed))
+
+        return indexed
+
+    async def hand_off(self, node_id):
+        self._log("handing off listener %s" % (node_id))
+
+        return await self._redis.sadd(self._handed_off_key(node_id.rsplit("_", 1)[0]), node_id)
+
+    async def get_handed_off_listeners(self, host):
+        return await self._redis.smembers(self._handed_off_key(host))
+
+    async def renew_lease(self, node_id, lease_timeout, register=False):
+        renewed = await self._renew_lease(node_id, lease_timeout, register)
+
+        self._log_renewed(node_id, renewed)
+
+        return renewed > 0
+
+    async def recover_expired_leases(self):
+        task_ids = await self._recover_expired_leases()
+
+        self._log_recovered(task_ids)
+
+        return task_ids
+
+    async def subscribe(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self._channel_name)
+
+        return pubsub
+
+    async def schedule(self, parameters, eta, timeout=None):
+        if eta < time.time():
+            return await self.enqueue(parameters, timeout)
+
+        async with self._redis.pipeline() as pipeline:
+            task_id = self._schedule(pipeline, parameters, eta, timeout)
+            await pipeline.execute()
+
+        return task_id
+
+    async def schedule_many(self, scheduled_tasks, chunk_size, timeout=None):
+        task_ids = []
+
+        for chunk in self._chunks(scheduled_tasks, chunk_size):
+            async with self._redis.pipeline() as pipeline:
+                task_ids.extend(self._schedule_chunk(pipeline, chunk, timeout))
+                await pipeline.execute()
+
+        return task_ids
+
+    async def enqueue(self, parameters, timeout=None):
+        started = time.perf_counter()
+
+        async with self._redis.pipeline() as pipeline:
+            task_id = self._enqueue(pipeline, parameters, timeout)
+            await pipeline.execute()
+
+        self._observe("enqueue", started)
+
+        return task_id
+
+    async def enqueue_many(self, parameters_list, chunk_size, timeout=None):
+        started = time.perf_counter()
+        task_ids = []
+        round_trips = 0
+
+        for chunk in self._chunks(parameters_list, chunk_size):
+            async with self._redis.pipeline() as pipeline:
+                task_ids.extend(self._enqueue_chunk(pipeline, chunk, timeout))
+                await pipeline.execute()
+
+            round_trips += 1
+
+        self._observe("enqueue_many", started, round_trips)
+
+        return task_ids
+
+    async def enqueue_due_tasks(self, limit):
+        started = time.perf_counter()
+
+        due_tasks, remaining = await self._enqueue_due(limit)
+
+        self._observe("enqueue_due_tasks", started)
+
+        self._log_due_tasks(due_tasks, remaining)
+
+        return remaining
+
+    async def dequeue(self, node_id, timeout=None):
+        started = time.perf_counter()
+        round_trips = 1
+
+        if timeout is None:
+            task_id = await self._reserve(node_id)
+        else:
+            task_id = await self._blocking_reserve(node_id, timeout)
+
+            if task_id is not None:
+                async with self._redis.pipeline() as pipeline:
+                    self._mark_reserved(pipeline, task_id, node_id)
+                    await pipeline.execute()
+
+                round_trips += 1
+
+        self._observe("dequeue", started, round_trips)
+
+        if task_id is None:
+            return None
+
+        self._log("got task %s" % (task_id))
+
+        return task_id
+
+    async def start(self, task_id, node_id, pid):
+        started = time.perf_counter()
+
+        await self._start(task_id, node_id, pid)
+
+        self._observe("start", started)
+
+    async def reclaim_task(self, old_node, new_node):
+        task_ids = await self._reclaim_tasks(old_node, new_node, 1)
+
+        return task_ids[0] if len(task_ids) > 0 else None
+
+    async def reclaim_tasks(self, old_node, new_node):
+        return await self._reclaim_tasks(old_node, new_node, 0)
+
+    async def reclaim_listeners(self, old_nodes, new_node):
+        return await self._reclaim_listeners(old_nodes, new_node)
+
+    async def complete(self, task_id, node_id, pid, result, result_ttl=None):
+        started = time.perf_counter()
+
+        await self._complete(task_id, node_id, pid, result, result_ttl)
+
+        self._observe("complete", started)
+
+    async def fail(self, task_id, node_id, pid, error, result_ttl=None):
+        started = time.perf_counter()
+
+        await self._fail(task_id, node_id, pid, error, result_ttl)
+
+        self._observe("fail", started)
+
+    async def record_usage(self, task_id, cpu_user, cpu_system, max_rss, duration):
+        return await self._record_usage(task_id, cpu_user, cpu_system, max_rss, duration)
+
+    async def get_usage(self):
+        return self._parse_usage(await self._redis.hgetall(self._usage_key))
+
+    @classmethod
+    async def get_many_stats(cls, redis_client, queue_names=None):
+        if queue_names is not None and len(queue_names) == 0:
+            return {}
+
+        return cls._parse_stats(await cls._get_raw_stats(redis_client, queue_names))
+
+    async def get_stats(self):
+        return (await self.get_many_stats(self._redis, [self._name]))[self._name]
+
+    async def delete_task(self, task_id, task_status):
+        async with self._redis.pipeline() as pipeline:
+            self._delete_task(pipeline, task_id, task_status)
+            await pipeline.execute()
+
+    async def purge_finished(self, older_than, batch_size):
+        cutoff = time.time() - older_than
+        purged = 0
+
+        for finished_key in (self._complete_key, self._failed_key):
+            while True:
+                batch_purged = await self._purge_finished(finished_key, cutoff, batch_size)
+                purged += batch_purged
+
+                if batch_purged < batch_size:
+                    break
+
+        self._log("purged %i tasks finished before %f" % (purged, cutoff))
+
+        return purged
+
+    async def get_finished(self, task_status, start, end, limit):
+        return await self._get_finished(task_status, start, end, limit)
+
+    async def migrate_finished(self, batch_size):
+        migrated = 0
+
+        for finished_list_key, finished_key in (
+                (self._complete_list_key, self._complete_key),
+                (self._failed_list_key, self._failed_key)):
+            while True:
+                batch_migrated, remaining = await self._migrate_finished(
+                    finished_list_key, finished_key, batch_size)
+                migrated += batch_migrated
+
+                if remaining == 0:
+                    break
+
+        self._log("migrated %i finished tasks" % (migrated))
+
+        return migrated
@@ -0,0 +1,6 @@
+from blueque.redis_task import RedisTask
+
+
+class AsyncRedisTask(RedisTask):
+    async def get_task_data(self):
+        return self._parse_task_data(await self._redis.hgetall(self._task_key))
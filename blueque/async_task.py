@@ -0,0 +1,14 @@
+from blueque.task import Task
+
+
+# Fields can't be read lazily without awaiting them, so every field is
+# read when the task is got, and again by refresh.
+class AsyncTask(Task):
+    __slots__ = ()
+
+    def _get(self, field):
+        return self._attributes.get(field)
+
+    async def refresh(self):
+        self._attributes = await self._redis_task.get_task_data()
+        self._all_fields = True
@@ -0,0 +1,67 @@
+from blueque.client import Client
+
+import argparse
+import logging
+
+
+def _run_scheduler(client, args):
+    scheduler = client.get_scheduler(batch_size=args.batch_size, lock_timeout=args.lock_timeout)
+    scheduler.run()
+
+
+def _migrate_finished(client, args):
+    for queue_name in client.get_queue_names():
+        migrated = client.get_queue(queue_name).migrate_finished(batch_size=args.batch_size)
+
+        logging.info("Migrated %i finished tasks on %s" % (migrated, queue_name))
+
+
+def _index_listeners(client, args):
+    for queue_name in client.get_queue_names():
+        indexed = client.get_queue(queue_name).index_host_listeners(batch_size=args.batch_size)
+
+        logging.info("Indexed %i listeners by host on %s" % (indexed, queue_name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="blueque")
+    parser.add_argument("url", help="Redis URL, i.e. redis://hostname:port/db")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scheduler_parser = subparsers.add_parser(
+        "scheduler", help="enqueue scheduled tasks, on every queue, when they are due")
+    scheduler_parser.add_argument(
+        "--batch-size", type=int, default=1000,
+        help="maximum number of tasks to enqueue at once (default: %(default)s)")
+    scheduler_parser.add_argument(
+        "--lock-timeout", type=float, default=30,
+        help="seconds before another scheduler can take over (default: %(default)s)")
+    scheduler_parser.set_defaults(run=_run_scheduler)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-finished",
+        help="move finished tasks, on every queue, from lists to time-ordered sorted sets")
+    migrate_parser.add_argument(
+        "--batch-size", type=int, default=1000,
+        help="maximum number of tasks to migrate at once (default: %(default)s)")
+    migrate_parser.set_defaults(run=_migrate_finished)
+
+    index_parser = subparsers.add_parser(
+        "index-listeners",
+        help="add listeners, on every queue, to the per-host listener index, "
+             "so that their orphaned tasks can be reclaimed")
+    index_parser.add_argument(
+        "--batch-size", type=int, default=1000,
+        help="maximum number of listeners to index at once (default: %(default)s)")
+    index_parser.set_defaults(run=_index_listeners)
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    args.run(Client(args.url), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,104 @@
+from blueque.event_reader import EventReader
 from blueque.listener import Listener
 from blueque.processor import Processor
 from blueque.queue import Queue
 from blueque.redis_queue import RedisQueue
+from blueque.redis_scheduler import RedisScheduler
 from blueque.redis_task import RedisTask
+from blueque.scheduler import Scheduler
 from blueque.task import Task
 
 import redis
+import time
 
 
 class Client(object):
-    def __init__(self, url, **kwargs):
+    def __init__(self, url, metrics=None, **kwargs):
         super(Client, self).__init__()
 
         self._redis = redis.StrictRedis.from_url(url, decode_responses=True, **kwargs)
+        self._metrics = metrics
+
+    @property
+    def metrics(self):
+        return self._metrics
 
     def get_queue(self, name):
-        redis_queue = RedisQueue(name, self._redis)
+        redis_queue = RedisQueue(name, self._redis, self._metrics)
         return Queue(name, redis_queue)
 
+    def get_queue_names(self):
+        return RedisScheduler(self._redis).get_queues()
+
+    def all_queue_stats(self):
+        return RedisQueue.get_many_stats(self._redis)
+
     def get_task(self, task_id):
         redis_task = RedisTask(task_id, self._redis)
         return Task(task_id, redis_task)
 
-    def get_listener(self, queue_name):
-        redis_queue = RedisQueue(queue_name, self._redis)
-        return Listener(redis_queue, self.get_task)
+    def get_tasks(self, task_ids, fields=None, chunk_size=1000):
+        task_ids = list(task_ids)
+        tasks = []
+
+        for start in range(0, len(task_ids), chunk_size):
+            chunk = task_ids[start:start + chunk_size]
+            chunk_data = RedisTask.get_many_task_data(self._redis, chunk, fields)
+
+            for task_id, task_data in zip(chunk, chunk_data):
+                if task_data is None:
+                    tasks.append(None)
+                else:
+                    redis_task = RedisTask(task_id, self._redis)
+                    tasks.append(Task(task_id, redis_task, task_data, all_fields=fields is None))
+
+        return tasks
+
+    def wait_for_result(self, task_id, timeout=None):
+        return self.wait_for_any([task_id], timeout)
+
+    def wait_for_any(self, task_ids, timeout=None):
+        task_ids = list(task_ids)
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        channel_count = len(set(task_ids))
+
+        with RedisTask.subscribe_finished(self._redis, task_ids) as subscription:
+            while True:
+                remaining = None
+
+                if timeout is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+
+                message = subscription.get_message(timeout=remaining)
+                if message is None:
+                    continue
+
+                if message["type"] == "message":
+                    return self.get_task(message["data"])
+
+                # Check once every subscription has taken effect, in
+                # case a task finished before then.
+                if message["type"] == "subscribe" and message["data"] == channel_count:
+                    for task in self.get_tasks(task_ids, fields=["status"]):
+                        if task is not None and task.status in ("complete", "failed"):
+                            return task
+
+    def get_listener(self, queue_name, **kwargs):
+        redis_queue = RedisQueue(queue_name, self._redis, self._metrics)
+        return Listener(redis_queue, self.get_task, **kwargs)
+
+    def get_processor(self, task, **kwargs):
+        redis_queue = RedisQueue(task.queue, self._redis, self._metrics)
+
+        return Processor(task, redis_queue, metrics=self._metrics, **kwargs)
 
-    def get_processor(self, task):
-        redis_queue = RedisQueue(task.queue, self._redis)
+    def get_scheduler(self, **kwargs):
+        return Scheduler(RedisScheduler(self._redis, self._metrics), **kwargs)
 
-        return Processor(task, redis_queue)
+    def get_event_reader(self, queue_names, **kwargs):
+        return EventReader(self._redis, queue_names, **kwargs)
@@ -0,0 +1,86 @@
+from blueque.redis_queue import RedisQueue
+
+import collections
+
+
+class Event(object):
+    __slots__ = ("id", "queue", "type", "task_id", "time", "fields")
+
+    def __init__(self, queue, event_id, event_data):
+        super(Event, self).__init__()
+
+        fields = dict(event_data)
+
+        self.id = event_id
+        self.queue = queue
+        self.type = fields.pop("event")
+        self.task_id = fields.pop("task")
+        self.time = float(fields.pop("time"))
+        self.fields = fields
+
+
+class EventReader(object):
+    def __init__(self, redis_client, queue_names, last_ids=None, timeout=None, count=100):
+        super(EventReader, self).__init__()
+
+        self._redis = redis_client
+        self._timeout = timeout
+        self._count = count
+
+        self._queue_names = dict((RedisQueue.events_key(name), name) for name in queue_names)
+        self._last_ids = self._get_start_ids(last_ids or {})
+
+        self._events = collections.deque()
+
+    def _get_start_ids(self, last_ids):
+        start_ids = {}
+        new_streams = []
+
+        for stream, queue_name in self._queue_names.items():
+            if queue_name in last_ids:
+                start_ids[stream] = last_ids[queue_name]
+            else:
+                new_streams.append(stream)
+
+        if len(new_streams) > 0:
+            # Start after the newest existing event, rather than
+            # reading from "$" every time, which would miss any
+            # events added between reads.
+            with self._redis.pipeline(transaction=False) as pipeline:
+                for stream in new_streams:
+                    pipeline.xrevrange(stream, count=1)
+
+                newest_events = pipeline.execute()
+
+            for stream, newest in zip(new_streams, newest_events):
+                start_ids[stream] = newest[0][0] if len(newest) > 0 else "0-0"
+
+        return start_ids
+
+    @property
+    def last_ids(self):
+        return dict(
+            (self._queue_names[stream], last_id) for stream, last_id in self._last_ids.items())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while len(self._events) == 0:
+            block = 0 if self._timeout is None else int(self._timeout * 1000)
+
+            streams = self._redis.xread(dict(self._last_ids), count=self._count, block=block)
+            if not streams:
+                raise StopIteration
+
+            for stream, entries in streams:
+                for event_id, event_data in entries:
+                    self._events.append((stream, event_id, event_data))
+
+        stream, event_id, event_data = self._events.popleft()
+
+        # Only advance once the event has been handed out, so that
+        # last_ids can be saved and used to resume reading.
+        self._last_ids[stream] = event_id
+
+        return Event(self._queue_names[stream], event_id, event_data)
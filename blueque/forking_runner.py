@@ -1,36 +1,339 @@
-from blueque.process_helpers import process_running
+from blueque.process_helpers import child_exited, open_pidfd, process_running, wait_for_exit
 
+import json
 import logging
 import os
 import random
+import resource
+import select
+import signal
 import sys
+import threading
 import time
 
 
+class _Worker(object):
+    def __init__(self, pid, task_fd, done_fd):
+        super(_Worker, self).__init__()
+
+        self.pid = pid
+        self.task_fd = task_fd
+        self.done_fd = done_fd
+        self.task = None
+        self.tasks_run = 0
+
+    def close(self):
+        os.close(self.task_fd)
+        os.close(self.done_fd)
+
+
+def _fail_unfinished(client, task, error, result_ttl):
+    # The process running it may have finished it after all.
+    task.refresh()
+
+    if task.status in ("reserved", "started"):
+        processor = client.get_processor(task, result_ttl=result_ttl)
+        processor.fail(error)
+
+
+class _Watchdog(object):
+    # Kills any child still running its task after the task's timeout,
+    # and fails the task, since it will never finish it itself.
+    def __init__(self, client, kill_grace_period, result_ttl, lock, is_running):
+        super(_Watchdog, self).__init__()
+
+        self._client = client
+        self._kill_grace_period = kill_grace_period
+        self._result_ttl = result_ttl
+        # The runner's lock, and whether a process is still running a
+        # task, which must be called with it held; a PID is only safe
+        # to signal while it is, since once the runner has reaped it
+        # it may be reused, or a worker may have a new task.
+        self._lock = lock
+        self._is_running = is_running
+        self._deadlines = {}
+        self._expiring = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def watch(self, pid, task, timeout, started=None):
+        # An orphan adopted from another runner has been running since
+        # it was started, not since it was adopted.
+        deadline = (time.time() if started is None else started) + timeout
+
+        with self._condition:
+            self._deadlines[(pid, task.id)] = (deadline, task, timeout)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._condition.notify()
+
+    def unwatch(self, pid, task_id):
+        # Returns whether the task has been timed out, in which case
+        # this fails it.
+        with self._condition:
+            self._deadlines.pop((pid, task_id), None)
+
+            return (pid, task_id) in self._expiring
+
+    def _next_expired(self):
+        with self._condition:
+            while True:
+                if len(self._deadlines) == 0:
+                    self._condition.wait()
+                    continue
+
+                key = min(self._deadlines, key=lambda key: self._deadlines[key][0])
+                deadline, task, timeout = self._deadlines[key]
+
+                if deadline <= time.time():
+                    del self._deadlines[key]
+                    return key[0], task, timeout
+
+                self._condition.wait(deadline - time.time())
+
+    def _signal(self, pid, task, signum):
+        # Returns whether the process was still running the task.
+        with self._lock:
+            if not self._is_running(pid, task.id):
+                return False
+
+            with self._condition:
+                self._expiring.add((pid, task.id))
+
+            # Children start their own sessions, so this also gets any
+            # processes the task has started.
+            try:
+                os.killpg(pid, signum)
+            except ProcessLookupError:
+                pass
+
+        return True
+
+    def _expire(self, pid, task, timeout):
+        try:
+            self._terminate(pid, task, timeout)
+        finally:
+            with self._condition:
+                self._expiring.discard((pid, task.id))
+
+    def _terminate(self, pid, task, timeout):
+        if not self._signal(pid, task, signal.SIGTERM):
+            return
+
+        logging.error(
+            "Task %s timed out after %g seconds, terminating pid %i" % (task.id, timeout, pid))
+
+        if not wait_for_exit([pid], timeout=self._kill_grace_period):
+            if self._signal(pid, task, signal.SIGKILL):
+                logging.error("Pid %i did not exit after SIGTERM, killing it" % (pid))
+
+                wait_for_exit([pid], timeout=self._kill_grace_period)
+
+        _fail_unfinished(
+            self._client, task, "Task timed out after %g seconds" % (timeout), self._result_ttl)
+
+    def _run(self):
+        while True:
+            pid, task, timeout = self._next_expired()
+
+            try:
+                self._expire(pid, task, timeout)
+            except Exception:
+                logging.exception("Error timing out task %s" % (task.id))
+
+
 class ForkingRunner(object):
-    def __init__(self, client, queue, task_callback):
+    # How often to check for forked tasks exiting, where they can't be
+    # waited on with pidfds.
+    poll_interval = 0.1
+
+    def __init__(
+            self, client, queue, task_callback, concurrency=1, max_tasks_per_child=None,
+            lease_timeout=None, timeout=None, kill_grace_period=10, drain_timeout=None,
+            handoff=False, result_ttl=None, metrics_port=None, metrics_addr="127.0.0.1",
+            dequeue_timeout=None, subscribe=False):
         super(ForkingRunner, self).__init__()
 
+        if metrics_port is not None and client.metrics is None:
+            raise ValueError("A metrics port requires a Client with metrics")
+
+        # Otherwise it would wait for the running tasks for ever, and
+        # never hand them off.
+        if handoff and drain_timeout is None:
+            raise ValueError("Handing off tasks requires a drain timeout")
+
         self._client = client
         self._queue = queue
         self._task_callback = task_callback
+        self._concurrency = concurrency
+        self._max_tasks_per_child = max_tasks_per_child
+        self._lease_timeout = lease_timeout
+        self._dequeue_timeout = dequeue_timeout
+        self._subscribe = subscribe
+        self._result_ttl = result_ttl
+        self._timeout = timeout
+        self._drain_timeout = drain_timeout
+        self._handoff = handoff
+        # Guards the running tasks and workers, which the watchdog
+        # thread checks before it signals any of them.
+        self._lock = threading.Lock()
+        self._children = {}
+        self._exit_times = {}
+        self._orphans = {}
+        self._workers = {}
+        self._watchdog = _Watchdog(
+            client, kill_grace_period, result_ttl, self._lock, self._is_running)
+        self._listener = None
+        self._stopping = False
+        self._wake_read_fd = None
+        self._wake_write_fd = None
+        self._previous_handlers = {}
+        self._previous_child_handler = None
+        self._metrics = client.metrics
+        self._metrics_port = metrics_port
+        self._metrics_addr = metrics_addr
+        self._metrics_server = None
+        self._metrics_fds = {}
 
-    def fork_task(self, task):
-        pid = os.fork()
+    def stop(self):
+        # Only sets flags, so that it is safe to call from a signal
+        # handler.
+        self._stopping = True
 
-        if pid > 0:
-            return pid
+        if self._listener is not None:
+            self._listener.stop()
 
-        logging.info("Process forked to run task %s" % (task.id))
+        # Wakes the main loop if it is waiting for a slot; interrupted
+        # system calls are otherwise retried once the handler returns.
+        self._wake(self._wake_write_fd)
+
+    def _wake(self, write_fd):
+        if write_fd is not None:
+            try:
+                os.write(write_fd, b"\0")
+            except OSError:
+                # Already woken, or no longer running.
+                pass
 
+    def _handle_signal(self, signum, frame):
+        self.stop()
+
+    def _install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self._previous_handlers[signum] = signal.signal(signum, self._handle_signal)
+
+    def _restore_signal_handlers(self):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+
+        self._previous_handlers = {}
+
+    def _handle_child_exit(self, signum, frame):
+        # Runs in the main loop's thread, between its own steps, so it
+        # only notes when each child exited, so that time spent waiting
+        # for a new task isn't counted as the task's, and wakes the
+        # main loop, or makes its listener return, to reap them.
+        now = time.time()
+
+        for pid in list(self._children):
+            if pid not in self._exit_times and child_exited(pid):
+                self._exit_times[pid] = now
+
+        if self._listener is not None:
+            self._listener.interrupt()
+
+        self._wake(self._wake_write_fd)
+
+    def _install_child_handler(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        self._previous_child_handler = signal.signal(signal.SIGCHLD, self._handle_child_exit)
+
+    def _restore_child_handler(self):
+        if self._previous_child_handler is not None:
+            signal.signal(signal.SIGCHLD, self._previous_child_handler)
+            self._previous_child_handler = None
+
+    def _init_child(self):
         # Reseed the random number generator, since we inherited it
         # from our parent after the fork
         random.seed()
 
+        # The watchdog terminates children with SIGTERM.
+        self._restore_signal_handlers()
+        self._restore_child_handler()
+
         os.setsid()
 
+        if self._metrics_server is not None:
+            self._metrics_server.server_close()
+
+        # Children send their metrics to this process, which exports
+        # them; they don't touch the collectors, whose locks may have
+        # been held by another thread when they were forked.
+        if self._metrics is not None:
+            self._metrics.start_recording()
+
+    def _send_metrics(self, fd):
+        try:
+            # Never block exiting on a full pipe; the parent only
+            # reads it once this process has exited.
+            os.set_blocking(fd, False)
+            os.write(fd, json.dumps(self._metrics.stop_recording()).encode())
+        except Exception:
+            logging.exception("Error sending metrics")
+
+    def _receive_metrics(self, fd):
+        data = b""
+
+        try:
+            # Anything the child started may still hold the pipe open,
+            # so only read what it has already sent.
+            os.set_blocking(fd, False)
+
+            while True:
+                chunk = os.read(fd, 65536)
+                if len(chunk) == 0:
+                    break
+
+                data += chunk
+        except BlockingIOError:
+            pass
+        finally:
+            os.close(fd)
+
+        self._replay_metrics(data)
+
+    def _replay_metrics(self, data):
+        if len(data) == 0:
+            return
+
+        try:
+            self._metrics.replay(json.loads(data))
+        except Exception:
+            logging.exception("Error replaying metrics")
+
+    def _exit_child(self):
+        # _exit won't flush, so we need to, in case there are
+        # error messages we want to see.
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        os._exit(0)
+
+    def _process_task(self, task):
         logging.info("Getting Processor to run task %s" % (task.id))
-        processor = self._client.get_processor(task)
+        processor = self._client.get_processor(
+            task, lease_timeout=self._lease_timeout, result_ttl=self._result_ttl)
 
         logging.info("Starting to run task %s" % (task.id))
         processor.start(os.getpid())
@@ -41,40 +344,549 @@ class ForkingRunner(object):
             processor.complete(result)
         except Exception as e:
             processor.fail(str(e))
+
+    def _watch(self, pid, task, started=None):
+        timeout = task.timeout if task.timeout is not None else self._timeout
+
+        if timeout is not None:
+            self._watchdog.watch(pid, task, timeout, started)
+
+    def _record_usage(self, task_id, cpu_user, cpu_system, max_rss, duration):
+        try:
+            self._client.get_queue(self._queue).record_usage(
+                task_id, cpu_user, cpu_system, max_rss, duration)
+        except Exception:
+            logging.exception("Error recording usage of task %s" % (task_id))
+
+    def fork_task(self, task):
+        if self._metrics is not None:
+            metrics_read_fd, metrics_write_fd = os.pipe()
+
+        pid = os.fork()
+
+        if pid > 0:
+            if self._metrics is not None:
+                os.close(metrics_write_fd)
+                self._metrics_fds[pid] = metrics_read_fd
+
+            return pid
+
+        if self._metrics is not None:
+            os.close(metrics_read_fd)
+
+        logging.info("Process forked to run task %s" % (task.id))
+
+        self._init_child()
+
+        try:
+            self._process_task(task)
         finally:
-            # _exit won't flush, so we need to, in case there are
-            # error messages we want to see.
-            logging.shutdown()
-            sys.stdout.flush()
-            sys.stderr.flush()
+            if self._metrics is not None:
+                self._send_metrics(metrics_write_fd)
+
+            self._exit_child()
+
+    def fork_worker(self):
+        task_read_fd, task_write_fd = os.pipe()
+        done_read_fd, done_write_fd = os.pipe()
+
+        pid = os.fork()
+
+        if pid > 0:
+            os.close(task_read_fd)
+            os.close(done_write_fd)
+
+            worker = _Worker(pid, task_write_fd, done_read_fd)
+
+            with self._lock:
+                self._workers[pid] = worker
+
+            logging.info("Forked worker %i" % (pid))
+
+            return worker
+
+        os.close(task_write_fd)
+        os.close(done_read_fd)
+
+        for worker in self._workers.values():
+            worker.close()
+
+        logging.info("Process forked to run up to %i tasks" % (self._max_tasks_per_child))
+
+        self._init_child()
+
+        try:
+            with os.fdopen(task_read_fd) as tasks:
+                for _ in range(self._max_tasks_per_child):
+                    task_id = tasks.readline().strip()
+                    if not task_id:
+                        break
+
+                    before = resource.getrusage(resource.RUSAGE_SELF)
+                    started = time.time()
+
+                    self._process_task(self._client.get_task(task_id))
+
+                    # The peak RSS is the worker's, across every task
+                    # it has run so far.
+                    after = resource.getrusage(resource.RUSAGE_SELF)
+                    self._record_usage(
+                        task_id, after.ru_utime - before.ru_utime,
+                        after.ru_stime - before.ru_stime, after.ru_maxrss, time.time() - started)
+
+                    message = task_id
+
+                    if self._metrics is not None:
+                        message += " " + json.dumps(self._metrics.stop_recording())
+                        self._metrics.start_recording()
+
+                    os.write(done_write_fd, (message + "\n").encode())
+        finally:
+            self._exit_child()
+
+    def _retire_worker(self, worker):
+        with self._lock:
+            del self._workers[worker.pid]
+
+        self._wait_for_worker(worker)
 
-            os._exit(0)
+    def _wait_for_worker(self, worker):
+        worker.close()
+
+        _, status = os.waitpid(worker.pid, 0)
+
+        logging.info("Worker %i exited with status %i" % (worker.pid, os.WEXITSTATUS(status)))
+
+    def _busy_workers(self):
+        return [worker for worker in self._workers.values() if worker.task is not None]
+
+    def _running(self):
+        # Must be called with the lock held.
+        return len(self._children) + len(self._orphans) + len(self._busy_workers())
+
+    def _readable(self, fd):
+        readable, _, _ = select.select([fd], [], [], 0)
+
+        return len(readable) > 0
+
+    def _is_running(self, pid, task_id):
+        # Must be called with the lock held. Tasks are only reaped by
+        # the main loop, so one which has finished while it waits for a
+        # new task is no longer running, though it is still listed.
+        if pid in self._children:
+            task, _, _ = self._children[pid]
+            finished = child_exited(pid)
+        elif pid in self._orphans:
+            task, _ = self._orphans[pid]
+            finished = not process_running(pid)
+        elif pid in self._workers:
+            worker = self._workers[pid]
+            task = worker.task
+            finished = task is not None and self._readable(worker.done_fd)
+        else:
+            return False
+
+        return task is not None and task.id == task_id and not finished
+
+    def _read_done_message(self, done_fd):
+        # Returns None if the worker exited before finishing its task.
+        message = b""
+
+        while not message.endswith(b"\n"):
+            data = os.read(done_fd, 65536)
+            if len(data) == 0:
+                return None
+
+            message += data
+
+        return message
+
+    def _clear_wake(self, read_fd):
+        try:
+            while len(os.read(read_fd, 512)) > 0:
+                pass
+        except BlockingIOError:
+            pass
+
+    def _wait(self, timeout=None):
+        # Returns once a running task may have finished, or the runner
+        # was stopped, or the timeout passed, having reaped whatever
+        # finished.
+        fds, polled = self._watched_fds()
+
+        if polled:
+            timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+
+        readable, _, _ = select.select([self._wake_read_fd] + fds, [], [], timeout)
+
+        if self._wake_read_fd in readable:
+            self._clear_wake(self._wake_read_fd)
+
+        self._reap()
+
+    def _get_idle_worker(self):
+        # Only called when there is a slot free, so either a worker is
+        # idle, or there are fewer workers than slots.
+        with self._lock:
+            for worker in self._workers.values():
+                if worker.task is None:
+                    return worker
+
+        return self.fork_worker()
+
+    def _send_task(self, worker, task):
+        # Returns whether the worker was still there to take the task.
+        try:
+            os.write(worker.task_fd, (task.id + "\n").encode())
+        except BrokenPipeError:
+            return False
+
+        # Only workers with a task are reaped, and the watchdog can't
+        # time out this one before it is watched, as it isn't running.
+        with self._lock:
+            worker.task = task
+            worker.tasks_run += 1
+
+            self._watch(worker.pid, task)
+
+        return True
 
     def _run_task(self, task):
-        pid = self.fork_task(task)
+        if self._max_tasks_per_child is not None:
+            while True:
+                worker = self._get_idle_worker()
 
-        logging.info("Forked task %s to pid %i" % (task.id, pid))
+                if self._send_task(worker, task):
+                    logging.info("Sent task %s to worker %i" % (task.id, worker.pid))
+                    break
 
-        _, status = os.waitpid(pid, 0)
+                logging.error("Worker %i exited while idle" % (worker.pid))
 
-        logging.info(
-            "Forked task %s exited with status %i" % (task.id, os.WEXITSTATUS(status)))
+                self._retire_worker(worker)
+        else:
+            pid = self.fork_task(task)
 
-    def run(self):
-        listener = self._client.get_listener(self._queue)
+            logging.info("Forked task %s to pid %i" % (task.id, pid))
+
+            pidfd = open_pidfd(pid)
+
+            with self._lock:
+                self._children[pid] = (task, time.time(), pidfd)
+
+                self._watch(pid, task)
+
+    def _adopt(self, task):
+        # Orphans which are still running use up a slot each, until
+        # they exit.
+        try:
+            pidfd = open_pidfd(task.pid)
+        except ProcessLookupError:
+            return
+
+        with self._lock:
+            self._orphans[task.pid] = (task, pidfd)
+
+            # Its old runner's watchdog is gone, so it is timed out
+            # here instead.
+            self._watch(task.pid, task, started=task.started)
+
+        logging.info("Waiting for orphaned task %s in pid %i" % (task.id, task.pid))
+
+    def _watched_fds(self):
+        # Returns the fds which become readable when a running task
+        # finishes, and whether any tasks have to be polled instead.
+        fds = []
+        polled = False
+
+        with self._lock:
+            pidfds = [pidfd for _, _, pidfd in self._children.values()]
+            pidfds.extend(pidfd for _, pidfd in self._orphans.values())
+
+            for pidfd in pidfds:
+                if pidfd is None:
+                    polled = True
+                else:
+                    fds.append(pidfd)
+
+            fds.extend(worker.done_fd for worker in self._busy_workers())
+
+        return fds, polled
+
+    def _reap_children(self):
+        reaped = []
+
+        with self._lock:
+            for pid, (task, forked, pidfd) in list(self._children.items()):
+                reaped_pid, status, usage = os.wait4(pid, os.WNOHANG)
+
+                if reaped_pid == 0:
+                    continue
+
+                del self._children[pid]
+
+                if pidfd is not None:
+                    os.close(pidfd)
+
+                self._watchdog.unwatch(pid, task.id)
+
+                exited = self._exit_times.pop(pid, time.time())
+
+                reaped.append(
+                    (task, status, usage, exited - forked, self._metrics_fds.pop(pid, None)))
+
+        for task, status, usage, duration, metrics_fd in reaped:
+            if metrics_fd is not None:
+                self._receive_metrics(metrics_fd)
+
+            logging.info(
+                "Forked task %s exited with status %i" % (task.id, os.WEXITSTATUS(status)))
+
+            self._record_usage(task.id, usage.ru_utime, usage.ru_stime, usage.ru_maxrss, duration)
+
+    def _reap_orphans(self):
+        # They aren't this process's children, so they can't be
+        # waited for, only seen to have exited.
+        with self._lock:
+            exited = [pid for pid in self._orphans if not process_running(pid)]
+
+            for pid in exited:
+                task, pidfd = self._orphans.pop(pid)
+                if pidfd is not None:
+                    os.close(pidfd)
+
+                self._watchdog.unwatch(pid, task.id)
+
+        for pid in exited:
+            logging.info("Orphaned task in pid %i exited" % (pid))
+
+    def _reap_workers(self, readable):
+        with self._lock:
+            finished = [worker for worker in self._busy_workers() if worker.done_fd in readable]
+
+        for worker in finished:
+            task = worker.task
+
+            message = self._read_done_message(worker.done_fd)
+            if message is None:
+                self._fail_exited_worker(worker)
+                continue
 
-        task = listener.claim_orphan()
+            logging.info("Worker %i finished task %s" % (worker.pid, task.id))
 
-        while task is not None:
-            if task.status == "reserved":
-                self._run_task(task)
-            elif task.status == "started":
-                while process_running(task.pid):
-                    time.sleep(0.1)
+            if self._metrics is not None:
+                self._replay_metrics(message.strip().partition(b" ")[2])
 
-            task = listener.claim_orphan()
+            retiring = worker.tasks_run >= self._max_tasks_per_child
 
+            # The watchdog checks which task it is running.
+            with self._lock:
+                self._watchdog.unwatch(worker.pid, task.id)
+                worker.task = None
+
+                if retiring:
+                    del self._workers[worker.pid]
+
+            if retiring:
+                self._wait_for_worker(worker)
+
+    def _fail_exited_worker(self, worker):
+        task = worker.task
+
+        with self._lock:
+            del self._workers[worker.pid]
+
+            # Once it is no longer running the task, the watchdog can't
+            # start timing it out.
+            timed_out = self._watchdog.unwatch(worker.pid, task.id)
+
+        logging.error("Worker %i exited while running task %s" % (worker.pid, task.id))
+
+        if not timed_out:
+            try:
+                _fail_unfinished(
+                    self._client, task, "Worker %i exited while running the task" % (worker.pid),
+                    self._result_ttl)
+            except Exception:
+                logging.exception("Error failing task %s" % (task.id))
+
+        self._wait_for_worker(worker)
+
+    def _reap(self):
+        # Reaps whatever has finished, without waiting. Only the main
+        # loop does, so that the runner has no thread of its own when
+        # it forks (unless it uses a watchdog, heartbeat or metrics
+        # server).
+        fds, _ = self._watched_fds()
+        readable, _, _ = select.select(fds, [], [], 0)
+
+        self._reap_children()
+        self._reap_orphans()
+        self._reap_workers(readable)
+
+    def _open_wake_pipe(self):
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+
+        return read_fd, write_fd
+
+    def _wait_for_slot(self, stoppable=True):
+        # Returns whether there is a slot free, which there may not be
+        # if the runner was stopped while waiting, when stoppable.
+        # Tasks may have finished while it waited for a new one.
+        self._reap()
+
+        while True:
+            with self._lock:
+                if self._running() < self._concurrency:
+                    return True
+
+            if stoppable and self._stopping:
+                return False
+
+            self._wait()
+
+    def _drain(self, timeout):
+        # Returns whether every running task finished before the
+        # timeout.
+        deadline = None if timeout is None else time.time() + timeout
+
+        self._reap()
+
+        while True:
+            with self._lock:
+                if self._running() == 0:
+                    break
+
+            if deadline is None:
+                self._wait()
+                continue
+
+            time_left = deadline - time.time()
+            if time_left <= 0:
+                return False
+
+            self._wait(time_left)
+
+        # Idle workers exit once their task pipe is closed.
+        with self._lock:
+            workers = list(self._workers.values())
+
+        for worker in workers:
+            self._retire_worker(worker)
+
+        return True
+
+    def _count_unstarted(self):
+        # Returns how many running tasks have been given to a process
+        # which has not started them yet.
+        with self._lock:
+            task_ids = [task.id for task, _, _ in self._children.values()]
+            task_ids.extend(worker.task.id for worker in self._busy_workers())
+
+        return len([
+            task_id for task_id in task_ids
+            if self._client.get_task(task_id).status == "reserved"
+        ])
+
+    def _wait_until_started(self):
+        # The runner which reclaims a handed off task runs it again if
+        # it is still reserved, so only hand off once each one has
+        # been started (or has finished).
         while True:
-            task = listener.listen()
+            unstarted = self._count_unstarted()
+            if unstarted == 0:
+                return
+
+            logging.info("Waiting for %i tasks to start before handing them off" % (unstarted))
+
+            self._wait(self.poll_interval)
+
+    def _shut_down(self, listener):
+        with self._lock:
+            running = self._running()
+
+        logging.info("Stopping, waiting for %i running tasks" % (running))
+
+        if self._drain(self._drain_timeout):
+            listener.remove()
+
+            logging.info("Stopped")
+        elif self._handoff:
+            self._wait_until_started()
+
+            # The next runner on this host adopts the running tasks'
+            # reservations, without waiting for this process to exit.
+            listener.hand_off()
+
+            logging.info("Stopped, handing off running tasks")
+        else:
+            logging.warning(
+                "Stopped with tasks still running, which will be reclaimed as orphans")
+
+    def _start_metrics_server(self):
+        if self._metrics_port is not None:
+            self._metrics_server = self._metrics.start_http_server(
+                self._metrics_port, self._metrics_addr)
+
+            logging.info(
+                "Serving metrics on %s:%i" % (self._metrics_addr, self._metrics_port))
+
+    def _stop_metrics_server(self):
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server.server_close()
+            self._metrics_server = None
+
+    def _run(self, listener):
+        self._install_signal_handlers()
+
+        try:
+            orphans = listener.reclaim_all()
+
+            for task in orphans:
+                if task.status == "reserved":
+                    # It is already reserved by this listener, so run
+                    # it even if the runner is stopped meanwhile.
+                    self._wait_for_slot(stoppable=False)
+                    self._run_task(task)
+
+            for task in orphans:
+                if task.status == "started":
+                    self._adopt(task)
+
+            while self._wait_for_slot() and not self._stopping:
+                task = listener.listen()
+                if task is not None:
+                    self._run_task(task)
+        finally:
+            # A second signal while draining stops the runner at once.
+            self._restore_signal_handlers()
+
+        self._shut_down(listener)
+
+    def run(self):
+        listener = self._client.get_listener(
+            self._queue, dequeue_timeout=self._dequeue_timeout, subscribe=self._subscribe,
+            lease_timeout=self._lease_timeout)
+        self._listener = listener
+
+        self._wake_read_fd, self._wake_write_fd = self._open_wake_pipe()
+
+        self._install_child_handler()
+        self._start_metrics_server()
+
+        try:
+            self._run(listener)
+        finally:
+            self._stop_metrics_server()
+
+            # Whatever has already finished.
+            self._reap()
+            self._restore_child_handler()
+
+            wake_read_fd, wake_write_fd = self._wake_read_fd, self._wake_write_fd
+            self._wake_read_fd = self._wake_write_fd = None
 
-            self._run_task(task)
+            os.close(wake_read_fd)
+            os.close(wake_write_fd)
@@ -0,0 +1,47 @@
+import logging
+import threading
+
+
+class Heartbeat(object):
+    def __init__(self, redis_queue, node_id, lease_timeout, register=False):
+        super(Heartbeat, self).__init__()
+
+        self._redis_queue = redis_queue
+        self._node_id = node_id
+        self._lease_timeout = lease_timeout
+        # Only the listener's own heartbeat registers it again if its
+        # lease was lost while it was running.
+        self._register = register
+
+        # Renew well before the lease expires, so that one slow or
+        # failed renewal does not lose it.
+        self._renew_interval = lease_timeout / 3.0
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _renew(self):
+        # Returns whether the lease is still held.
+        return self._redis_queue.renew_lease(self._node_id, self._lease_timeout, self._register)
+
+    def _run(self):
+        while not self._stopped.wait(self._renew_interval):
+            try:
+                if not self._renew():
+                    logging.warning(
+                        "Lease of %s was lost, no longer renewing it" % (self._node_id))
+                    return
+            except Exception:
+                logging.exception("Error renewing lease of %s" % (self._node_id))
+
+    def start(self):
+        self._renew()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join()
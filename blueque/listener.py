@@ -1,3 +1,4 @@
+from blueque.heartbeat import Heartbeat
 from blueque.process_helpers import process_running
 
 import os
@@ -6,50 +7,166 @@ import time
 
 
 class Listener(object):
-    def __init__(self, queue, task_factory):
+    # How long a subscribed listener without a dequeue_timeout waits
+    # for a notification before trying to dequeue a task again.
+    notification_timeout = 60
+    # How often a subscribed listener checks whether it was stopped
+    # while it waits for a notification.
+    stop_check_interval = 1
+
+    def __init__(
+            self, queue, task_factory, dequeue_timeout=None, subscribe=False, lease_timeout=None):
         super(Listener, self).__init__()
 
+        # BRPOPLPUSH blocks for ever with a timeout of 0, so stop()
+        # would never take effect.
+        if dequeue_timeout is not None and dequeue_timeout <= 0:
+            raise ValueError("A dequeue timeout must be greater than 0")
+
         self._hostname = socket.getfqdn()
         self._pid = os.getpid()
         self._name = "_".join((self._hostname, str(self._pid)))
         self._queue = queue
         self._queue.add_listener(self._name)
         self._task_factory = task_factory
+        self._dequeue_timeout = dequeue_timeout
+        self._subscribe = subscribe
+        self._orphans = []
+        self._stopped = False
+        self._interrupted = False
+
+        self._heartbeat = None
+        if lease_timeout is not None:
+            self._heartbeat = Heartbeat(self._queue, self._name, lease_timeout, register=True)
+            self._heartbeat.start()
 
     def _parse_name(self, name):
         host, pid = name.rsplit('_', 1)
 
         return host, int(pid)
 
+    def _listening(self):
+        return not self._stopped and not self._interrupted
+
+    def _wait_for_notification(self, subscription):
+        # Waits in slices, since stop() can't interrupt get_message.
+        deadline = time.time() + (self._dequeue_timeout or self.notification_timeout)
+
+        while self._listening():
+            time_left = deadline - time.time()
+            if time_left <= 0:
+                return
+
+            message = subscription.get_message(timeout=min(time_left, self.stop_check_interval))
+            if message is not None:
+                return
+
+    def _listen_subscribed(self):
+        task_id = self._queue.dequeue(self._name)
+        if task_id is not None:
+            return task_id
+
+        with self._queue.subscribe() as subscription:
+            while self._listening():
+                # Try again once subscribed, in case a task was
+                # enqueued before the subscription took effect.
+                task_id = self._queue.dequeue(self._name)
+                if task_id is not None:
+                    return task_id
+
+                self._wait_for_notification(subscription)
+
+        return None
+
     def listen(self):
-        while True:
-            task_id = self._queue.dequeue(self._name)
-            if task_id is not None:
-                return self._task_factory(task_id)
-            else:
-                time.sleep(1)
+        try:
+            if self._subscribe:
+                task_id = self._listen_subscribed()
+                return self._task_factory(task_id) if task_id is not None else None
 
-    def claim_orphan(self):
-        for listener in self._queue.get_listeners():
-            host, pid = self._parse_name(listener)
+            while self._listening():
+                task_id = self._queue.dequeue(self._name, timeout=self._dequeue_timeout)
+                if task_id is not None:
+                    return self._task_factory(task_id)
+                elif self._dequeue_timeout is None:
+                    time.sleep(1)
 
-            if host != self._hostname:
-                continue
+            return None
+        finally:
+            self._interrupted = False
+
+    def stop(self):
+        # Only sets a flag, so that it is safe to call from a signal
+        # handler; listen() returns None once its current attempt to
+        # dequeue a task has finished, or, when subscribed, within
+        # stop_check_interval.
+        self._stopped = True
+
+    def interrupt(self):
+        # Like stop(), but only the current (or next) call to listen()
+        # returns None, and the listener can be listened on again.
+        self._interrupted = True
+
+    def _stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._heartbeat.stop()
+            self._heartbeat = None
+
+    def remove(self):
+        self.stop()
+        self._stop_heartbeat()
+
+        self._queue.remove_listener(self._name)
+
+    def hand_off(self):
+        # Tasks which are still running keep the lease alive with
+        # their own heartbeats.
+        self.stop()
+        self._stop_heartbeat()
+
+        self._queue.hand_off(self._name)
+
+    def _get_orphaned_listeners(self):
+        handed_off = self._queue.get_handed_off_listeners(self._hostname)
+
+        for listener in self._queue.get_host_listeners(self._hostname):
+            _, pid = self._parse_name(listener)
 
             if pid == self._pid:
                 continue
 
-            if process_running(pid):
+            # A listener which has handed off its tasks may still be
+            # exiting.
+            if listener not in handed_off and process_running(pid):
                 continue
 
+            yield listener
+
+    def claim_orphan(self):
+        if len(self._orphans) > 0:
+            return self._task_factory(self._orphans.pop(0))
+
+        for listener in self._get_orphaned_listeners():
             if self._queue.remove_listener(listener) == 0:
                 # already claimed
                 continue
 
-            task_id = self._queue.reclaim_task(listener, self._name)
-            if task_id is None:
+            # A listener may have had several tasks reserved, if it
+            # was running them concurrently.
+            self._orphans = self._queue.reclaim_tasks(listener, self._name)
+            if len(self._orphans) == 0:
                 continue
 
-            return self._task_factory(task_id)
+            return self._task_factory(self._orphans.pop(0))
 
         return None
+
+    def reclaim_all(self):
+        task_ids = self._orphans
+        self._orphans = []
+
+        orphaned_listeners = list(self._get_orphaned_listeners())
+        if len(orphaned_listeners) > 0:
+            task_ids = task_ids + self._queue.reclaim_listeners(orphaned_listeners, self._name)
+
+        return [self._task_factory(task_id) for task_id in task_ids]
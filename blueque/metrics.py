@@ -0,0 +1,97 @@
+import prometheus_client
+
+import logging
+
+
+class Metrics(object):
+    # Redis operations usually take well under a millisecond, while
+    # tasks may wait, and run, for hours.
+    operation_buckets = (
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    task_buckets = (
+        0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+
+    # Observations recorded by a forked process are sent back to its
+    # parent over a pipe, so there is a limit to how many are kept.
+    max_recorded = 500
+
+    def __init__(self, registry=None):
+        super(Metrics, self).__init__()
+
+        if registry is None:
+            registry = prometheus_client.CollectorRegistry()
+
+        self.registry = registry
+
+        self._operation_duration = prometheus_client.Histogram(
+            "blueque_operation_duration_seconds", "Time taken by Blueque operations on Redis",
+            ["queue", "operation"], buckets=self.operation_buckets, registry=registry)
+        self._round_trips = prometheus_client.Counter(
+            "blueque_redis_round_trips", "Round trips to Redis made by Blueque operations",
+            ["queue", "operation"], registry=registry)
+        self._queue_wait = prometheus_client.Histogram(
+            "blueque_task_queue_wait_seconds",
+            "Time from a task being created, or becoming due, to being reserved",
+            ["queue"], buckets=self.task_buckets, registry=registry)
+        self._start_delay = prometheus_client.Histogram(
+            "blueque_task_start_delay_seconds",
+            "Time from a task being reserved to being started, e.g. forking",
+            ["queue"], buckets=self.task_buckets, registry=registry)
+        self._run_time = prometheus_client.Histogram(
+            "blueque_task_run_seconds", "Time from a task being started to finishing",
+            ["queue", "status"], buckets=self.task_buckets, registry=registry)
+
+        self._recorded = None
+        self._dropped = 0
+
+    def _observe(self, kind, *args):
+        if self._recorded is None:
+            getattr(self, "_apply_" + kind)(*args)
+        elif len(self._recorded) < self.max_recorded:
+            self._recorded.append([kind] + list(args))
+        else:
+            self._dropped += 1
+
+    def _apply_operation(self, queue, operation, duration, round_trips):
+        self._operation_duration.labels(queue, operation).observe(duration)
+        self._round_trips.labels(queue, operation).inc(round_trips)
+
+    def _apply_task_start(self, queue, waiting_since, reserved, started):
+        self._queue_wait.labels(queue).observe(max(0.0, reserved - waiting_since))
+        self._start_delay.labels(queue).observe(max(0.0, started - reserved))
+
+    def _apply_task_run(self, queue, status, duration):
+        self._run_time.labels(queue, status).observe(duration)
+
+    def observe_operation(self, queue, operation, duration, round_trips):
+        self._observe("operation", queue, operation, duration, round_trips)
+
+    def observe_task_start(self, queue, waiting_since, reserved, started):
+        self._observe("task_start", queue, waiting_since, reserved, started)
+
+    def observe_task_run(self, queue, status, duration):
+        self._observe("task_run", queue, status, duration)
+
+    def start_recording(self):
+        # Until stop_recording is called, observations are kept, to be
+        # replayed in another process, rather than applied here.
+        self._recorded = []
+        self._dropped = 0
+
+    def stop_recording(self):
+        recorded = self._recorded
+        self._recorded = None
+
+        if self._dropped > 0:
+            logging.warning("Dropped %i metrics observations" % (self._dropped))
+
+        return recorded
+
+    def replay(self, observations):
+        for kind, *args in observations:
+            getattr(self, "_apply_" + kind)(*args)
+
+    def start_http_server(self, port, addr="127.0.0.1"):
+        server, _ = prometheus_client.start_http_server(port, addr, registry=self.registry)
+
+        return server
@@ -1,4 +1,7 @@
+import errno
 import os
+import select
+import time
 
 
 def process_running(pid):
@@ -7,3 +10,98 @@ def process_running(pid):
         return True
     except OSError:
         return False
+
+
+def child_exited(pid):
+    # Returns whether a child process has exited, without reaping it.
+    # Where that can't be told (e.g. on macOS before Python 3.13), or
+    # it isn't a child of this process, it is taken to be running.
+    if not hasattr(os, "waitid"):
+        return False
+
+    try:
+        return os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+    except ChildProcessError:
+        return False
+
+
+def open_pidfd(pid):
+    # A pidfd becomes readable once its process exits. Returns None
+    # where pidfds aren't supported, i.e. on kernels older than 5.3.
+    if not hasattr(os, "pidfd_open"):
+        return None
+
+    try:
+        return os.pidfd_open(pid)
+    except OSError as e:
+        if e.errno not in (errno.ENOSYS, errno.EPERM, errno.EINVAL):
+            raise
+
+        return None
+
+
+def _wait_for_pidfds(pids, deadline):
+    # Returns the PIDs which could not be waited on with a pidfd, and
+    # any still running at the deadline.
+    pidfds = {}
+    unwaitable = set()
+
+    try:
+        for pid in pids:
+            try:
+                pidfd = open_pidfd(pid)
+            except ProcessLookupError:
+                continue
+
+            if pidfd is None:
+                unwaitable.add(pid)
+            else:
+                pidfds[pidfd] = pid
+
+        poller = select.poll()
+        for pidfd in pidfds:
+            poller.register(pidfd, select.POLLIN)
+
+        while len(pidfds) > 0:
+            if deadline is None:
+                events = poller.poll()
+            else:
+                events = poller.poll(max(0, int((deadline - time.time()) * 1000)))
+
+                if len(events) == 0:
+                    unwaitable.update(pidfds.values())
+                    break
+
+            for pidfd, _ in events:
+                poller.unregister(pidfd)
+                os.close(pidfd)
+                del pidfds[pidfd]
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+
+    return unwaitable
+
+
+def wait_for_exit(pids, poll_interval=0.1, timeout=None):
+    deadline = None if timeout is None else time.time() + timeout
+
+    remaining = set(pids)
+
+    if hasattr(os, "pidfd_open"):
+        remaining = _wait_for_pidfds(remaining, deadline)
+
+    while True:
+        remaining = set(pid for pid in remaining if process_running(pid))
+        if len(remaining) == 0:
+            return True
+
+        if deadline is None:
+            time.sleep(poll_interval)
+            continue
+
+        time_left = deadline - time.time()
+        if time_left <= 0:
+            return False
+
+        time.sleep(min(poll_interval, time_left))
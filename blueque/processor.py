@@ -1,18 +1,64 @@
+from blueque.heartbeat import Heartbeat
+
+import time
+
+
 class Processor(object):
-    def __init__(self, task, redis_queue):
+    def __init__(self, task, redis_queue, lease_timeout=None, result_ttl=None, metrics=None):
         super(Processor, self).__init__()
 
         self._listener_id = task.node
         self._task_id = task.id
         self._pid = task.pid
         self._redis_queue = redis_queue
+        self._lease_timeout = lease_timeout
+        self._result_ttl = result_ttl
+        self._heartbeat = None
+        self._metrics = metrics
+        self._started = None
+
+        if metrics is not None:
+            self._queue_name = task.queue
+            self._reserved = task.updated if task.status == "reserved" else None
+            # Scheduled tasks only start waiting once they are due.
+            self._waiting_since = max(task.created or 0, task.eta or 0)
+
+    def _observe_start(self):
+        if self._metrics is not None:
+            self._started = time.time()
+
+            if self._reserved is not None:
+                self._metrics.observe_task_start(
+                    self._queue_name, self._waiting_since, self._reserved, self._started)
+
+    def _observe_finish(self, status):
+        if self._started is not None:
+            self._metrics.observe_task_run(self._queue_name, status, time.time() - self._started)
+
+    def _stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._heartbeat.stop()
+            self._heartbeat = None
 
     def start(self, pid):
         self._pid = pid
         self._redis_queue.start(self._task_id, self._listener_id, self._pid)
+        self._observe_start()
+
+        # Keep the listener's lease alive while the task runs, even if
+        # the listener's own process is busy, or has gone away.
+        if self._lease_timeout is not None:
+            self._heartbeat = Heartbeat(self._redis_queue, self._listener_id, self._lease_timeout)
+            self._heartbeat.start()
 
     def complete(self, result):
-        self._redis_queue.complete(self._task_id, self._listener_id, self._pid, result)
+        self._stop_heartbeat()
+        self._redis_queue.complete(
+            self._task_id, self._listener_id, self._pid, result, self._result_ttl)
+        self._observe_finish("complete")
 
     def fail(self, error):
-        self._redis_queue.fail(self._task_id, self._listener_id, self._pid, error)
+        self._stop_heartbeat()
+        self._redis_queue.fail(
+            self._task_id, self._listener_id, self._pid, error, self._result_ttl)
+        self._observe_finish("failed")
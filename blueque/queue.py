@@ -5,17 +5,47 @@ class Queue(object):
         self._name = name
         self._redis_queue = redis_queue
 
-    def enqueue(self, parameters):
-        return self._redis_queue.enqueue(parameters)
+    def enqueue(self, parameters, timeout=None):
+        return self._redis_queue.enqueue(parameters, timeout)
 
-    def schedule(self, parameters, eta):
-        return self._redis_queue.schedule(parameters, eta)
+    def enqueue_many(self, parameters_list, chunk_size=1000, timeout=None):
+        return self._redis_queue.enqueue_many(parameters_list, chunk_size, timeout)
 
-    def enqueue_due_tasks(self):
-        self._redis_queue.enqueue_due_tasks()
+    def schedule(self, parameters, eta, timeout=None):
+        return self._redis_queue.schedule(parameters, eta, timeout)
+
+    def schedule_many(self, scheduled_tasks, chunk_size=1000, timeout=None):
+        return self._redis_queue.schedule_many(scheduled_tasks, chunk_size, timeout)
+
+    def enqueue_due_tasks(self, limit=1000):
+        return self._redis_queue.enqueue_due_tasks(limit)
+
+    def record_usage(self, task_id, cpu_user, cpu_system, max_rss, duration):
+        return self._redis_queue.record_usage(task_id, cpu_user, cpu_system, max_rss, duration)
+
+    def get_usage(self):
+        return self._redis_queue.get_usage()
+
+    def stats(self):
+        return self._redis_queue.get_stats()
+
+    def recover_expired_leases(self):
+        return self._redis_queue.recover_expired_leases()
 
     def delete_task(self, task):
         if task.queue != self._name:
             raise ValueError("Task %s is not in queue %s" % (task.id, self._name))
 
         self._redis_queue.delete_task(task.id, task.status)
+
+    def purge_finished(self, older_than, batch_size=1000):
+        return self._redis_queue.purge_finished(older_than, batch_size)
+
+    def get_finished(self, task_status, start="-inf", end="+inf", limit=None):
+        return self._redis_queue.get_finished(task_status, start, end, limit)
+
+    def migrate_finished(self, batch_size=1000):
+        return self._redis_queue.migrate_finished(batch_size)
+
+    def index_host_listeners(self, batch_size=1000):
+        return self._redis_queue.index_host_listeners(batch_size)
@@ -1,36 +1,85 @@
+from blueque import redis_scripts
 from blueque.redis_task import RedisTask
 
+import itertools
 import logging
 import time
 import uuid
 
 
 class RedisQueue(object):
-    def __init__(self, name, redis_client):
+    # The event stream is trimmed to about this many events.
+    max_events = 10000
+
+    def __init__(self, name, redis_client, metrics=None):
         super(RedisQueue, self).__init__()
 
         self._name = name
         self._pending_name = self._key("pending_tasks", self._name)
         self._scheduled_key = self._key("scheduled_tasks", self._name)
+        self._channel_name = self._key("task_channel", self._name)
 
         self._queues_key = self._key("queues")
+        self._schedule_channel_name = self._key("schedule_channel")
         self._started_key = self._key("started_tasks", self._name)
         self._listeners_key = self._key("listeners", self._name)
+        self._leased_key = self._key("leased_listeners", self._name)
 
-        self._complete_key = self._key("complete_tasks", self._name)
-        self._failed_key = self._key("failed_tasks", self._name)
+        self._complete_key = self._key("complete_tasks_by_time", self._name)
+        self._failed_key = self._key("failed_tasks_by_time", self._name)
+        # Finished tasks used to be kept in lists, which
+        # migrate_finished moves into the sorted sets above.
+        self._complete_list_key = self._key("complete_tasks", self._name)
+        self._failed_list_key = self._key("failed_tasks", self._name)
+        self._events_key = self.events_key(self._name)
+        self._usage_key = self._key("usage", self._name)
 
         self._redis = redis_client
+        self._metrics = metrics
+
+        self._task_key_prefix = RedisTask.task_key("")
+
+        self._dequeue_script = self._redis.register_script(redis_scripts.DEQUEUE)
+        self._start_script = self._redis.register_script(redis_scripts.START)
+        self._finish_script = self._redis.register_script(redis_scripts.FINISH)
+        self._enqueue_due_script = self._redis.register_script(redis_scripts.ENQUEUE_DUE)
+        self._remove_listener_script = self._redis.register_script(redis_scripts.REMOVE_LISTENER)
+        self._renew_lease_script = self._redis.register_script(redis_scripts.RENEW_LEASE)
+        self._reclaim_tasks_script = self._redis.register_script(redis_scripts.RECLAIM_TASKS)
+        self._reclaim_listeners_script = self._redis.register_script(
+            redis_scripts.RECLAIM_LISTENERS)
+        self._index_host_listeners_script = self._redis.register_script(
+            redis_scripts.INDEX_HOST_LISTENERS)
+        self._record_usage_script = self._redis.register_script(redis_scripts.RECORD_USAGE)
+        self._purge_finished_script = self._redis.register_script(redis_scripts.PURGE_FINISHED)
+        self._migrate_finished_script = self._redis.register_script(
+            redis_scripts.MIGRATE_FINISHED)
+        self._recover_expired_leases_script = self._redis.register_script(
+            redis_scripts.RECOVER_EXPIRED_LEASES)
 
     def _running_job(self, node_id, pid, task_id):
         return " ".join((node_id, str(pid), task_id))
 
-    def _key(self, *args):
+    @staticmethod
+    def _key(*args):
         return '_'.join(("blueque",) + args)
 
+    @staticmethod
+    def events_key(queue_name):
+        return RedisQueue._key("events", queue_name)
+
     def _reserved_key(self, node_id):
         return self._key("reserved_tasks", self._name, node_id)
 
+    def _heartbeat_key(self, node_id):
+        return self._key("heartbeat", self._name, node_id)
+
+    def _host_listeners_key(self, host):
+        return self._key("host_listeners", self._name, host)
+
+    def _handed_off_key(self, host):
+        return self._key("handed_off_listeners", self._name, host)
+
     def _generate_task_id(self):
         return str(uuid.uuid4())
 
@@ -40,28 +89,159 @@ class RedisQueue(object):
     def _debug(self, message):
         logging.debug("Blueque queue %s: %s" % (self._name, message))
 
-    def add_listener(self, node_id):
+    def _observe(self, operation, started, round_trips=1):
+        if self._metrics is not None:
+            self._metrics.observe_operation(
+                self._name, operation, time.perf_counter() - started, round_trips)
+
+    def _add_listener(self, pipeline, node_id):
         self._log("adding listener %s" % (node_id))
+
+        pipeline.sadd(self._listeners_key, node_id)
+        pipeline.sadd(self._host_listeners_key(node_id.rsplit("_", 1)[0]), node_id)
+        pipeline.zincrby(self._queues_key, 1, self._name)
+
+    def add_listener(self, node_id):
         with self._redis.pipeline() as pipeline:
-            pipeline.sadd(self._listeners_key, node_id)
-            pipeline.zincrby(self._queues_key, 1, self._name)
+            self._add_listener(pipeline, node_id)
             pipeline.execute()
 
-    def remove_listener(self, node_id):
+    def _remove_listener(self, node_id):
         self._log("removing listener %s" % (node_id))
 
-        removed = self._redis.srem(self._listeners_key, node_id)
+        return self._remove_listener_script(
+            keys=[
+                self._listeners_key,
+                self._host_listeners_key(node_id.rsplit("_", 1)[0]),
+                self._queues_key,
+                self._handed_off_key(node_id.rsplit("_", 1)[0])
+            ],
+            args=[node_id, self._name])
+
+    def remove_listener(self, node_id):
+        removed = self._remove_listener(node_id)
 
         if removed > 0:
             self._log("removed listener")
-            self._redis.zincrby(self._queues_key, -1, self._name)
 
         return removed
 
     def get_listeners(self):
         return self._redis.smembers(self._listeners_key)
 
-    def _generate_task(self, pipeline, status, parameters, **kwargs):
+    def get_host_listeners(self, host):
+        return self._redis.smembers(self._host_listeners_key(host))
+
+    def _index_host_listeners(self, batch):
+        return self._index_host_listeners_script(
+            keys=[self._listeners_key], args=[self._host_listeners_key("")] + batch)
+
+    def index_host_listeners(self, batch_size):
+        indexed = 0
+
+        listeners = self._redis.sscan_iter(self._listeners_key, count=batch_size)
+
+        for batch in self._chunks(listeners, batch_size):
+            indexed += self._index_host_listeners(batch)
+
+        self._log("indexed %i listeners by host" % (indexed))
+
+        return indexed
+
+    def hand_off(self, node_id):
+        self._log("handing off listener %s" % (node_id))
+
+        return self._redis.sadd(self._handed_off_key(node_id.rsplit("_", 1)[0]), node_id)
+
+    def get_handed_off_listeners(self, host):
+        return self._redis.smembers(self._handed_off_key(host))
+
+    def _renew_lease(self, node_id, lease_timeout, register):
+        self._debug("renewing lease of %s" % (node_id))
+
+        return self._renew_lease_script(
+            keys=[
+                self._listeners_key,
+                self._host_listeners_key(node_id.rsplit("_", 1)[0]),
+                self._queues_key,
+                self._heartbeat_key(node_id),
+                self._leased_key
+            ],
+            args=[
+                node_id,
+                self._name,
+                time.time(),
+                int(lease_timeout * 1000),
+                1 if register else 0
+            ])
+
+    def _log_renewed(self, node_id, renewed):
+        if renewed == 0:
+            self._log("lease of %s was lost" % (node_id))
+        elif renewed == 2:
+            self._log("listener %s lost its lease, and registered again" % (node_id))
+
+    def renew_lease(self, node_id, lease_timeout, register=False):
+        # Returns whether the lease is still held.
+        renewed = self._renew_lease(node_id, lease_timeout, register)
+
+        self._log_renewed(node_id, renewed)
+
+        return renewed > 0
+
+    def _recover_expired_leases(self):
+        return self._recover_expired_leases_script(
+            keys=[
+                self._leased_key,
+                self._listeners_key,
+                self._queues_key,
+                self._pending_name,
+                self._started_key,
+                self._events_key
+            ],
+            args=[
+                self._heartbeat_key(""),
+                self._reserved_key(""),
+                self._task_key_prefix,
+                time.time(),
+                self._name,
+                self._channel_name,
+                self.max_events,
+                self._host_listeners_key(""),
+                self._handed_off_key("")
+            ])
+
+    def _log_recovered(self, task_ids):
+        if len(task_ids) > 0:
+            self._log("recovered tasks with expired leases: %s" % (task_ids))
+
+    def recover_expired_leases(self):
+        task_ids = self._recover_expired_leases()
+
+        self._log_recovered(task_ids)
+
+        return task_ids
+
+    def subscribe(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel_name)
+
+        return pubsub
+
+    def _notify_listeners(self, pipeline):
+        pipeline.publish(self._channel_name, self._name)
+
+    def _notify_scheduler(self, pipeline):
+        pipeline.publish(self._schedule_channel_name, self._name)
+
+    def _add_event(self, pipeline, event, task_id, **fields):
+        event_data = {"event": event, "task": task_id, "time": time.time()}
+        event_data.update(fields)
+
+        pipeline.xadd(
+            self._events_key, event_data, maxlen=self.max_events, approximate=True)
+
+    def _generate_task(self, pipeline, status, parameters, timeout=None, **kwargs):
         task_id = self._generate_task_id()
 
         self._log("adding %s task %s, parameters: %s" % (status, task_id, parameters))
@@ -78,69 +258,186 @@ class RedisQueue(object):
 
         task_data.update(kwargs)
 
+        if timeout is not None:
+            task_data["timeout"] = timeout
+
         pipeline.hset(RedisTask.task_key(task_id), mapping=task_data)
 
-        pipeline.zincrby(self._key("queues"), 0, self._name)
+        self._add_event(pipeline, "scheduled" if status == "scheduled" else "enqueued", task_id)
 
         return task_id
 
-    def schedule(self, parameters, eta):
-        if eta < time.time():
-            return self.enqueue(parameters)
+    def _touch_queue(self, pipeline):
+        pipeline.zincrby(self._queues_key, 0, self._name)
 
-        with self._redis.pipeline() as pipeline:
-            task_id = self._generate_task(pipeline, "scheduled", parameters, eta=eta)
+    def _chunks(self, items, chunk_size):
+        items = iter(items)
 
-            pipeline.zadd(self._scheduled_key, {task_id: eta})
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if len(chunk) == 0:
+                return
 
-            pipeline.execute()
+            yield chunk
+
+    # The methods which build up a pipeline, or make a single call,
+    # are shared with AsyncRedisQueue, which only has to await them.
+
+    def _schedule(self, pipeline, parameters, eta, timeout):
+        task_id = self._generate_task(pipeline, "scheduled", parameters, timeout, eta=eta)
+        self._touch_queue(pipeline)
+
+        pipeline.zadd(self._scheduled_key, {task_id: eta})
+
+        self._notify_scheduler(pipeline)
 
         return task_id
 
-    def enqueue(self, parameters):
+    def schedule(self, parameters, eta, timeout=None):
+        if eta < time.time():
+            return self.enqueue(parameters, timeout)
+
         with self._redis.pipeline() as pipeline:
-            task_id = self._generate_task(pipeline, "pending", parameters)
+            task_id = self._schedule(pipeline, parameters, eta, timeout)
+            pipeline.execute()
+
+        return task_id
+
+    def _schedule_chunk(self, pipeline, chunk, timeout):
+        now = time.time()
+
+        chunk_ids = []
+        pending_ids = []
+        scheduled_etas = {}
+
+        for parameters, eta in chunk:
+            if eta < now:
+                task_id = self._generate_task(pipeline, "pending", parameters, timeout)
+                pending_ids.append(task_id)
+            else:
+                task_id = self._generate_task(
+                    pipeline, "scheduled", parameters, timeout, eta=eta)
+                scheduled_etas[task_id] = eta
+
+            chunk_ids.append(task_id)
+
+        self._touch_queue(pipeline)
+
+        if len(pending_ids) > 0:
+            pipeline.lpush(self._pending_name, *pending_ids)
+            self._notify_listeners(pipeline)
+
+        if len(scheduled_etas) > 0:
+            pipeline.zadd(self._scheduled_key, scheduled_etas)
+            self._notify_scheduler(pipeline)
 
-            pipeline.lpush(self._pending_name, task_id)
+        return chunk_ids
 
+    def schedule_many(self, scheduled_tasks, chunk_size, timeout=None):
+        task_ids = []
+
+        for chunk in self._chunks(scheduled_tasks, chunk_size):
+            with self._redis.pipeline() as pipeline:
+                task_ids.extend(self._schedule_chunk(pipeline, chunk, timeout))
+                pipeline.execute()
+
+        return task_ids
+
+    def _enqueue(self, pipeline, parameters, timeout):
+        task_id = self._generate_task(pipeline, "pending", parameters, timeout)
+        self._touch_queue(pipeline)
+
+        pipeline.lpush(self._pending_name, task_id)
+
+        self._notify_listeners(pipeline)
+
+        return task_id
+
+    def enqueue(self, parameters, timeout=None):
+        started = time.perf_counter()
+
+        with self._redis.pipeline() as pipeline:
+            task_id = self._enqueue(pipeline, parameters, timeout)
             pipeline.execute()
 
+        self._observe("enqueue", started)
+
         return task_id
 
-    def enqueue_due_tasks(self):
-        def enqueue_transaction(pipeline):
-            now = time.time()
-            due_tasks = pipeline.zrangebyscore(self._scheduled_key, 0, now)
+    def _enqueue_chunk(self, pipeline, chunk, timeout):
+        chunk_ids = [
+            self._generate_task(pipeline, "pending", parameters, timeout) for parameters in chunk
+        ]
+        self._touch_queue(pipeline)
 
-            if len(due_tasks) == 0:
-                self._debug("no due tasks")
-                return
+        pipeline.lpush(self._pending_name, *chunk_ids)
+
+        self._notify_listeners(pipeline)
+
+        return chunk_ids
+
+    def enqueue_many(self, parameters_list, chunk_size, timeout=None):
+        started = time.perf_counter()
+        task_ids = []
+        round_trips = 0
+
+        for chunk in self._chunks(parameters_list, chunk_size):
+            with self._redis.pipeline() as pipeline:
+                task_ids.extend(self._enqueue_chunk(pipeline, chunk, timeout))
+                pipeline.execute()
+
+            round_trips += 1
+
+        self._observe("enqueue_many", started, round_trips)
 
-            self._log("enqueuing due tasks: %s" % (due_tasks))
+        return task_ids
 
-            pipeline.multi()
+    def _enqueue_due(self, limit):
+        return self._enqueue_due_script(
+            keys=[self._scheduled_key, self._pending_name, self._events_key],
+            args=[
+                self._task_key_prefix,
+                time.time(),
+                limit,
+                self._channel_name,
+                self._name,
+                self.max_events
+            ])
 
-            pipeline.zremrangebyscore(self._scheduled_key, 0, now)
+    def _log_due_tasks(self, due_tasks, remaining):
+        if len(due_tasks) == 0:
+            self._debug("no due tasks")
+        else:
+            self._log("enqueued due tasks: %s, %i still due" % (due_tasks, remaining))
+
+    def enqueue_due_tasks(self, limit):
+        started = time.perf_counter()
+
+        due_tasks, remaining = self._enqueue_due(limit)
 
-            for task in due_tasks:
-                pipeline.lpush(self._pending_name, task)
-                pipeline.hset(
-                    RedisTask.task_key(task), mapping={"status": "pending", "updated": now})
+        self._observe("enqueue_due_tasks", started)
 
-        self._redis.transaction(enqueue_transaction, self._scheduled_key)
+        self._log_due_tasks(due_tasks, remaining)
 
-    def dequeue(self, node_id):
+        return remaining
+
+    def _reserve(self, node_id):
         self._debug("reserving task on %s" % (node_id))
 
-        task_id = self._redis.rpoplpush(
-            self._pending_name, self._reserved_key(node_id))
+        return self._dequeue_script(
+            keys=[self._pending_name, self._reserved_key(node_id), self._events_key],
+            args=[self._task_key_prefix, node_id, time.time(), self.max_events])
 
-        if task_id is None:
-            return None
+    # Blocking commands do not block inside scripts, so the blocking
+    # pop and the status update are separate calls.
 
-        self._log("got task %s" % (task_id))
+    def _blocking_reserve(self, node_id, timeout):
+        self._debug("reserving task on %s" % (node_id))
 
-        self._redis.hset(
+        return self._redis.brpoplpush(self._pending_name, self._reserved_key(node_id), timeout)
+
+    def _mark_reserved(self, pipeline, task_id, node_id):
+        pipeline.hset(
             RedisTask.task_key(task_id),
             mapping={
                 "status": "reserved",
@@ -148,77 +445,322 @@ class RedisQueue(object):
                 "updated": time.time()
             })
 
+        self._add_event(pipeline, "reserved", task_id, node=node_id)
+
+    def dequeue(self, node_id, timeout=None):
+        started = time.perf_counter()
+        round_trips = 1
+
+        if timeout is None:
+            task_id = self._reserve(node_id)
+        else:
+            task_id = self._blocking_reserve(node_id, timeout)
+
+            if task_id is not None:
+                with self._redis.pipeline() as pipeline:
+                    self._mark_reserved(pipeline, task_id, node_id)
+                    pipeline.execute()
+
+                round_trips += 1
+
+        self._observe("dequeue", started, round_trips)
+
+        if task_id is None:
+            return None
+
+        self._log("got task %s" % (task_id))
+
         return task_id
 
-    def start(self, task_id, node_id, pid):
+    def _start(self, task_id, node_id, pid):
         self._log("starting task %s on %s, pid %i" % (task_id, node_id, pid))
-        with self._redis.pipeline() as pipeline:
-            pipeline.sadd(self._started_key, self._running_job(node_id, pid, task_id))
-            pipeline.hset(
-                RedisTask.task_key(task_id),
-                mapping={"status": "started", "pid": pid, "updated": time.time()})
 
-            pipeline.execute()
+        return self._start_script(
+            keys=[self._started_key, RedisTask.task_key(task_id), self._events_key],
+            args=[
+                self._running_job(node_id, pid, task_id),
+                pid,
+                time.time(),
+                task_id,
+                node_id,
+                self.max_events
+            ])
 
-    def reclaim_task(self, old_node, new_node):
-        task_id = self._redis.lindex(self._reserved_key(old_node), 0)
+    def start(self, task_id, node_id, pid):
+        started = time.perf_counter()
 
-        if task_id is not None:
-            self._redis.hset(RedisTask.task_key(task_id), "reclaimed_node", new_node)
+        result = self._start(task_id, node_id, pid)
 
-        return task_id
+        self._observe("start", started)
 
-    def complete(self, task_id, node_id, pid, result):
-        self._log(
-            "completing task %s on %s, pid: %i, result: %s" % (task_id, node_id, pid, result))
+        return result
 
-        with self._redis.pipeline() as pipeline:
-            pipeline.lrem(self._reserved_key(node_id), 1, task_id)
-            pipeline.srem(self._started_key, self._running_job(node_id, pid, task_id))
+    def _reclaim_tasks(self, old_node, new_node, limit):
+        self._log("reclaiming tasks of %s on %s" % (old_node, new_node))
+
+        return self._reclaim_tasks_script(
+            keys=[self._reserved_key(old_node), self._started_key, self._events_key],
+            args=[
+                old_node,
+                new_node,
+                self._reserved_key(""),
+                self._task_key_prefix,
+                time.time(),
+                self.max_events,
+                limit
+            ])
 
-            pipeline.hset(
+    def reclaim_task(self, old_node, new_node):
+        task_ids = self._reclaim_tasks(old_node, new_node, 1)
+
+        return task_ids[0] if len(task_ids) > 0 else None
+
+    def reclaim_tasks(self, old_node, new_node):
+        return self._reclaim_tasks(old_node, new_node, 0)
+
+    def _reclaim_listeners(self, old_nodes, new_node):
+        self._log("reclaiming tasks of %s on %s" % (old_nodes, new_node))
+
+        return self._reclaim_listeners_script(
+            keys=[self._listeners_key, self._queues_key, self._events_key, self._started_key],
+            args=[
+                new_node,
+                self._host_listeners_key(""),
+                self._reserved_key(""),
+                self._task_key_prefix,
+                time.time(),
+                self._name,
+                self.max_events,
+                self._handed_off_key("")
+            ] + list(old_nodes))
+
+    def reclaim_listeners(self, old_nodes, new_node):
+        return self._reclaim_listeners(old_nodes, new_node)
+
+    def _finish(
+            self, task_id, node_id, pid, status, event, finished_key, output_field, output,
+            result_ttl):
+        return self._finish_script(
+            keys=[
+                self._reserved_key(node_id),
+                self._started_key,
                 RedisTask.task_key(task_id),
-                mapping={
-                    "status": "complete",
-                    "result": result,
-                    "updated": time.time()
-                })
+                finished_key,
+                self._events_key
+            ],
+            args=[
+                task_id,
+                self._running_job(node_id, pid, task_id),
+                status,
+                output_field,
+                output,
+                time.time(),
+                RedisTask.finished_channel(task_id),
+                event,
+                self.max_events,
+                int(result_ttl * 1000) if result_ttl is not None else 0,
+                node_id,
+                str(pid),
+                self._reserved_key("")
+            ])
+
+    def _complete(self, task_id, node_id, pid, result, result_ttl):
+        self._log(
+            "completing task %s on %s, pid: %s, result: %s" % (task_id, node_id, pid, result))
 
-            pipeline.lpush(self._complete_key, task_id)
+        return self._finish(
+            task_id, node_id, pid, "complete", "completed", self._complete_key, "result", result,
+            result_ttl)
 
-            pipeline.execute()
+    def complete(self, task_id, node_id, pid, result, result_ttl=None):
+        started = time.perf_counter()
 
-    def fail(self, task_id, node_id, pid, error):
-        self._log("failed task %s on %s, pid: %i, error: %s" % (task_id, node_id, pid, error))
+        finished = self._complete(task_id, node_id, pid, result, result_ttl)
 
-        with self._redis.pipeline() as pipeline:
-            pipeline.lrem(self._reserved_key(node_id), 1, task_id)
-            pipeline.srem(self._started_key, self._running_job(node_id, pid, task_id))
+        self._observe("complete", started)
 
-            pipeline.hset(
-                RedisTask.task_key(task_id),
-                mapping={
-                    "status": "failed",
-                    "error": error,
-                    "updated": time.time()
-                })
+        return finished
 
-            pipeline.lpush(self._failed_key, task_id)
+    def _fail(self, task_id, node_id, pid, error, result_ttl):
+        # A task which was never started, and so has no pid, may be
+        # failed by the watchdog.
+        self._log("failed task %s on %s, pid: %s, error: %s" % (task_id, node_id, pid, error))
 
-            pipeline.execute()
+        return self._finish(
+            task_id, node_id, pid, "failed", "failed", self._failed_key, "error", error,
+            result_ttl)
 
-    def delete_task(self, task_id, task_status):
+    def fail(self, task_id, node_id, pid, error, result_ttl=None):
+        started = time.perf_counter()
+
+        finished = self._fail(task_id, node_id, pid, error, result_ttl)
+
+        self._observe("fail", started)
+
+        return finished
+
+    def _record_usage(self, task_id, cpu_user, cpu_system, max_rss, duration):
+        self._debug(
+            "task %s used %fs user, %fs system, %i max rss, in %fs" % (
+                task_id, cpu_user, cpu_system, max_rss, duration))
+
+        return self._record_usage_script(
+            keys=[RedisTask.task_key(task_id), self._usage_key],
+            args=[cpu_user, cpu_system, max_rss, duration])
+
+    def record_usage(self, task_id, cpu_user, cpu_system, max_rss, duration):
+        return self._record_usage(task_id, cpu_user, cpu_system, max_rss, duration)
+
+    def _parse_usage(self, raw_usage):
+        tasks = int(raw_usage.get("tasks", 0))
+        started_tasks = int(raw_usage.get("started_tasks", 0))
+
+        usage = {"tasks": tasks, "max_rss": int(raw_usage.get("max_rss", 0))}
+
+        for field, count in (
+                ("cpu_user", tasks),
+                ("cpu_system", tasks),
+                ("duration", tasks),
+                ("queue_wait", started_tasks)):
+            usage[field] = float(raw_usage.get(field, 0))
+            usage["mean_" + field] = usage[field] / count if count > 0 else None
+
+        return usage
+
+    def get_usage(self):
+        return self._parse_usage(self._redis.hgetall(self._usage_key))
+
+    @classmethod
+    def _get_raw_stats(cls, redis_client, queue_names):
+        stats_script = redis_client.register_script(redis_scripts.QUEUE_STATS)
+
+        return stats_script(
+            keys=[cls._key("queues")],
+            args=[
+                cls._key("pending_tasks", ""),
+                cls._key("scheduled_tasks", ""),
+                cls._key("started_tasks", ""),
+                cls._key("complete_tasks_by_time", ""),
+                cls._key("complete_tasks", ""),
+                cls._key("failed_tasks_by_time", ""),
+                cls._key("failed_tasks", ""),
+                cls._key("listeners", ""),
+                RedisTask.task_key("")
+            ] + list(queue_names or []))
+
+    @staticmethod
+    def _parse_stats(raw_stats):
+        now = time.time()
+        stats = {}
+
+        for (queue_name, pending, scheduled, started, complete, failed, listeners,
+                oldest_pending_updated) in raw_stats:
+            stats[queue_name] = {
+                "pending": pending,
+                "scheduled": scheduled,
+                "started": started,
+                "complete": complete,
+                "failed": failed,
+                "listeners": listeners,
+                "oldest_pending_age": None
+            }
+
+            if oldest_pending_updated is not None:
+                stats[queue_name]["oldest_pending_age"] = max(
+                    0.0, now - float(oldest_pending_updated))
+
+        return stats
+
+    @classmethod
+    def get_many_stats(cls, redis_client, queue_names=None):
+        # Returns a dict of stats by queue name, for every queue in
+        # blueque_queues if no names are given, from one script call.
+        if queue_names is not None and len(queue_names) == 0:
+            return {}
+
+        return cls._parse_stats(cls._get_raw_stats(redis_client, queue_names))
+
+    def get_stats(self):
+        return self.get_many_stats(self._redis, [self._name])[self._name]
+
+    def _finished_keys(self, task_status, action):
+        # Returns the finished set, and the list it is migrated from.
         if task_status == "complete":
-            finished_queue = self._complete_key
+            return self._complete_key, self._complete_list_key
         elif task_status == "failed":
-            finished_queue = self._failed_key
+            return self._failed_key, self._failed_list_key
         else:
-            raise ValueError("Cannot delete task with status %s" % (task_status))
+            raise ValueError("Cannot %s task with status %s" % (action, task_status))
+
+    def _delete_task(self, pipeline, task_id, task_status):
+        finished_key, finished_list_key = self._finished_keys(task_status, "delete")
 
         self._log("deleting task %s with status %s" % (task_id, task_status))
 
-        with self._redis.pipeline() as pipeline:
-            pipeline.delete(RedisTask.task_key(task_id))
-            pipeline.lrem(finished_queue, 1, task_id)
+        pipeline.delete(RedisTask.task_key(task_id))
+        pipeline.zrem(finished_key, task_id)
+        # Only the task's own list is searched, and only until it has
+        # been migrated.
+        pipeline.lrem(finished_list_key, 1, task_id)
+
+        self._add_event(pipeline, "deleted", task_id)
 
+    def delete_task(self, task_id, task_status):
+        with self._redis.pipeline() as pipeline:
+            self._delete_task(pipeline, task_id, task_status)
             pipeline.execute()
+
+    def _purge_finished(self, finished_key, cutoff, batch_size):
+        return self._purge_finished_script(
+            keys=[finished_key], args=[self._task_key_prefix, cutoff, batch_size])
+
+    def purge_finished(self, older_than, batch_size):
+        cutoff = time.time() - older_than
+        purged = 0
+
+        # Each batch is a separate script call, so that Redis isn't
+        # blocked for long by a large purge.
+        for finished_key in (self._complete_key, self._failed_key):
+            while True:
+                batch_purged = self._purge_finished(finished_key, cutoff, batch_size)
+                purged += batch_purged
+
+                if batch_purged < batch_size:
+                    break
+
+        self._log("purged %i tasks finished before %f" % (purged, cutoff))
+
+        return purged
+
+    def _get_finished(self, task_status, start, end, limit):
+        finished_key, _ = self._finished_keys(task_status, "list")
+
+        if limit is None:
+            return self._redis.zrangebyscore(finished_key, start, end)
+
+        return self._redis.zrangebyscore(finished_key, start, end, start=0, num=limit)
+
+    def get_finished(self, task_status, start, end, limit):
+        return self._get_finished(task_status, start, end, limit)
+
+    def _migrate_finished(self, finished_list_key, finished_key, batch_size):
+        return self._migrate_finished_script(
+            keys=[finished_list_key, finished_key], args=[self._task_key_prefix, batch_size])
+
+    def migrate_finished(self, batch_size):
+        migrated = 0
+
+        for finished_list_key, finished_key in (
+                (self._complete_list_key, self._complete_key),
+                (self._failed_list_key, self._failed_key)):
+            while True:
+                batch_migrated, remaining = self._migrate_finished(
+                    finished_list_key, finished_key, batch_size)
+                migrated += batch_migrated
+
+                if remaining == 0:
+                    break
+
+        self._log("migrated %i finished tasks" % (migrated))
+
+        return migrated
@@ -0,0 +1,62 @@
+from blueque import redis_scripts
+from blueque.redis_queue import RedisQueue
+
+
+class RedisScheduler(object):
+    def __init__(self, redis_client, metrics=None):
+        super(RedisScheduler, self).__init__()
+
+        self._queues_key = self._key("queues")
+        self._lock_key = self._key("scheduler_lock")
+        self._channel_name = self._key("schedule_channel")
+
+        self._redis = redis_client
+        self._metrics = metrics
+
+        self._acquire_lock_script = self._redis.register_script(redis_scripts.ACQUIRE_LOCK)
+        self._release_lock_script = self._redis.register_script(redis_scripts.RELEASE_LOCK)
+
+        self._queues = {}
+
+    def _key(self, *args):
+        return '_'.join(("blueque",) + args)
+
+    def _get_queue(self, queue_name):
+        if queue_name not in self._queues:
+            self._queues[queue_name] = RedisQueue(queue_name, self._redis, self._metrics)
+
+        return self._queues[queue_name]
+
+    def acquire_lock(self, node_id, timeout):
+        return self._acquire_lock_script(
+            keys=[self._lock_key], args=[node_id, int(timeout * 1000)]) == 1
+
+    def release_lock(self, node_id):
+        return self._release_lock_script(keys=[self._lock_key], args=[node_id]) == 1
+
+    def subscribe(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel_name)
+
+        return pubsub
+
+    def get_queues(self):
+        return self._redis.zrange(self._queues_key, 0, -1)
+
+    def get_next_etas(self, queue_names):
+        with self._redis.pipeline(transaction=False) as pipeline:
+            for queue_name in queue_names:
+                pipeline.zrange(
+                    self._key("scheduled_tasks", queue_name), 0, 0, withscores=True)
+
+            results = pipeline.execute()
+
+        return dict(
+            (queue_name, result[0][1] if len(result) > 0 else None)
+            for queue_name, result in zip(queue_names, results))
+
+    def enqueue_due_tasks(self, queue_name, limit):
+        return self._get_queue(queue_name).enqueue_due_tasks(limit)
+
+    def recover_expired_leases(self, queue_name):
+        return self._get_queue(queue_name).recover_expired_leases()
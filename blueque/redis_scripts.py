@@ -0,0 +1,438 @@
+# Lua scripts used by RedisQueue, so that each task state transition
+# is a single, atomic round trip. Task hash keys are built inside the
+# scripts from a prefix, because the task ID is not known until the
+# task has been popped.
+#
+# Each transition also adds an event to the queue's event stream,
+# which is capped at about ARGV "max events" entries.
+
+# KEYS: pending list, reserved list, event stream
+# ARGV: task key prefix, node id, timestamp, max events
+DEQUEUE = """
+local task_id = redis.call("RPOPLPUSH", KEYS[1], KEYS[2])
+if not task_id then
+    return false
+end
+
+redis.call(
+    "HSET", ARGV[1] .. task_id, "status", "reserved", "node", ARGV[2], "updated", ARGV[3])
+redis.call(
+    "XADD", KEYS[3], "MAXLEN", "~", ARGV[4], "*",
+    "event", "reserved", "task", task_id, "time", ARGV[3], "node", ARGV[2])
+
+return task_id
+"""
+
+# KEYS: started set, task hash, event stream
+# ARGV: running job, pid, timestamp, task id, node id, max events
+START = """
+redis.call("SADD", KEYS[1], ARGV[1])
+redis.call(
+    "HSET", KEYS[2], "status", "started", "pid", ARGV[2], "started", ARGV[3], "updated", ARGV[3])
+redis.call(
+    "XADD", KEYS[3], "MAXLEN", "~", ARGV[6], "*",
+    "event", "started", "task", ARGV[4], "time", ARGV[3], "node", ARGV[5], "pid", ARGV[2])
+"""
+
+# KEYS: reserved list, started set, task hash, finished set, event stream
+# ARGV: task id, running job, status, output field, output, timestamp,
+#       finished channel, event, max events, result ttl in milliseconds
+#       (0 to keep the task until it is deleted), node id, pid, reserved
+#       list prefix
+FINISH = """
+redis.call("LREM", KEYS[1], 1, ARGV[1])
+redis.call("SREM", KEYS[2], ARGV[2])
+
+-- A task which was still running when its listener went away has
+-- since been reclaimed by another listener.
+local node = redis.call("HGET", KEYS[3], "node")
+if node and node ~= ARGV[11] then
+    redis.call("LREM", ARGV[13] .. node, 1, ARGV[1])
+    redis.call("SREM", KEYS[2], node .. " " .. ARGV[12] .. " " .. ARGV[1])
+end
+
+redis.call("HSET", KEYS[3], "status", ARGV[3], ARGV[4], ARGV[5], "updated", ARGV[6])
+if tonumber(ARGV[10]) > 0 then
+    redis.call("PEXPIRE", KEYS[3], ARGV[10])
+end
+redis.call("ZADD", KEYS[4], ARGV[6], ARGV[1])
+redis.call(
+    "XADD", KEYS[5], "MAXLEN", "~", ARGV[9], "*",
+    "event", ARGV[8], "task", ARGV[1], "time", ARGV[6])
+redis.call("PUBLISH", ARGV[7], ARGV[1])
+"""
+
+# KEYS: scheduled set, pending list, event stream
+# ARGV: task key prefix, timestamp, limit, task channel, queue name,
+#       max events
+ENQUEUE_DUE = """
+local due_tasks = redis.call("ZRANGEBYSCORE", KEYS[1], 0, ARGV[2], "LIMIT", 0, ARGV[3])
+
+for _, task_id in ipairs(due_tasks) do
+    redis.call("ZREM", KEYS[1], task_id)
+    redis.call("LPUSH", KEYS[2], task_id)
+    redis.call("HSET", ARGV[1] .. task_id, "status", "pending", "updated", ARGV[2])
+    redis.call(
+        "XADD", KEYS[3], "MAXLEN", "~", ARGV[6], "*",
+        "event", "promoted", "task", task_id, "time", ARGV[2])
+end
+
+if #due_tasks > 0 then
+    redis.call("PUBLISH", ARGV[4], ARGV[5])
+end
+
+return {due_tasks, redis.call("ZCOUNT", KEYS[1], 0, ARGV[2])}
+"""
+
+# Listener IDs are "[hostname]_[pid]"; this is the hostname.
+LISTENER_HOST = """
+local function listener_host(node)
+    return string.match(node, "^(.*)_[^_]*$")
+end
+"""
+
+# KEYS: listeners set, host listeners set, queues, host handed off set
+# ARGV: listener id, queue name
+REMOVE_LISTENER = """
+if redis.call("SREM", KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+
+redis.call("SREM", KEYS[2], ARGV[1])
+redis.call("SREM", KEYS[4], ARGV[1])
+redis.call("ZINCRBY", KEYS[3], -1, ARGV[2])
+
+return 1
+"""
+
+# A listener whose lease expired while it was still running has had its
+# tasks recovered, and been removed from the listeners sets, so it has
+# to register again for the tasks it reserves from then on to be
+# recovered; anything else renewing its lease (i.e. its processors)
+# just loses it.
+#
+# KEYS: listeners set, host listeners set, queues, heartbeat key,
+#       leased listeners set
+# ARGV: listener id, queue name, timestamp, lease timeout in
+#       milliseconds, whether to register again (1 or 0)
+# Returns 1 if the lease was renewed, 2 if the listener registered
+# again, and 0 if the lease was lost.
+RENEW_LEASE = """
+local renewed = 1
+
+if redis.call("SISMEMBER", KEYS[1], ARGV[1]) == 0 then
+    if ARGV[5] ~= "1" then
+        return 0
+    end
+
+    redis.call("SADD", KEYS[1], ARGV[1])
+    redis.call("SADD", KEYS[2], ARGV[1])
+    redis.call("ZINCRBY", KEYS[3], 1, ARGV[2])
+
+    renewed = 2
+end
+
+redis.call("SET", KEYS[4], ARGV[3], "PX", ARGV[4])
+redis.call("SADD", KEYS[5], ARGV[1])
+
+return renewed
+"""
+
+# Listeners used to be kept only in the listeners set, so the host
+# index is filled in for any listeners still in it, in batches.
+#
+# KEYS: listeners set
+# ARGV: host listeners set prefix, listener ids...
+INDEX_HOST_LISTENERS = LISTENER_HOST + """
+local indexed = 0
+
+for i = 2, #ARGV do
+    local node = ARGV[i]
+
+    -- It may have been removed since it was read.
+    if redis.call("SISMEMBER", KEYS[1], node) == 1 then
+        indexed = indexed + redis.call("SADD", ARGV[1] .. listener_host(node), node)
+    end
+end
+
+return indexed
+"""
+
+# Moves tasks from one listener to another, which then owns them as
+# if it had reserved them itself, so that they are finished, and
+# recovered if its lease expires, as its tasks.
+RECLAIM = """
+local function reclaim_tasks(
+        task_ids, old_node, new_node, reserved_prefix, task_key_prefix, started_key,
+        events_key, timestamp, max_events)
+    for _, task_id in ipairs(task_ids) do
+        local task_key = task_key_prefix .. task_id
+
+        redis.call("LREM", reserved_prefix .. old_node, 1, task_id)
+        redis.call("RPUSH", reserved_prefix .. new_node, task_id)
+
+        local pid = redis.call("HGET", task_key, "pid")
+        if pid then
+            local running_job = " " .. pid .. " " .. task_id
+
+            if redis.call("SREM", started_key, old_node .. running_job) == 1 then
+                redis.call("SADD", started_key, new_node .. running_job)
+            end
+        end
+
+        -- A blocking dequeue only marks its task reserved after
+        -- popping it, so its listener may have gone away in between.
+        if redis.call("HGET", task_key, "status") == "pending" then
+            redis.call("HSET", task_key, "status", "reserved", "updated", timestamp)
+        end
+
+        redis.call("HSET", task_key, "node", new_node, "reclaimed_node", new_node)
+        redis.call(
+            "XADD", events_key, "MAXLEN", "~", max_events, "*",
+            "event", "reclaimed", "task", task_id, "time", timestamp, "node", new_node)
+    end
+
+    return task_ids
+end
+"""
+
+# KEYS: old reserved list, started set, event stream
+# ARGV: old listener id, new listener id, reserved list prefix, task
+#       key prefix, timestamp, max events, limit (0 for every task)
+RECLAIM_TASKS = RECLAIM + """
+local task_ids = redis.call("LRANGE", KEYS[1], 0, tonumber(ARGV[7]) - 1)
+
+return reclaim_tasks(
+    task_ids, ARGV[1], ARGV[2], ARGV[3], ARGV[4], KEYS[2], KEYS[3], ARGV[5], ARGV[6])
+"""
+
+# KEYS: listeners set, queues, event stream, started set
+# ARGV: new listener id, host listeners set prefix, reserved list
+#       prefix, task key prefix, timestamp, queue name, max events,
+#       host handed off set prefix, old listener ids...
+RECLAIM_LISTENERS = LISTENER_HOST + RECLAIM + """
+local reclaimed = {}
+
+for i = 9, #ARGV do
+    local node = ARGV[i]
+
+    -- Another listener may already have claimed it.
+    if redis.call("SREM", KEYS[1], node) == 1 then
+        redis.call("SREM", ARGV[2] .. listener_host(node), node)
+        redis.call("SREM", ARGV[8] .. listener_host(node), node)
+        redis.call("ZINCRBY", KEYS[2], -1, ARGV[6])
+
+        local task_ids = reclaim_tasks(
+            redis.call("LRANGE", ARGV[3] .. node, 0, -1), node, ARGV[1], ARGV[3], ARGV[4],
+            KEYS[4], KEYS[3], ARGV[5], ARGV[7])
+
+        for _, task_id in ipairs(task_ids) do
+            table.insert(reclaimed, task_id)
+        end
+    end
+end
+
+return reclaimed
+"""
+
+# KEYS: leased listeners set, listeners set, queues, pending list,
+#       started set, event stream
+# ARGV: heartbeat key prefix, reserved list prefix, task key prefix,
+#       timestamp, queue name, task channel, max events, host listeners
+#       set prefix, host handed off set prefix
+RECOVER_EXPIRED_LEASES = LISTENER_HOST + """
+local recovered = {}
+
+for _, node in ipairs(redis.call("SMEMBERS", KEYS[1])) do
+    if redis.call("EXISTS", ARGV[1] .. node) == 0 then
+        redis.call("SREM", KEYS[1], node)
+
+        -- If the listener is already gone, another listener on its
+        -- host has claimed its tasks.
+        if redis.call("SREM", KEYS[2], node) == 1 then
+            redis.call("SREM", ARGV[8] .. listener_host(node), node)
+            redis.call("SREM", ARGV[9] .. listener_host(node), node)
+            redis.call("ZINCRBY", KEYS[3], -1, ARGV[5])
+
+            local task_id = redis.call("LPOP", ARGV[2] .. node)
+            while task_id do
+                local task_key = ARGV[3] .. task_id
+
+                local pid = redis.call("HGET", task_key, "pid")
+                if pid then
+                    redis.call("SREM", KEYS[5], node .. " " .. pid .. " " .. task_id)
+                end
+
+                redis.call("RPUSH", KEYS[4], task_id)
+                redis.call("HSET", task_key, "status", "pending", "updated", ARGV[4])
+                redis.call("HDEL", task_key, "node", "pid")
+                redis.call(
+                    "XADD", KEYS[6], "MAXLEN", "~", ARGV[7], "*",
+                    "event", "recovered", "task", task_id, "time", ARGV[4], "node", node)
+
+                table.insert(recovered, task_id)
+
+                task_id = redis.call("LPOP", ARGV[2] .. node)
+            end
+        end
+    end
+end
+
+if #recovered > 0 then
+    redis.call("PUBLISH", ARGV[6], ARGV[5])
+end
+
+return recovered
+"""
+
+# KEYS: task hash, usage hash
+# ARGV: cpu user, cpu system, max rss, duration
+RECORD_USAGE = """
+local times = redis.call("HMGET", KEYS[1], "created", "started")
+if not times[1] then
+    -- Already deleted; don't recreate it.
+    return 0
+end
+
+redis.call(
+    "HSET", KEYS[1],
+    "cpu_user", ARGV[1], "cpu_system", ARGV[2], "max_rss", ARGV[3], "duration", ARGV[4])
+
+redis.call("HINCRBY", KEYS[2], "tasks", 1)
+redis.call("HINCRBYFLOAT", KEYS[2], "cpu_user", ARGV[1])
+redis.call("HINCRBYFLOAT", KEYS[2], "cpu_system", ARGV[2])
+redis.call("HINCRBYFLOAT", KEYS[2], "duration", ARGV[4])
+
+if tonumber(ARGV[3]) > tonumber(redis.call("HGET", KEYS[2], "max_rss") or 0) then
+    redis.call("HSET", KEYS[2], "max_rss", ARGV[3])
+end
+
+if times[2] then
+    local queue_wait = tostring(tonumber(times[2]) - tonumber(times[1]))
+
+    redis.call("HSET", KEYS[1], "queue_wait", queue_wait)
+    redis.call("HINCRBY", KEYS[2], "started_tasks", 1)
+    redis.call("HINCRBYFLOAT", KEYS[2], "queue_wait", queue_wait)
+end
+
+return 1
+"""
+
+# Finished sets are scored by the time each task finished, so the
+# oldest tasks are first.
+#
+# KEYS: finished set
+# ARGV: task key prefix, cutoff timestamp, batch size
+PURGE_FINISHED = """
+local task_ids = redis.call(
+    "ZRANGEBYSCORE", KEYS[1], "-inf", "(" .. ARGV[2], "LIMIT", 0, ARGV[3])
+
+for _, task_id in ipairs(task_ids) do
+    redis.call("DEL", ARGV[1] .. task_id)
+end
+
+if #task_ids > 0 then
+    redis.call("ZREMRANGEBYRANK", KEYS[1], 0, #task_ids - 1)
+end
+
+return #task_ids
+"""
+
+# Finished tasks used to be kept in lists, which processors that
+# haven't been upgraded may still be pushing onto. Each call moves a
+# batch of tasks over, scored by their last update, i.e. when they
+# finished.
+#
+# KEYS: finished list, finished set
+# ARGV: task key prefix, batch size
+MIGRATE_FINISHED = """
+local migrated = 0
+
+while migrated < tonumber(ARGV[2]) do
+    local task_id = redis.call("RPOP", KEYS[1])
+    if not task_id then
+        break
+    end
+
+    -- Skip tasks which have expired, or been deleted.
+    local updated = redis.call("HGET", ARGV[1] .. task_id, "updated")
+    if updated then
+        redis.call("ZADD", KEYS[2], updated, task_id)
+    end
+
+    migrated = migrated + 1
+end
+
+return {migrated, redis.call("LLEN", KEYS[1])}
+"""
+
+# Reads every count with one call, however many queues there are; the
+# age of the oldest pending task is worked out by the caller, from
+# when it was last updated.
+#
+# KEYS: queues
+# ARGV: pending list prefix, scheduled set prefix, started set prefix,
+#       complete set prefix, complete list prefix, failed set prefix,
+#       failed list prefix, listeners set prefix, task key prefix,
+#       queue names... (every queue in KEYS[1] if there are none)
+QUEUE_STATS = """
+local queue_names = {}
+for i = 10, #ARGV do
+    table.insert(queue_names, ARGV[i])
+end
+
+if #queue_names == 0 then
+    queue_names = redis.call("ZRANGE", KEYS[1], 0, -1)
+end
+
+local stats = {}
+
+for _, queue in ipairs(queue_names) do
+    local oldest_pending_updated = false
+
+    local oldest_task_id = redis.call("LINDEX", ARGV[1] .. queue, -1)
+    if oldest_task_id then
+        oldest_pending_updated = redis.call("HGET", ARGV[9] .. oldest_task_id, "updated")
+    end
+
+    -- Tasks which finished before the lists were migrated are still
+    -- finished.
+    table.insert(stats, {
+        queue,
+        redis.call("LLEN", ARGV[1] .. queue),
+        redis.call("ZCARD", ARGV[2] .. queue),
+        redis.call("SCARD", ARGV[3] .. queue),
+        redis.call("ZCARD", ARGV[4] .. queue) + redis.call("LLEN", ARGV[5] .. queue),
+        redis.call("ZCARD", ARGV[6] .. queue) + redis.call("LLEN", ARGV[7] .. queue),
+        redis.call("SCARD", ARGV[8] .. queue),
+        oldest_pending_updated
+    })
+end
+
+return stats
+"""
+
+# KEYS: lock
+# ARGV: owner, timeout in milliseconds
+ACQUIRE_LOCK = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("PEXPIRE", KEYS[1], ARGV[2])
+    return 1
+end
+
+if redis.call("SET", KEYS[1], ARGV[1], "NX", "PX", ARGV[2]) then
+    return 1
+end
+
+return 0
+"""
+
+# KEYS: lock
+# ARGV: owner
+RELEASE_LOCK = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+
+return 0
+"""
@@ -5,7 +5,15 @@ class RedisTask(object):
     _field_types = defaultdict(lambda: str, {
         "pid": int,
         "created": float,
-        "updated": float
+        "updated": float,
+        "started": float,
+        "eta": float,
+        "timeout": float,
+        "queue_wait": float,
+        "duration": float,
+        "cpu_user": float,
+        "cpu_system": float,
+        "max_rss": int
     })
 
     def __init__(self, id, redis):
@@ -19,14 +27,67 @@ class RedisTask(object):
     def task_key(task_id):
         return RedisTask._key("task", task_id)
 
+    @staticmethod
+    def finished_channel(task_id):
+        return RedisTask._key("finished_channel", task_id)
+
+    @staticmethod
+    def subscribe_finished(redis, task_ids):
+        pubsub = redis.pubsub()
+        pubsub.subscribe(*[RedisTask.finished_channel(task_id) for task_id in task_ids])
+
+        return pubsub
+
     @staticmethod
     def _key(*args):
         return '_'.join(("blueque",) + args)
 
+    @classmethod
+    def _parse_task_data(cls, raw_data):
+        task_data = {}
+
+        for field, value in raw_data.items():
+            task_data[field] = cls._field_types[field](value)
+
+        return task_data
+
     def get_task_data(self):
+        return self._parse_task_data(self._redis.hgetall(self._task_key))
+
+    @classmethod
+    def _parse_task_fields(cls, fields, values):
         task_data = {}
 
-        for field, value in self._redis.hgetall(self._task_key).items():
-            task_data[field] = self._field_types[field](value)
+        for field, value in zip(fields, values):
+            task_data[field] = None if value is None else cls._field_types[field](value)
 
         return task_data
+
+    def get_task_fields(self, fields):
+        return self._parse_task_fields(fields, self._redis.hmget(self._task_key, fields))
+
+    @classmethod
+    def get_many_task_data(cls, redis, task_ids, fields=None):
+        with redis.pipeline(transaction=False) as pipeline:
+            for task_id in task_ids:
+                task_key = cls.task_key(task_id)
+
+                if fields is None:
+                    pipeline.hgetall(task_key)
+                else:
+                    # HMGET can't tell a missing task from missing fields.
+                    pipeline.exists(task_key)
+                    pipeline.hmget(task_key, fields)
+
+            results = pipeline.execute()
+
+        if fields is None:
+            return [
+                cls._parse_task_data(raw_data) if len(raw_data) > 0 else None
+                for raw_data in results
+            ]
+
+        return [
+            cls._parse_task_fields(fields, values) if exists else None
+            for exists, values in zip(results[::2], results[1::2])
+        ]
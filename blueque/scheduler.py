@@ -0,0 +1,87 @@
+import logging
+import os
+import socket
+import time
+
+
+class Scheduler(object):
+    def __init__(self, redis_scheduler, batch_size=1000, lock_timeout=30):
+        super(Scheduler, self).__init__()
+
+        self._name = "_".join((socket.getfqdn(), str(os.getpid())))
+        self._redis_scheduler = redis_scheduler
+        self._batch_size = batch_size
+        self._lock_timeout = lock_timeout
+
+        # Wake up often enough to renew the lock before it expires.
+        self._renew_interval = lock_timeout / 3.0
+
+        self._next_recovery = 0
+
+    def _log(self, message):
+        logging.info("Blueque scheduler %s: %s" % (self._name, message))
+
+    def _debug(self, message):
+        logging.debug("Blueque scheduler %s: %s" % (self._name, message))
+
+    def _enqueue_due_tasks(self):
+        while True:
+            now = time.time()
+
+            next_etas = self._redis_scheduler.get_next_etas(self._redis_scheduler.get_queues())
+
+            due_queues = [
+                queue_name for queue_name, eta in next_etas.items()
+                if eta is not None and eta <= now
+            ]
+
+            if len(due_queues) == 0:
+                return min([eta for eta in next_etas.values() if eta is not None], default=None)
+
+            for queue_name in due_queues:
+                self._redis_scheduler.enqueue_due_tasks(queue_name, self._batch_size)
+
+            if not self._redis_scheduler.acquire_lock(self._name, self._lock_timeout):
+                self._log("lost lock")
+                return None
+
+    def _recover_expired_leases(self):
+        now = time.time()
+        if now < self._next_recovery:
+            return
+
+        self._next_recovery = now + self._renew_interval
+
+        for queue_name in self._redis_scheduler.get_queues():
+            self._redis_scheduler.recover_expired_leases(queue_name)
+
+    def _wait(self, subscription, timeout):
+        self._debug("sleeping for %f seconds" % (timeout))
+
+        subscription.get_message(timeout=timeout)
+
+        # Several tasks may have been scheduled while we were busy;
+        # one wake up is enough for all of them.
+        while subscription.get_message() is not None:
+            pass
+
+    def run(self):
+        try:
+            with self._redis_scheduler.subscribe() as subscription:
+                while True:
+                    if not self._redis_scheduler.acquire_lock(self._name, self._lock_timeout):
+                        self._debug("waiting for lock")
+                        time.sleep(self._renew_interval)
+                        continue
+
+                    self._recover_expired_leases()
+
+                    next_eta = self._enqueue_due_tasks()
+
+                    timeout = self._renew_interval
+                    if next_eta is not None:
+                        timeout = max(0, min(timeout, next_eta - time.time()))
+
+                    self._wait(subscription, timeout)
+        finally:
+            self._redis_scheduler.release_lock(self._name)
@@ -1,9 +1,44 @@
 class Task(object):
-    def __init__(self, id, redis_task):
+    # Fields are only read from Redis when they are first used, so
+    # checking a task's status doesn't fetch its parameters and
+    # result, which may be large. The rest are small, so using any of
+    # them reads them all at once.
+    __slots__ = ("_id", "_redis_task", "_attributes", "_all_fields")
+
+    _small_fields = (
+        "status", "queue", "node", "pid", "created", "updated", "eta", "timeout", "started",
+        "queue_wait", "duration", "cpu_user", "cpu_system", "max_rss")
+
+    def __init__(self, id, redis_task, task_data=None, all_fields=True):
         super(Task, self).__init__()
 
         self._id = id
-        self._attributes = redis_task.get_task_data()
+        self._redis_task = redis_task
+
+        if task_data is None:
+            self._attributes = {}
+            self._all_fields = False
+        else:
+            self._attributes = task_data
+            self._all_fields = all_fields
+
+    def _get(self, field):
+        if field not in self._attributes and not self._all_fields:
+            if field in self._small_fields:
+                fields = [
+                    small_field for small_field in self._small_fields
+                    if small_field not in self._attributes
+                ]
+            else:
+                fields = [field]
+
+            self._attributes.update(self._redis_task.get_task_fields(fields))
+
+        return self._attributes.get(field)
+
+    def refresh(self):
+        self._attributes = {}
+        self._all_fields = False
 
     @property
     def id(self):
@@ -11,36 +46,68 @@ class Task(object):
 
     @property
     def status(self):
-        return self._attributes.get("status")
+        return self._get("status")
 
     @property
     def queue(self):
-        return self._attributes.get("queue")
+        return self._get("queue")
 
     @property
     def parameters(self):
-        return self._attributes.get("parameters")
+        return self._get("parameters")
 
     @property
     def result(self):
-        return self._attributes.get("result")
+        return self._get("result")
 
     @property
     def error(self):
-        return self._attributes.get("error")
+        return self._get("error")
 
     @property
     def node(self):
-        return self._attributes.get("node")
+        return self._get("node")
 
     @property
     def pid(self):
-        return self._attributes.get("pid")
+        return self._get("pid")
 
     @property
     def created(self):
-        return self._attributes.get("created")
+        return self._get("created")
 
     @property
     def updated(self):
-        return self._attributes.get("updated")
+        return self._get("updated")
+
+    @property
+    def eta(self):
+        return self._get("eta")
+
+    @property
+    def timeout(self):
+        return self._get("timeout")
+
+    @property
+    def started(self):
+        return self._get("started")
+
+    @property
+    def queue_wait(self):
+        return self._get("queue_wait")
+
+    @property
+    def duration(self):
+        return self._get("duration")
+
+    @property
+    def cpu_user(self):
+        return self._get("cpu_user")
+
+    @property
+    def cpu_system(self):
+        return self._get("cpu_system")
+
+    @property
+    def max_rss(self):
+        return self._get("max_rss")
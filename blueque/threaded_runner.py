@@ -0,0 +1,83 @@
+from blueque.process_helpers import process_running
+
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+import os
+import threading
+
+
+class ThreadedRunner(object):
+    def __init__(
+            self, client, queue, task_callback, max_workers=10, lease_timeout=None,
+            result_ttl=None, dequeue_timeout=None, subscribe=False):
+        super(ThreadedRunner, self).__init__()
+
+        self._client = client
+        self._queue = queue
+        self._task_callback = task_callback
+        self._max_workers = max_workers
+
+        # The tasks run in this process, so the listener's heartbeat
+        # keeps the lease alive for them too.
+        self._lease_timeout = lease_timeout
+        self._dequeue_timeout = dequeue_timeout
+        self._subscribe = subscribe
+        self._result_ttl = result_ttl
+
+        # Only take a task off the queue when there is a thread free
+        # to run it, so that tasks aren't left waiting in the
+        # executor while other runners are idle.
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def _process_task(self, task):
+        try:
+            logging.info("Getting Processor to run task %s" % (task.id))
+            processor = self._client.get_processor(task, result_ttl=self._result_ttl)
+
+            logging.info("Starting to run task %s" % (task.id))
+            processor.start(os.getpid())
+
+            try:
+                result = self._task_callback(task)
+
+                processor.complete(result)
+            except Exception as e:
+                processor.fail(str(e))
+        except Exception:
+            logging.exception("Error running task %s" % (task.id))
+        finally:
+            self._slots.release()
+
+    def _run_task(self, executor, task):
+        logging.info("Submitting task %s" % (task.id))
+
+        executor.submit(self._process_task, task)
+
+    def _fail_orphan(self, task):
+        # The threads that were running the task died with their
+        # process, so it will never finish.
+        logging.info("Failing task %s, orphaned by pid %i" % (task.id, task.pid))
+
+        processor = self._client.get_processor(task, result_ttl=self._result_ttl)
+        processor.fail("Task was orphaned while running")
+
+    def run(self):
+        listener = self._client.get_listener(
+            self._queue, dequeue_timeout=self._dequeue_timeout, subscribe=self._subscribe,
+            lease_timeout=self._lease_timeout)
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for task in listener.reclaim_all():
+                if task.status == "reserved":
+                    self._slots.acquire()
+                    self._run_task(executor, task)
+                elif task.status == "started" and not process_running(task.pid):
+                    self._fail_orphan(task)
+
+            while True:
+                self._slots.acquire()
+
+                task = listener.listen()
+
+                self._run_task(executor, task)
@@ -19,4 +19,4 @@ def do_work(task):
 if __name__ == "__main__":
     client = Client("redis://localhost")
 
-    forking_runner.run(client, "some.queue", do_work, 4)
+    forking_runner.ForkingRunner(client, "some.queue", do_work, concurrency=4).run()
@@ -0,0 +1,131 @@
+from blueque import AsyncClient
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import unittest
+
+
+class TestAsyncClient(unittest.IsolatedAsyncioTestCase):
+    def _patch(self, target):
+        patcher = mock.patch(target, autospec=True)
+        self.addCleanup(patcher.stop)
+
+        return patcher.start()
+
+    def setUp(self):
+        self.mock_strict_redis_class = self._patch("redis.asyncio.StrictRedis")
+        self.mock_strict_redis = self.mock_strict_redis_class.from_url.return_value
+
+        self.mock_redis_queue_class = self._patch("blueque.async_client.AsyncRedisQueue")
+        self.mock_redis_queue = self.mock_redis_queue_class.return_value
+
+        self.mock_redis_task_class = self._patch("blueque.async_client.AsyncRedisTask")
+        self.mock_redis_task = self.mock_redis_task_class.return_value
+        self.mock_redis_task.get_task_data.return_value = {
+            "queue": "some.queue",
+            "status": "reserved",
+            "node": "host_1234",
+            "parameters": "some parameters"
+        }
+
+        self.client = AsyncClient("redis://url", socket_timeout=5)
+
+    def test_client_connects_with_requested_information(self):
+        self.mock_strict_redis_class.from_url.assert_called_with(
+            "redis://url", decode_responses=True, socket_timeout=5)
+
+    async def test_close_closes_connection(self):
+        self.mock_strict_redis.aclose = mock.AsyncMock()
+
+        async with self.client:
+            pass
+
+        self.mock_strict_redis.aclose.assert_awaited_with()
+
+    async def test_get_task_loads_task_data(self):
+        task = await self.client.get_task("some_task")
+
+        self.mock_redis_task_class.assert_called_with("some_task", self.mock_strict_redis)
+        self.mock_redis_task.get_task_data.assert_awaited_once_with()
+
+        self.assertEqual("some_task", task.id)
+        self.assertEqual("reserved", task.status)
+        self.assertEqual("some parameters", task.parameters)
+
+    async def test_refresh_reloads_task_data(self):
+        task = await self.client.get_task("some_task")
+
+        self.mock_redis_task.get_task_data.return_value = {"status": "complete"}
+
+        await task.refresh()
+
+        self.assertEqual(2, self.mock_redis_task.get_task_data.await_count)
+
+        self.assertEqual("complete", task.status)
+        self.assertIsNone(task.parameters)
+
+        self.mock_redis_task.get_task_fields.assert_not_called()
+
+    async def test_queue_enqueues_task(self):
+        self.mock_redis_queue.enqueue.return_value = "some_task"
+
+        queue = self.client.get_queue("some.queue")
+
+        self.assertEqual("some_task", await queue.enqueue("some parameters"))
+
+        self.mock_redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis, None)
+        self.mock_redis_queue.enqueue.assert_awaited_with("some parameters", None)
+
+    async def test_queue_schedules_task(self):
+        self.mock_redis_queue.schedule.return_value = "some_task"
+
+        queue = self.client.get_queue("some.queue")
+
+        self.assertEqual("some_task", await queue.schedule("some parameters", 12.34))
+
+        self.mock_redis_queue.schedule.assert_awaited_with("some parameters", 12.34, None)
+
+    async def test_queue_refuses_to_delete_task_from_other_queue(self):
+        task = await self.client.get_task("some_task")
+
+        queue = self.client.get_queue("other.queue")
+
+        with self.assertRaises(ValueError):
+            await queue.delete_task(task)
+
+        self.mock_redis_queue.delete_task.assert_not_called()
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    async def test_get_listener_registers_listener(self, _, __):
+        await self.client.get_listener("some.queue")
+
+        self.mock_redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis, None)
+        self.mock_redis_queue.add_listener.assert_awaited_with("somehost.example.com_2314")
+
+    async def test_processor_runs_task(self):
+        task = await self.client.get_task("some_task")
+
+        processor = self.client.get_processor(task)
+
+        await processor.start(4321)
+        await processor.complete("some result")
+
+        self.mock_redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis, None)
+        self.mock_redis_queue.start.assert_awaited_with("some_task", "host_1234", 4321)
+        self.mock_redis_queue.complete.assert_awaited_with(
+            "some_task", "host_1234", 4321, "some result", None)
+
+    async def test_processor_fails_task(self):
+        task = await self.client.get_task("some_task")
+
+        processor = self.client.get_processor(task)
+
+        await processor.start(4321)
+        await processor.fail("some error")
+
+        self.mock_redis_queue.fail.assert_awaited_with(
+            "some_task", "host_1234", 4321, "some error", None)
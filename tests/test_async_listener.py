@@ -0,0 +1,97 @@
+from blueque.async_listener import AsyncListener
+from blueque.async_redis_queue import AsyncRedisQueue
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import unittest
+
+
+class TestAsyncListener(unittest.IsolatedAsyncioTestCase):
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    def setUp(self, _, __):
+        self.mock_redis_queue = mock.AsyncMock(spec=AsyncRedisQueue)
+        self.mock_task_factory = mock.AsyncMock()
+
+        self.listener = AsyncListener(self.mock_redis_queue, self.mock_task_factory)
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    def _make_listener(self, _, __, **kwargs):
+        return AsyncListener(self.mock_redis_queue, self.mock_task_factory, **kwargs)
+
+    def test_rejects_dequeue_timeout_which_would_block_for_ever(self):
+        for dequeue_timeout in (0, -1):
+            with self.assertRaisesRegex(ValueError, "dequeue timeout must be greater than 0"):
+                self._make_listener(dequeue_timeout=dequeue_timeout)
+
+    async def test_register_adds_listener(self):
+        await self.listener.register()
+
+        self.mock_redis_queue.add_listener.assert_awaited_with("somehost.example.com_2314")
+
+    async def test_listen_returns_task_when_task_in_queue(self):
+        self.mock_redis_queue.dequeue.side_effect = ["some_task"]
+
+        task = await self.listener.listen()
+
+        self.assertIs(self.mock_task_factory.return_value, task)
+
+        self.mock_redis_queue.dequeue.assert_awaited_with("somehost.example.com_2314", timeout=None)
+        self.mock_task_factory.assert_awaited_with("some_task")
+
+    @mock.patch("asyncio.sleep")
+    async def test_listen_sleeps_when_no_task_available(self, mock_sleep):
+        self.mock_redis_queue.dequeue.side_effect = [None, "some_task"]
+
+        await self.listener.listen()
+
+        self.assertEqual(2, self.mock_redis_queue.dequeue.await_count)
+
+        mock_sleep.assert_awaited_once_with(1)
+        self.mock_task_factory.assert_awaited_with("some_task")
+
+    @mock.patch("asyncio.sleep")
+    async def test_blocking_listen_does_not_sleep_when_no_task_available(self, mock_sleep):
+        listener = self._make_listener(dequeue_timeout=30)
+
+        self.mock_redis_queue.dequeue.side_effect = [None, "some_task"]
+
+        await listener.listen()
+
+        self.mock_redis_queue.dequeue.assert_has_awaits([
+            mock.call("somehost.example.com_2314", timeout=30),
+            mock.call("somehost.example.com_2314", timeout=30)])
+
+        mock_sleep.assert_not_called()
+
+    async def test_subscribed_listen_does_not_subscribe_when_task_available(self):
+        listener = self._make_listener(subscribe=True)
+
+        self.mock_redis_queue.dequeue.side_effect = ["some_task"]
+
+        await listener.listen()
+
+        self.mock_redis_queue.subscribe.assert_not_called()
+        self.mock_task_factory.assert_awaited_with("some_task")
+
+    async def test_subscribed_listen_waits_for_notification(self):
+        listener = self._make_listener(dequeue_timeout=10, subscribe=True)
+
+        subscription = self.mock_redis_queue.subscribe.return_value
+        self.mock_redis_queue.dequeue.side_effect = [None, None, "some_task"]
+
+        await listener.listen()
+
+        self.mock_redis_queue.dequeue.assert_has_awaits([
+            mock.call("somehost.example.com_2314"),
+            mock.call("somehost.example.com_2314"),
+            mock.call("somehost.example.com_2314")])
+
+        subscription.get_message.assert_awaited_once_with(timeout=10)
+        subscription.__aexit__.assert_awaited()
+
+        self.mock_task_factory.assert_awaited_with("some_task")
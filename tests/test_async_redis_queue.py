@@ -0,0 +1,432 @@
+from blueque import redis_scripts
+from blueque.async_redis_queue import AsyncRedisQueue
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import redis.asyncio
+import unittest
+import uuid
+
+
+class TestAsyncRedisQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.mock_redis = mock.MagicMock(spec=redis.asyncio.StrictRedis)
+
+        # redis.asyncio shares its command definitions with the
+        # synchronous client, so autospec can't tell they're awaitable.
+        for command in ("smembers", "brpoplpush", "hset", "lrange", "hgetall"):
+            setattr(self.mock_redis, command, mock.AsyncMock())
+
+        self.pipeline = mock.MagicMock(spec=redis.asyncio.client.Pipeline)
+        self.mock_redis.pipeline.return_value.__aenter__.return_value = self.pipeline
+
+        self.mock_redis.pubsub.return_value = mock.MagicMock(spec=redis.asyncio.client.PubSub)
+
+        self.uuid_patch = mock.patch(
+            "uuid.uuid4", return_value=uuid.UUID("{12345678-1234-1234-1234-123456781234}"))
+        self.uuid_patch.start()
+        self.addCleanup(self.uuid_patch.stop)
+
+        self.time_patch = mock.patch("time.time", return_value=12.34)
+        self.mock_time = self.time_patch.start()
+        self.addCleanup(self.time_patch.stop)
+
+        self.log_info_patch = mock.patch("logging.info", autospec=True)
+        self.log_info = self.log_info_patch.start()
+        self.addCleanup(self.log_info_patch.stop)
+
+        self.scripts = {}
+        self.mock_redis.register_script.side_effect = \
+            lambda script: self.scripts.setdefault(script, mock.AsyncMock())
+
+        self.queue = AsyncRedisQueue("some.queue", self.mock_redis)
+
+    def _get_pipeline(self):
+        return self.pipeline
+
+    async def test_add_listener(self):
+        pipeline = self._get_pipeline()
+
+        await self.queue.add_listener("some.host_1234")
+
+        pipeline.sadd.assert_has_calls([
+            mock.call("blueque_listeners_some.queue", "some.host_1234"),
+            mock.call("blueque_host_listeners_some.queue_some.host", "some.host_1234")
+        ])
+        pipeline.zincrby.assert_called_with("blueque_queues", 1, "some.queue")
+
+        pipeline.execute.assert_awaited_with()
+
+    async def test_remove_listener(self):
+        remove_script = self.scripts[redis_scripts.REMOVE_LISTENER]
+        remove_script.return_value = 1
+
+        removed = await self.queue.remove_listener("some.host_1234")
+
+        self.assertEqual(1, removed)
+
+        remove_script.assert_awaited_with(
+            keys=[
+                "blueque_listeners_some.queue",
+                "blueque_host_listeners_some.queue_some.host",
+                "blueque_queues",
+                "blueque_handed_off_listeners_some.queue_some.host"
+            ],
+            args=["some.host_1234", "some.queue"])
+
+    async def test_subscribe(self):
+        pubsub = self.mock_redis.pubsub.return_value
+
+        subscription = await self.queue.subscribe()
+
+        self.assertIs(pubsub, subscription)
+
+        self.mock_redis.pubsub.assert_called_with(ignore_subscribe_messages=True)
+        pubsub.subscribe.assert_awaited_with("blueque_task_channel_some.queue")
+
+    async def test_index_host_listeners_indexes_listeners_in_batches(self):
+        index_script = self.scripts[redis_scripts.INDEX_HOST_LISTENERS]
+        index_script.side_effect = [2, 0]
+
+        self.mock_redis.sscan_iter.return_value.__aiter__.return_value = [
+            "some.host_1234", "other.host_4321", "some.host_5678"]
+
+        indexed = await self.queue.index_host_listeners(2)
+
+        self.assertEqual(2, indexed)
+
+        self.mock_redis.sscan_iter.assert_called_with("blueque_listeners_some.queue", count=2)
+
+        index_script.assert_has_awaits([
+            mock.call(
+                keys=["blueque_listeners_some.queue"],
+                args=["blueque_host_listeners_some.queue_", "some.host_1234", "other.host_4321"]),
+            mock.call(
+                keys=["blueque_listeners_some.queue"],
+                args=["blueque_host_listeners_some.queue_", "some.host_5678"])
+        ])
+
+    async def test_renew_lease(self):
+        renew_script = self.scripts[redis_scripts.RENEW_LEASE]
+        renew_script.return_value = 0
+
+        self.assertFalse(await self.queue.renew_lease("some.host_1234", 30, register=True))
+
+        renew_script.assert_awaited_with(
+            keys=[
+                "blueque_listeners_some.queue",
+                "blueque_host_listeners_some.queue_some.host",
+                "blueque_queues",
+                "blueque_heartbeat_some.queue_some.host_1234",
+                "blueque_leased_listeners_some.queue"
+            ],
+            args=["some.host_1234", "some.queue", 12.34, 30000, 1])
+
+    async def test_recover_expired_leases(self):
+        recover_script = self.scripts[redis_scripts.RECOVER_EXPIRED_LEASES]
+        recover_script.return_value = ["some_task", "other_task"]
+
+        task_ids = await self.queue.recover_expired_leases()
+
+        recover_script.assert_awaited_with(keys=mock.ANY, args=mock.ANY)
+
+        self.assertEqual(["some_task", "other_task"], task_ids)
+
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: recovered tasks with expired leases: "
+            "['some_task', 'other_task']")
+
+    async def test_reclaim_task_moves_first_task(self):
+        reclaim_script = self.scripts[redis_scripts.RECLAIM_TASKS]
+        reclaim_script.return_value = ["some_task"]
+
+        task_id = await self.queue.reclaim_task("some-listener_1", "some-listener_2")
+
+        reclaim_script.assert_awaited_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some-listener_1",
+                "blueque_started_tasks_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=mock.ANY)
+        self.assertEqual(1, reclaim_script.call_args.kwargs["args"][6])
+        self.assertEqual("some_task", task_id)
+
+    async def test_reclaim_tasks_moves_all_tasks(self):
+        reclaim_script = self.scripts[redis_scripts.RECLAIM_TASKS]
+        reclaim_script.return_value = ["some_task", "other_task"]
+
+        task_ids = await self.queue.reclaim_tasks("some-listener_1", "some-listener_2")
+
+        reclaim_script.assert_awaited_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some-listener_1",
+                "blueque_started_tasks_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=mock.ANY)
+        self.assertEqual(0, reclaim_script.call_args.kwargs["args"][6])
+        self.assertEqual(["some_task", "other_task"], task_ids)
+
+    async def test_reclaim_listeners(self):
+        reclaim_script = self.scripts[redis_scripts.RECLAIM_LISTENERS]
+        reclaim_script.return_value = ["some_task"]
+
+        task_ids = await self.queue.reclaim_listeners(["some.host_1111"], "some.host_3333")
+
+        reclaim_script.assert_awaited_with(
+            keys=[
+                "blueque_listeners_some.queue",
+                "blueque_queues",
+                "blueque_events_some.queue",
+                "blueque_started_tasks_some.queue"
+            ],
+            args=mock.ANY)
+        self.assertEqual(["some_task"], task_ids)
+
+    async def test_enqueue(self):
+        pipeline = self._get_pipeline()
+
+        task_id = await self.queue.enqueue("some parameters")
+
+        self.assertEqual("12345678-1234-1234-1234-123456781234", task_id)
+
+        pipeline.hset.assert_called_with(
+            "blueque_task_12345678-1234-1234-1234-123456781234",
+            mapping={
+                "status": "pending",
+                "queue": "some.queue",
+                "parameters": "some parameters",
+                "created": 12.34,
+                "updated": 12.34
+            })
+        pipeline.zincrby.assert_called_with("blueque_queues", 0, "some.queue")
+        pipeline.lpush.assert_called_with(
+            "blueque_pending_tasks_some.queue", "12345678-1234-1234-1234-123456781234")
+        pipeline.publish.assert_called_with("blueque_task_channel_some.queue", "some.queue")
+
+        pipeline.execute.assert_awaited_with()
+
+    async def test_enqueue_many_executes_a_pipeline_per_chunk(self):
+        pipeline = self._get_pipeline()
+
+        task_ids = await self.queue.enqueue_many(["one", "two", "three"], chunk_size=2)
+
+        self.assertEqual(["12345678-1234-1234-1234-123456781234"] * 3, task_ids)
+
+        self.assertEqual(3, pipeline.hset.call_count)
+        self.assertEqual(2, pipeline.lpush.call_count)
+        self.assertEqual(2, pipeline.execute.await_count)
+
+    async def test_schedule(self):
+        pipeline = self._get_pipeline()
+
+        task_id = await self.queue.schedule("some parameters", 23.45)
+
+        self.assertEqual("12345678-1234-1234-1234-123456781234", task_id)
+
+        pipeline.zadd.assert_called_with(
+            "blueque_scheduled_tasks_some.queue",
+            {"12345678-1234-1234-1234-123456781234": 23.45})
+        pipeline.publish.assert_called_with("blueque_schedule_channel", "some.queue")
+
+        pipeline.execute.assert_awaited_with()
+
+    async def test_schedule_past_eta_enqueues(self):
+        pipeline = self._get_pipeline()
+
+        await self.queue.schedule("some parameters", 1.23)
+
+        pipeline.zadd.assert_not_called()
+        pipeline.lpush.assert_called_with(
+            "blueque_pending_tasks_some.queue", "12345678-1234-1234-1234-123456781234")
+
+    async def test_schedule_many(self):
+        pipeline = self._get_pipeline()
+
+        task_ids = await self.queue.schedule_many(
+            [("due", 1.23), ("scheduled", 23.45)], chunk_size=10)
+
+        self.assertEqual(2, len(task_ids))
+
+        pipeline.lpush.assert_called_with(
+            "blueque_pending_tasks_some.queue", "12345678-1234-1234-1234-123456781234")
+        pipeline.zadd.assert_called_with(
+            "blueque_scheduled_tasks_some.queue",
+            {"12345678-1234-1234-1234-123456781234": 23.45})
+
+        pipeline.execute.assert_awaited_once_with()
+
+    async def test_enqueue_due_tasks(self):
+        self.scripts[redis_scripts.ENQUEUE_DUE].return_value = [["some_task"], 3]
+
+        remaining = await self.queue.enqueue_due_tasks(100)
+
+        self.assertEqual(3, remaining)
+
+        self.scripts[redis_scripts.ENQUEUE_DUE].assert_awaited_with(
+            keys=[
+                "blueque_scheduled_tasks_some.queue",
+                "blueque_pending_tasks_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "blueque_task_", 12.34, 100, "blueque_task_channel_some.queue", "some.queue", 10000
+            ])
+
+    async def test_dequeue(self):
+        self.scripts[redis_scripts.DEQUEUE].return_value = "some_task"
+
+        task_id = await self.queue.dequeue("some_node")
+
+        self.assertEqual("some_task", task_id)
+
+        self.scripts[redis_scripts.DEQUEUE].assert_awaited_with(
+            keys=[
+                "blueque_pending_tasks_some.queue",
+                "blueque_reserved_tasks_some.queue_some_node",
+                "blueque_events_some.queue"
+            ],
+            args=["blueque_task_", "some_node", 12.34, 10000])
+
+    async def test_dequeue_with_timeout_blocks(self):
+        self.mock_redis.brpoplpush.return_value = "some_task"
+
+        task_id = await self.queue.dequeue("some_node", timeout=30)
+
+        self.assertEqual("some_task", task_id)
+
+        self.mock_redis.brpoplpush.assert_awaited_with(
+            "blueque_pending_tasks_some.queue", "blueque_reserved_tasks_some.queue_some_node", 30)
+        self.pipeline.hset.assert_called_with(
+            "blueque_task_some_task",
+            mapping={
+                "status": "reserved",
+                "node": "some_node",
+                "updated": 12.34
+            })
+        self.pipeline.xadd.assert_called_with(
+            "blueque_events_some.queue",
+            {"event": "reserved", "task": "some_task", "time": 12.34, "node": "some_node"},
+            maxlen=10000, approximate=True)
+        self.pipeline.execute.assert_awaited_with()
+
+    async def test_dequeue_with_timeout_returns_none_when_no_task(self):
+        self.mock_redis.brpoplpush.return_value = None
+
+        task_id = await self.queue.dequeue("some_node", timeout=30)
+
+        self.assertIsNone(task_id)
+
+        self.mock_redis.pipeline.assert_not_called()
+
+    async def test_start(self):
+        await self.queue.start("some_task", "some_node", 4321)
+
+        self.scripts[redis_scripts.START].assert_awaited_with(
+            keys=[
+                "blueque_started_tasks_some.queue",
+                "blueque_task_some_task",
+                "blueque_events_some.queue"
+            ],
+            args=["some_node 4321 some_task", 4321, 12.34, "some_task", "some_node", 10000])
+
+    @mock.patch("time.perf_counter", side_effect=[1.0, 1.25])
+    async def test_start_is_observed(self, _):
+        metrics = mock.Mock()
+        queue = AsyncRedisQueue("some.queue", self.mock_redis, metrics)
+
+        await queue.start("some_task", "some_node", 4321)
+
+        metrics.observe_operation.assert_called_once_with("some.queue", "start", 0.25, 1)
+
+    async def test_complete(self):
+        await self.queue.complete("some_task", "some_node", 4321, "some result")
+
+        self.scripts[redis_scripts.FINISH].assert_awaited_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some_node",
+                "blueque_started_tasks_some.queue",
+                "blueque_task_some_task",
+                "blueque_complete_tasks_by_time_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "some_task", "some_node 4321 some_task", "complete", "result", "some result", 12.34,
+                "blueque_finished_channel_some_task", "completed", 10000, 0, "some_node", "4321",
+                "blueque_reserved_tasks_some.queue_"
+            ])
+
+    async def test_fail(self):
+        await self.queue.fail("some_task", "some_node", 4321, "some error")
+
+        self.scripts[redis_scripts.FINISH].assert_awaited_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some_node",
+                "blueque_started_tasks_some.queue",
+                "blueque_task_some_task",
+                "blueque_failed_tasks_by_time_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "some_task", "some_node 4321 some_task", "failed", "error", "some error", 12.34,
+                "blueque_finished_channel_some_task", "failed", 10000, 0, "some_node", "4321",
+                "blueque_reserved_tasks_some.queue_"
+            ])
+
+    async def test_record_usage(self):
+        await self.queue.record_usage("some_task", 1.5, 0.25, 2048, 3.75)
+
+        self.scripts[redis_scripts.RECORD_USAGE].assert_awaited_with(
+            keys=["blueque_task_some_task", "blueque_usage_some.queue"],
+            args=[1.5, 0.25, 2048, 3.75])
+
+    async def test_get_usage(self):
+        self.mock_redis.hgetall.return_value = {"tasks": "4", "cpu_user": "6.5"}
+
+        usage = await self.queue.get_usage()
+
+        self.mock_redis.hgetall.assert_awaited_with("blueque_usage_some.queue")
+
+        self.assertEqual(4, usage["tasks"])
+        self.assertEqual(1.625, usage["mean_cpu_user"])
+
+    async def test_get_stats(self):
+        self.scripts[redis_scripts.QUEUE_STATS] = mock.AsyncMock(
+            return_value=[["some.queue", 3, 2, 1, 10, 4, 2, "2.34"]])
+
+        stats = await self.queue.get_stats()
+
+        self.assertEqual({
+            "pending": 3,
+            "scheduled": 2,
+            "started": 1,
+            "complete": 10,
+            "failed": 4,
+            "listeners": 2,
+            "oldest_pending_age": 10.0
+        }, stats)
+
+    async def test_get_many_stats_of_no_queues(self):
+        self.assertEqual({}, await AsyncRedisQueue.get_many_stats(self.mock_redis, []))
+
+        self.assertNotIn(redis_scripts.QUEUE_STATS, self.scripts)
+
+    async def test_delete_task(self):
+        pipeline = self._get_pipeline()
+
+        await self.queue.delete_task("some_task", "complete")
+
+        pipeline.delete.assert_called_with("blueque_task_some_task")
+        pipeline.zrem.assert_called_with(
+            "blueque_complete_tasks_by_time_some.queue", "some_task")
+        pipeline.lrem.assert_called_with("blueque_complete_tasks_some.queue", 1, "some_task")
+
+        pipeline.execute.assert_awaited_with()
+
+    async def test_delete_unfinished_task_raises(self):
+        with self.assertRaises(ValueError):
+            await self.queue.delete_task("some_task", "started")
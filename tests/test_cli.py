@@ -0,0 +1,73 @@
+from blueque import cli
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import unittest
+
+
+class TestCli(unittest.TestCase):
+    @mock.patch("logging.basicConfig")
+    @mock.patch("blueque.cli.Client", autospec=True)
+    def test_runs_scheduler(self, mock_client_class, _):
+        cli.main(["redis://url", "scheduler", "--batch-size", "10", "--lock-timeout", "5"])
+
+        mock_client_class.assert_called_with("redis://url")
+
+        mock_client = mock_client_class.return_value
+        mock_client.get_scheduler.assert_called_with(batch_size=10, lock_timeout=5)
+        mock_client.get_scheduler.return_value.run.assert_called_with()
+
+    @mock.patch("logging.basicConfig")
+    @mock.patch("blueque.cli.Client", autospec=True)
+    def test_scheduler_defaults(self, mock_client_class, _):
+        cli.main(["redis://url", "scheduler"])
+
+        mock_client = mock_client_class.return_value
+        mock_client.get_scheduler.assert_called_with(batch_size=1000, lock_timeout=30)
+
+    @mock.patch("logging.info")
+    @mock.patch("logging.basicConfig")
+    @mock.patch("blueque.cli.Client", autospec=True)
+    def test_migrates_finished_tasks_on_every_queue(self, mock_client_class, _, mock_log_info):
+        mock_client = mock_client_class.return_value
+        mock_client.get_queue_names.return_value = ["some.queue", "other.queue"]
+        mock_client.get_queue.return_value.migrate_finished.side_effect = [3, 0]
+
+        cli.main(["redis://url", "migrate-finished", "--batch-size", "10"])
+
+        mock_client.get_queue.assert_has_calls([
+            mock.call("some.queue"),
+            mock.call().migrate_finished(batch_size=10),
+            mock.call("other.queue"),
+            mock.call().migrate_finished(batch_size=10)
+        ])
+
+        mock_log_info.assert_has_calls([
+            mock.call("Migrated 3 finished tasks on some.queue"),
+            mock.call("Migrated 0 finished tasks on other.queue")
+        ])
+
+    @mock.patch("logging.info")
+    @mock.patch("logging.basicConfig")
+    @mock.patch("blueque.cli.Client", autospec=True)
+    def test_indexes_listeners_on_every_queue(self, mock_client_class, _, mock_log_info):
+        mock_client = mock_client_class.return_value
+        mock_client.get_queue_names.return_value = ["some.queue", "other.queue"]
+        mock_client.get_queue.return_value.index_host_listeners.side_effect = [2, 0]
+
+        cli.main(["redis://url", "index-listeners"])
+
+        mock_client.get_queue.assert_has_calls([
+            mock.call("some.queue"),
+            mock.call().index_host_listeners(batch_size=1000),
+            mock.call("other.queue"),
+            mock.call().index_host_listeners(batch_size=1000)
+        ])
+
+        mock_log_info.assert_has_calls([
+            mock.call("Indexed 2 listeners by host on some.queue"),
+            mock.call("Indexed 0 listeners by host on other.queue")
+        ])
@@ -1,4 +1,5 @@
 from blueque import Client
+from blueque import redis_scripts
 
 try:
     from unittest import mock
@@ -24,3 +25,149 @@ class TestClient(unittest.TestCase):
 
         mock_redis_class.from_url.assert_called_with(
             "redis://url", decode_responses=True, socket_timeout=5)
+
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def test_get_queue_names(self, mock_redis_class):
+        mock_redis = mock_redis_class.from_url.return_value
+        mock_redis.zrange.return_value = ["some.queue", "other.queue"]
+
+        self.client = Client("redis://url")
+
+        self.assertEqual(["some.queue", "other.queue"], self.client.get_queue_names())
+
+        mock_redis.zrange.assert_called_with("blueque_queues", 0, -1)
+
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def test_all_queue_stats(self, mock_redis_class):
+        mock_redis = mock_redis_class.from_url.return_value
+
+        stats_script = mock_redis.register_script.return_value
+        stats_script.return_value = [
+            ["some.queue", 3, 0, 1, 5, 0, 2, None], ["other.queue", 0, 1, 0, 0, 2, 1, None]]
+
+        self.client = Client("redis://url")
+
+        stats = self.client.all_queue_stats()
+
+        self.assertEqual(["some.queue", "other.queue"], list(stats))
+        self.assertEqual(3, stats["some.queue"]["pending"])
+        self.assertEqual(1, stats["other.queue"]["scheduled"])
+        self.assertEqual(1, stats["other.queue"]["listeners"])
+
+        mock_redis.register_script.assert_called_once_with(redis_scripts.QUEUE_STATS)
+        stats_script.assert_called_once_with(keys=["blueque_queues"], args=mock.ANY)
+
+
+class TestWaitForResult(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, mock_redis_class):
+        self.mock_redis = mock_redis_class.from_url.return_value
+        self.mock_pipeline = self.mock_redis.pipeline.return_value.__enter__.return_value
+        self.mock_subscription = self.mock_redis.pubsub.return_value
+        self.mock_subscription.__enter__.return_value = self.mock_subscription
+
+        self.time_patch = mock.patch("time.time", return_value=100)
+        self.mock_time = self.time_patch.start()
+        self.addCleanup(self.time_patch.stop)
+
+        self.client = Client("redis://url")
+
+    def _subscribed(self, count):
+        return {"type": "subscribe", "data": count}
+
+    def _finished(self, task_id):
+        return {"type": "message", "data": task_id}
+
+    def test_returns_task_which_already_finished(self):
+        self.mock_pipeline.execute.return_value = [1, ["complete"]]
+        self.mock_subscription.get_message.side_effect = [self._subscribed(1)]
+
+        task = self.client.wait_for_result("some_task", timeout=10)
+
+        self.assertEqual("some_task", task.id)
+        self.assertEqual("complete", task.status)
+
+        self.mock_redis.pubsub.assert_called_with()
+        self.mock_subscription.subscribe.assert_called_with("blueque_finished_channel_some_task")
+        self.mock_subscription.get_message.assert_called_once_with(timeout=10)
+
+    def test_checks_status_once_subscribed(self):
+        self.mock_pipeline.execute.return_value = [1, ["complete"], 1, ["complete"]]
+        self.mock_subscription.get_message.side_effect = [
+            None, self._subscribed(1), self._subscribed(2)]
+
+        task = self.client.wait_for_any(["first_task", "last_task"])
+
+        self.assertEqual("first_task", task.id)
+
+        self.assertEqual(3, self.mock_subscription.get_message.call_count)
+        self.mock_pipeline.execute.assert_called_once_with()
+
+    def test_waits_for_task_to_finish(self):
+        self.mock_pipeline.execute.return_value = [1, ["started"]]
+        self.mock_subscription.get_message.side_effect = [
+            self._subscribed(1), self._finished("some_task")]
+
+        task = self.client.wait_for_result("some_task")
+
+        self.assertEqual("some_task", task.id)
+
+        self.mock_subscription.get_message.assert_has_calls([
+            mock.call(timeout=None), mock.call(timeout=None)])
+
+    def test_returns_task_which_finished_while_subscribing(self):
+        self.mock_subscription.get_message.side_effect = [
+            self._subscribed(1), self._finished("first_task")]
+
+        task = self.client.wait_for_any(["first_task", "last_task"])
+
+        self.assertEqual("first_task", task.id)
+
+        self.mock_pipeline.execute.assert_not_called()
+
+    def test_returns_none_after_timeout(self):
+        self.mock_pipeline.execute.return_value = [1, ["started"]]
+        self.mock_subscription.get_message.side_effect = [self._subscribed(1), None, None]
+        self.mock_time.side_effect = [100, 100, 101, 104, 110]
+
+        task = self.client.wait_for_result("some_task", timeout=10)
+
+        self.assertIsNone(task)
+
+        self.mock_subscription.get_message.assert_has_calls([
+            mock.call(timeout=10), mock.call(timeout=9), mock.call(timeout=6)])
+
+    def test_returns_none_when_not_subscribed_before_timeout(self):
+        self.mock_subscription.get_message.return_value = None
+        self.mock_time.side_effect = [100, 100, 110]
+
+        task = self.client.wait_for_result("some_task", timeout=10)
+
+        self.assertIsNone(task)
+
+        self.mock_pipeline.execute.assert_not_called()
+
+    def test_wait_for_any_returns_first_finished_task(self):
+        self.mock_pipeline.execute.return_value = [1, ["started"], 0, [None], 1, ["pending"]]
+        self.mock_subscription.get_message.side_effect = [
+            self._subscribed(1), self._subscribed(2), self._subscribed(3),
+            self._finished("last_task")]
+
+        task = self.client.wait_for_any(["first_task", "missing_task", "last_task"], timeout=10)
+
+        self.assertEqual("last_task", task.id)
+
+        self.mock_subscription.subscribe.assert_called_with(
+            "blueque_finished_channel_first_task",
+            "blueque_finished_channel_missing_task",
+            "blueque_finished_channel_last_task")
+
+    def test_wait_for_any_returns_task_which_already_failed(self):
+        self.mock_pipeline.execute.return_value = [1, ["started"], 1, ["failed"]]
+        self.mock_subscription.get_message.side_effect = [
+            self._subscribed(1), self._subscribed(2)]
+
+        task = self.client.wait_for_any(["first_task", "last_task"])
+
+        self.assertEqual("last_task", task.id)
+        self.assertEqual("failed", task.status)
@@ -0,0 +1,85 @@
+from blueque.event_reader import EventReader
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import unittest
+
+
+class TestEventReader(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, redis_class):
+        self.mock_redis = redis_class.return_value
+        self.pipeline = self.mock_redis.pipeline.return_value.__enter__.return_value
+
+    def test_starts_after_newest_event_of_new_streams(self):
+        self.pipeline.execute.return_value = [[("5-0", {"event": "enqueued"})], []]
+
+        reader = EventReader(
+            self.mock_redis, ["some.queue", "new.queue", "saved.queue"],
+            last_ids={"saved.queue": "3-0"})
+
+        self.mock_redis.pipeline.assert_called_with(transaction=False)
+        self.pipeline.xrevrange.assert_has_calls([
+            mock.call("blueque_events_some.queue", count=1),
+            mock.call("blueque_events_new.queue", count=1)
+        ])
+        self.assertEqual(2, self.pipeline.xrevrange.call_count)
+
+        self.assertEqual(
+            {"some.queue": "5-0", "new.queue": "0-0", "saved.queue": "3-0"}, reader.last_ids)
+
+    def test_does_not_look_up_saved_streams(self):
+        EventReader(self.mock_redis, ["some.queue"], last_ids={"some.queue": "3-0"})
+
+        self.assertFalse(self.mock_redis.pipeline.called)
+
+    def test_reads_events_and_tracks_last_ids(self):
+        self.mock_redis.xread.return_value = [
+            ["blueque_events_some.queue", [
+                ("4-0", {"event": "enqueued", "task": "some_task", "time": "12.5"}),
+                ("5-0", {
+                    "event": "started", "task": "some_task", "time": "13.5",
+                    "node": "some_node", "pid": "1234"
+                })
+            ]]
+        ]
+
+        reader = EventReader(
+            self.mock_redis, ["some.queue"], last_ids={"some.queue": "3-0"}, count=10)
+
+        event = next(reader)
+
+        self.mock_redis.xread.assert_called_once_with(
+            {"blueque_events_some.queue": "3-0"}, count=10, block=0)
+
+        self.assertEqual("4-0", event.id)
+        self.assertEqual("some.queue", event.queue)
+        self.assertEqual("enqueued", event.type)
+        self.assertEqual("some_task", event.task_id)
+        self.assertEqual(12.5, event.time)
+        self.assertEqual({}, event.fields)
+
+        self.assertEqual({"some.queue": "4-0"}, reader.last_ids)
+
+        event = next(reader)
+
+        self.assertEqual(1, self.mock_redis.xread.call_count)
+
+        self.assertEqual("started", event.type)
+        self.assertEqual({"node": "some_node", "pid": "1234"}, event.fields)
+
+        self.assertEqual({"some.queue": "5-0"}, reader.last_ids)
+
+    def test_stops_when_timeout_passes_without_events(self):
+        self.mock_redis.xread.return_value = []
+
+        reader = EventReader(
+            self.mock_redis, ["some.queue"], last_ids={"some.queue": "3-0"}, timeout=1.5)
+
+        self.assertEqual([], list(reader))
+
+        self.mock_redis.xread.assert_called_once_with(
+            {"blueque_events_some.queue": "3-0"}, count=100, block=1500)
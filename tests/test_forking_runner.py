@@ -1,4 +1,9 @@
+import os
+import signal
+import socket
 import sys
+import threading
+import time
 
 from blueque import Client
 from blueque import forking_runner
@@ -8,6 +13,11 @@ try:
 except ImportError:
     import mock
 
+try:
+    from blueque.metrics import Metrics
+except ImportError:
+    Metrics = None
+
 import unittest
 
 
@@ -15,18 +25,105 @@ class BreakLoop(RuntimeError):
     pass
 
 
+USAGE = mock.Mock(ru_utime=1.5, ru_stime=0.25, ru_maxrss=2048)
+
+
+class FakeWorkers(object):
+    # Stands in for forked workers: each one is a thread, reading task
+    # IDs from the worker's pipe, and replying to each as it is told.
+    def __init__(self, pids, max_tasks=2, replies=None, exited=()):
+        super(FakeWorkers, self).__init__()
+
+        self._pids = iter(pids)
+        self._max_tasks = max_tasks
+        self._replies = replies or {}
+        self._exited = exited
+        self._pipes = []
+        self._real_pipe = os.pipe
+        self.tasks = {}
+
+    def pipe(self):
+        fds = self._real_pipe()
+        self._pipes.append(fds)
+
+        return fds
+
+    def fork(self):
+        pid = next(self._pids)
+        self.tasks[pid] = []
+
+        (task_read_fd, _), (_, done_write_fd) = self._pipes[-2:]
+
+        if pid not in self._exited:
+            thread = threading.Thread(
+                target=self._run, args=(pid, os.dup(task_read_fd), os.dup(done_write_fd)))
+            thread.daemon = True
+            thread.start()
+
+        return pid
+
+    def _run(self, pid, task_read_fd, done_write_fd):
+        try:
+            with os.fdopen(task_read_fd) as tasks:
+                for _ in range(self._max_tasks):
+                    task_id = tasks.readline().strip()
+                    if not task_id:
+                        break
+
+                    self.tasks[pid].append(task_id)
+
+                    # None exits while running the task.
+                    reply = self._replies.get(task_id, task_id)
+                    if callable(reply):
+                        reply = reply()
+
+                    if reply is None:
+                        break
+
+                    os.write(done_write_fd, (reply + "\n").encode())
+        finally:
+            os.close(done_write_fd)
+
+
 @mock.patch("blueque.client.RedisQueue", autospec=True)
 class TestForkingRunner(unittest.TestCase):
     @mock.patch("redis.StrictRedis", autospec=True)
     def setUp(self, mock_redis_class):
         self.mock_strict_redis = mock_redis_class.from_url.return_value
 
+        self.task_data = {}
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [self.task_data.get(key, {}).get(field) for field in fields]
+
         self.task_callback = mock.Mock()
 
+        # The forked PIDs aren't real, so wait for them by polling.
+        open_pidfd_patch = mock.patch("blueque.forking_runner.open_pidfd", return_value=None)
+        self.mock_open_pidfd = open_pidfd_patch.start()
+        self.addCleanup(open_pidfd_patch.stop)
+
+        poll_interval_patch = mock.patch.object(
+            forking_runner.ForkingRunner, "poll_interval", 0.01)
+        poll_interval_patch.start()
+        self.addCleanup(poll_interval_patch.stop)
+
+        # Children exit straight away, unless they are still running.
+        self.running = set()
+
+        # Orphans from other runners only run while they are in here.
+        self.orphans = set()
+        process_running_patch = mock.patch(
+            "blueque.forking_runner.process_running", side_effect=lambda pid: pid in self.orphans)
+        self.mock_process_running = process_running_patch.start()
+        self.addCleanup(process_running_patch.stop)
+        wait4_patch = mock.patch("os.wait4", side_effect=self._wait4)
+        self.mock_wait4 = wait4_patch.start()
+        self.addCleanup(wait4_patch.stop)
+
         self.client = Client("redis://asdf:1234")
         self.runner = forking_runner.ForkingRunner(self.client, "some.queue", self.task_callback)
 
-    def _get_task(self, **kwargs):
+    def _get_task(self, task_id="some_task", **kwargs):
         task_data = {
             "status": "reserved",
             "parameters": "some params",
@@ -35,31 +132,43 @@ class TestForkingRunner(unittest.TestCase):
 
         task_data.update(kwargs)
 
-        self.mock_strict_redis.hgetall.return_value = task_data
+        self.task_data["blueque_task_" + task_id] = task_data
+
+        return self.client.get_task(task_id)
+
+    def _wait4(self, pid, options):
+        if pid in self.running:
+            return 0, 0, None
 
-        return self.client.get_task("some_task")
+        return pid, 0, USAGE
+
+    def _stop_after(self, runner, task):
+        def listen():
+            runner.stop()
+            return task
+
+        return listen
 
     @mock.patch("logging.info")
     @mock.patch("os.fork", return_value=1234)
-    @mock.patch("os.waitpid", return_value=(1234, 0))
-    def test_run_starts_unstarted_orphan(
-            self, mock_waitpid, mock_fork, mock_info, redis_queue_class):
+    def test_run_starts_unstarted_orphan(self, mock_fork, mock_info, redis_queue_class):
 
         with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
             mock_listener = mock_get_listener.return_value
             mock_listener.listen.side_effect = BreakLoop()
-            mock_listener.claim_orphan.side_effect = [self._get_task(status="reserved"), None]
+            mock_listener.reclaim_all.return_value = [self._get_task(status="reserved")]
 
             try:
                 self.runner.run()
             except BreakLoop:
                 pass
 
-            mock_get_listener.assert_called_with("some.queue")
-            mock_listener.claim_orphan.assert_called_with()
+            mock_get_listener.assert_called_with(
+                "some.queue", dequeue_timeout=None, subscribe=False, lease_timeout=None)
+            mock_listener.reclaim_all.assert_called_once_with()
 
         mock_fork.assert_has_calls([mock.call()])
-        mock_waitpid.assert_has_calls([mock.call(1234, 0)])
+        self.mock_wait4.assert_called_with(1234, os.WNOHANG)
 
         mock_info.assert_has_calls([
             mock.call("Forked task some_task to pid 1234"),
@@ -67,62 +176,149 @@ class TestForkingRunner(unittest.TestCase):
         ])
 
     @mock.patch("logging.info")
-    @mock.patch("os.kill", side_effect=[None, None, OSError])
-    @mock.patch("time.sleep")
-    def test_run_watches_started_orphan(
-            self, mock_sleep, mock_kill, mock_info, redis_queue_class):
+    def test_run_waits_for_started_orphan_before_taking_new_task(
+            self, mock_info, redis_queue_class):
+        self.orphans.add(1111)
+        threading.Timer(0.05, self.orphans.clear).start()
 
         with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
             mock_listener = mock_get_listener.return_value
-            mock_listener.listen.side_effect = BreakLoop()
-            mock_listener.claim_orphan.side_effect = [
-                self._get_task(status="started", pid="1111"), None]
+            mock_listener.reclaim_all.return_value = [
+                self._get_task(status="started", pid="1111")]
 
-            try:
+            def listen():
+                # The orphan was using the only slot.
+                self.assertEqual(set(), self.orphans)
+                raise BreakLoop()
+
+            mock_listener.listen.side_effect = listen
+
+            with self.assertRaises(BreakLoop):
                 self.runner.run()
-            except BreakLoop:
-                pass
 
-            mock_get_listener.assert_called_with("some.queue")
-            mock_listener.claim_orphan.assert_called_with()
+            mock_get_listener.assert_called_with(
+                "some.queue", dequeue_timeout=None, subscribe=False, lease_timeout=None)
+            mock_listener.reclaim_all.assert_called_once_with()
+
+        self.mock_process_running.assert_called_with(1111)
+
+        mock_info.assert_has_calls([
+            mock.call("Waiting for orphaned task some_task in pid 1111"),
+            mock.call("Orphaned task in pid 1111 exited")
+        ])
+
+    @mock.patch("logging.info")
+    def test_run_takes_new_tasks_beside_started_orphans(self, mock_info, redis_queue_class):
+        self.orphans.add(1111)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = [
+                self._get_task(status="started", pid="1111")]
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, concurrency=2, drain_timeout=0,
+                handoff=True)
+            mock_listener.listen.side_effect = lambda: runner.stop()
+
+            runner.run()
+
+        mock_listener.listen.assert_called_once_with()
+        mock_listener.hand_off.assert_called_once_with()
+
+        mock_info.assert_any_call("Stopping, waiting for 1 running tasks")
+
+    @mock.patch("logging.info")
+    def test_run_stops_on_sigterm_while_started_orphans_are_running(
+            self, mock_info, redis_queue_class):
+        self.orphans.add(1111)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = [
+                self._get_task(status="started", pid="1111")]
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, drain_timeout=0, handoff=True)
 
-        mock_kill.assert_has_calls([
-            mock.call(1111, 0), mock.call(1111, 0), mock.call(1111, 0)])
+            timer = threading.Timer(0.1, os.kill, (os.getpid(), signal.SIGTERM))
+            timer.start()
+            self.addCleanup(timer.join)
 
-        mock_sleep.assert_has_calls([mock.call(0.1), mock.call(0.1)])
+            runner.run()
+
+        mock_listener.listen.assert_not_called()
+        mock_listener.hand_off.assert_called_once_with()
 
     @mock.patch("logging.info")
-    @mock.patch("os.kill", side_effect=[OSError, OSError])
-    @mock.patch("time.sleep")
-    def test_run_exhausts_all_orphans(
-            self, mock_sleep, mock_kill, mock_info, redis_queue_class):
+    def test_run_does_not_wait_for_started_orphan_which_already_exited(
+            self, mock_info, redis_queue_class):
+        self.mock_open_pidfd.side_effect = ProcessLookupError
 
         with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
             mock_listener = mock_get_listener.return_value
             mock_listener.listen.side_effect = BreakLoop()
-            mock_listener.claim_orphan.side_effect = [
-                self._get_task(status="started", pid="1111"),
-                self._get_task(status="started", pid="2222"),
-                None]
+            mock_listener.reclaim_all.return_value = [
+                self._get_task(status="started", pid="1111")]
 
-            try:
+            with self.assertRaises(BreakLoop):
                 self.runner.run()
+
+        self.mock_process_running.assert_not_called()
+
+    def test_run_passes_listener_options(self, redis_queue_class):
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, lease_timeout=30, dequeue_timeout=5,
+            subscribe=True)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.listen.side_effect = BreakLoop()
+            mock_listener.reclaim_all.return_value = []
+
+            try:
+                runner.run()
             except BreakLoop:
                 pass
 
-            mock_get_listener.assert_called_with("some.queue")
-            mock_listener.claim_orphan.assert_has_calls([mock.call(), mock.call(), mock.call()])
+            mock_get_listener.assert_called_with(
+                "some.queue", dequeue_timeout=5, subscribe=True, lease_timeout=30)
+
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_runs_reserved_orphans_before_waiting_for_started_ones(
+            self, mock_fork, mock_info, redis_queue_class):
+        self.orphans.update([1111, 2222])
+        # Otherwise the reaper may log its exit between the calls below.
+        self.running.add(1234)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.listen.side_effect = BreakLoop()
+            mock_listener.reclaim_all.return_value = [
+                self._get_task("some_task", status="started", pid="1111"),
+                self._get_task("other_task", status="reserved"),
+                self._get_task("third_task", status="started", pid="2222")]
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, concurrency=4)
+
+            with self.assertRaises(BreakLoop):
+                runner.run()
+
+            mock_listener.reclaim_all.assert_called_once_with()
 
-        mock_kill.assert_has_calls([
-            mock.call(1111, 0), mock.call(2222, 0)])
+        mock_info.assert_has_calls([
+            mock.call("Forked task other_task to pid 1234"),
+            mock.call("Waiting for orphaned task some_task in pid 1111"),
+            mock.call("Waiting for orphaned task third_task in pid 2222")
+        ])
 
     @mock.patch("logging.info")
     @mock.patch("os.fork", return_value=1234)
-    @mock.patch("os.waitpid", return_value=(1234, 0))
-    def test_run_listens_for_and_forks_task(
-            self, mock_waitpid, mock_fork, mock_info, redis_queue_class):
+    def test_run_listens_for_and_forks_task(self, mock_fork, mock_info, redis_queue_class):
         mock_queue = redis_queue_class.return_value
-        mock_queue.get_listeners.return_value = []
+        mock_queue.get_host_listeners.return_value = []
 
         mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
 
@@ -132,107 +328,1259 @@ class TestForkingRunner(unittest.TestCase):
         except BreakLoop:
             pass
 
-        redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis)
+        redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis, None)
 
-        mock_queue.get_listeners.assert_called_with()
+        mock_queue.get_host_listeners.assert_called_with(socket.getfqdn())
         mock_fork.assert_has_calls([mock.call()])
-        mock_waitpid.assert_has_calls([mock.call(1234, 0)])
+        self.mock_wait4.assert_called_with(1234, os.WNOHANG)
 
         mock_info.assert_has_calls([
             mock.call("Forked task some_task to pid 1234"),
             mock.call("Forked task some_task exited with status 0")
         ])
 
-    @mock.patch("os.fork", side_effect=[1234, 4321])
-    @mock.patch("os.waitpid", side_effect=[(1234, 0), (4321, 0)])
-    def test_run_keeps_running_tasks(self, mock_waitpid, mock_fork, redis_queue_class):
+    @mock.patch("logging.info")
+    @mock.patch("time.time", side_effect=[10.0, 12.5])
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_records_usage_of_each_task(
+            self, mock_fork, mock_time, mock_info, redis_queue_class):
         mock_queue = redis_queue_class.return_value
 
-        mock_queue.dequeue.side_effect = ["some_task", "other_task", BreakLoop()]
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
 
         try:
-            # Don't want a real thread.
             self.runner.run()
         except BreakLoop:
             pass
 
-        redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis)
+        mock_queue.record_usage.assert_called_once_with("some_task", 1.5, 0.25, 2048, 2.5)
 
-        mock_fork.assert_has_calls([mock.call(), mock.call()])
-        mock_waitpid.assert_has_calls([mock.call(1234, 0), mock.call(4321, 0)])
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_watches_tasks_with_timeout(
+            self, mock_fork, mock_watchdog_class, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_watchdog = mock_watchdog_class.return_value
+
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, timeout=30, kill_grace_period=5)
+
+        try:
+            runner.run()
+        except BreakLoop:
+            pass
+
+        mock_watchdog_class.assert_called_with(self.client, 5, None, mock.ANY, mock.ANY)
 
+        mock_watchdog.watch.assert_called_once_with(1234, mock.ANY, 30, None)
+        self.assertEqual("some_task", mock_watchdog.watch.call_args.args[1].id)
+
+        mock_watchdog.unwatch.assert_called_once_with(1234, "some_task")
+
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
     @mock.patch("os.fork", return_value=1234)
-    def test_fork_task_returns_pid_in_parent(self, mock_fork, redis_queue_class):
-        task = self._get_task()
+    def test_run_unwatches_tasks_which_finished_while_waiting_for_new_ones(
+            self, mock_fork, mock_watchdog_class, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_watchdog = mock_watchdog_class.return_value
 
-        pid = self.runner.fork_task(task)
+        self.running.add(1234)
 
-        self.assertEqual(1234, pid)
+        def dequeue(node_id, timeout=None):
+            if mock_queue.dequeue.call_count == 1:
+                return "some_task"
 
-    @mock.patch("logging.shutdown")
-    @mock.patch("sys.stdout", wraps=sys.stdout)
-    @mock.patch("sys.stderr", wraps=sys.stderr)
-    @mock.patch("random.seed")
-    @mock.patch("os.getpid", return_value=2222)
-    @mock.patch("os.setsid")
-    @mock.patch("os.fork", return_value=0)
-    @mock.patch("os._exit")
-    def test_fork_task_runs_task_in_child(
-            self, mock_exit, mock_fork, mock_setsid, _, mock_seed, mock_stderr, mock_stdout,
-            mock_log_shutdown, redis_queue_class):
+            if mock_queue.dequeue.call_count == 2:
+                # The task finishes while the runner is waiting for
+                # another.
+                self.running.clear()
+                os.kill(os.getpid(), signal.SIGCHLD)
+                return None
+
+            mock_watchdog.unwatch.assert_called_once_with(1234, "some_task")
+
+            raise BreakLoop()
+
+        mock_queue.dequeue.side_effect = dequeue
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, concurrency=2, timeout=1)
+
+        with self.assertRaises(BreakLoop):
+            runner.run()
+
+        mock_watchdog.unwatch.assert_called_once_with(1234, "some_task")
+
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_uses_task_timeout_over_default(
+            self, mock_fork, mock_watchdog_class, redis_queue_class):
         mock_queue = redis_queue_class.return_value
-        self.task_callback.return_value = "some result"
+        mock_watchdog = mock_watchdog_class.return_value
 
-        task = self._get_task()
+        self._get_task(timeout="2.5")
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
 
-        self.runner.fork_task(task)
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, timeout=30)
 
-        mock_seed.assert_called_with()
+        try:
+            runner.run()
+        except BreakLoop:
+            pass
 
-        mock_setsid.assert_called_with()
+        mock_watchdog.watch.assert_called_once_with(1234, mock.ANY, 2.5, None)
 
-        mock_queue.start.assert_called_with("some_task", "some.host_1111", 2222)
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
+    @mock.patch("logging.info")
+    def test_run_watches_adopted_orphans_from_when_they_started(
+            self, mock_info, mock_watchdog_class, redis_queue_class):
+        mock_watchdog = mock_watchdog_class.return_value
 
-        self.task_callback.assert_called_with(task)
+        self.orphans.add(1111)
+        threading.Timer(0.05, self.orphans.clear).start()
 
-        mock_queue.complete.assert_called_with("some_task", "some.host_1111", 2222, "some result")
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = [
+                self._get_task(status="started", pid="1111", started="100.5")]
 
-        mock_log_shutdown.assert_called_with()
-        mock_stdout.flush.assert_called_with()
-        mock_stderr.flush.assert_called_with()
+            def listen():
+                self.assertEqual(set(), self.orphans)
+                raise BreakLoop()
 
-        mock_exit.assert_called_with(0)
+            mock_listener.listen.side_effect = listen
 
-    @mock.patch("logging.shutdown")
-    @mock.patch("sys.stdout", wraps=sys.stdout)
-    @mock.patch("sys.stderr", wraps=sys.stderr)
-    @mock.patch("os.getpid", return_value=2222)
-    @mock.patch("os.setsid")
-    @mock.patch("os.fork", return_value=0)
-    @mock.patch("os._exit")
-    def test_fork_task_fails_task_on_exception(
-            self, mock_exit, mock_fork, mock_setsid, _, mock_stderr, mock_stdout,
-            mock_log_shutdown, redis_queue_class):
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, timeout=30)
+
+            with self.assertRaises(BreakLoop):
+                runner.run()
+
+        mock_watchdog.watch.assert_called_once_with(1111, mock.ANY, 30, 100.5)
+        self.assertEqual("some_task", mock_watchdog.watch.call_args.args[1].id)
+
+        mock_watchdog.unwatch.assert_called_once_with(1111, "some_task")
+
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_does_not_watch_tasks_without_timeout(
+            self, mock_fork, mock_watchdog_class, redis_queue_class):
         mock_queue = redis_queue_class.return_value
+        mock_watchdog = mock_watchdog_class.return_value
 
-        callback_exception = Exception("some error")
-        self.task_callback.side_effect = callback_exception
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
 
-        task = self._get_task()
+        runner = forking_runner.ForkingRunner(self.client, "some.queue", self.task_callback)
 
-        self.runner.fork_task(task)
+        try:
+            runner.run()
+        except BreakLoop:
+            pass
 
-        mock_setsid.assert_called_with()
+        mock_watchdog.watch.assert_not_called()
 
-        mock_queue.start.assert_called_with("some_task", "some.host_1111", 2222)
+    @mock.patch("logging.info")
+    def test_run_removes_listener_when_stopped(self, mock_info, redis_queue_class):
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+            mock_listener.listen.side_effect = lambda: self.runner.stop()
 
-        self.task_callback.assert_called_with(task)
+            self.runner.run()
 
-        mock_queue.fail.assert_called_with(
-            "some_task", "some.host_1111", 2222, str(callback_exception))
+        mock_listener.stop.assert_called_with()
+        mock_listener.remove.assert_called_once_with()
+        mock_listener.hand_off.assert_not_called()
 
-        mock_log_shutdown.assert_called_with()
-        mock_stdout.flush.assert_called_with()
-        mock_stderr.flush.assert_called_with()
+        mock_info.assert_has_calls([
+            mock.call("Stopping, waiting for 0 running tasks"),
+            mock.call("Stopped")
+        ])
+
+    @mock.patch("logging.info")
+    def test_run_stops_on_sigterm_and_restores_handlers(self, mock_info, redis_queue_class):
+        previous_handler = signal.getsignal(signal.SIGTERM)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+            mock_listener.listen.side_effect = lambda: os.kill(os.getpid(), signal.SIGTERM)
+
+            self.runner.run()
+
+        mock_listener.stop.assert_called_with()
+        mock_listener.remove.assert_called_once_with()
+
+        self.assertIs(previous_handler, signal.getsignal(signal.SIGTERM))
+
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_waits_for_running_tasks_before_removing_listener(
+            self, mock_fork, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+
+        # The task finishes once the runner is stopping.
+        self.running.add(1234)
+        mock_info.side_effect = \
+            lambda message: message.startswith("Stopping") and self.running.clear()
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, concurrency=2)
+            actions = iter([self._get_task, runner.stop])
+            mock_listener.listen.side_effect = lambda: next(actions)()
+
+            runner.run()
+
+        self.mock_wait4.assert_called_with(1234, os.WNOHANG)
+        mock_queue.record_usage.assert_called_once_with("some_task", 1.5, 0.25, 2048, mock.ANY)
+
+        mock_listener.remove.assert_called_once_with()
+
+        mock_info.assert_has_calls([
+            mock.call("Stopping, waiting for 1 running tasks"),
+            mock.call("Forked task some_task exited with status 0"),
+            mock.call("Stopped")
+        ])
+
+    def test_handoff_requires_drain_timeout(self, redis_queue_class):
+        with self.assertRaisesRegex(ValueError, "Handing off tasks requires a drain timeout"):
+            forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, handoff=True)
+
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_hands_off_tasks_still_running_after_drain_timeout(
+            self, mock_fork, mock_info, redis_queue_class):
+        self.running.add(1234)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, concurrency=2, drain_timeout=0,
+                handoff=True)
+            mock_listener.listen.side_effect = self._stop_after(
+                runner, self._get_task(status="started"))
+
+            runner.run()
+
+        mock_fork.assert_called_once_with()
+
+        mock_listener.hand_off.assert_called_once_with()
+        mock_listener.remove.assert_not_called()
+
+        mock_info.assert_any_call("Stopped, handing off running tasks")
+
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_hands_off_tasks_only_once_they_are_started(
+            self, mock_fork, mock_info, redis_queue_class):
+        self.running.add(1234)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+
+            task = self._get_task(status="reserved")
+
+            def start():
+                self.task_data["blueque_task_some_task"]["status"] = "started"
+
+            # The child starts the task after the drain timeout.
+            timer = threading.Timer(0.1, start)
+            mock_listener.hand_off.side_effect = lambda: self.assertFalse(timer.is_alive())
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, drain_timeout=0, handoff=True)
+
+            def listen():
+                timer.start()
+                runner.stop()
+                return task
+
+            mock_listener.listen.side_effect = listen
+
+            runner.run()
+
+        mock_listener.hand_off.assert_called_once_with()
+
+        mock_info.assert_any_call("Waiting for 1 tasks to start before handing them off")
+        mock_info.assert_any_call("Stopped, handing off running tasks")
+
+    @mock.patch("logging.warning")
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_leaves_tasks_still_running_after_drain_timeout(
+            self, mock_fork, mock_info, mock_warning, redis_queue_class):
+        self.running.add(1234)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, concurrency=2,
+                drain_timeout=0.05)
+            mock_listener.listen.side_effect = self._stop_after(runner, self._get_task())
+
+            runner.run()
+
+        # Without a pidfd, it polls for the task exiting.
+        self.assertGreater(self.mock_wait4.call_count, 1)
+
+        mock_listener.hand_off.assert_not_called()
+        mock_listener.remove.assert_not_called()
+
+        mock_warning.assert_called_with(
+            "Stopped with tasks still running, which will be reclaimed as orphans")
+
+    @mock.patch("logging.info")
+    @mock.patch("logging.exception")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_keeps_running_when_usage_cannot_be_recorded(
+            self, mock_fork, mock_exception, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.record_usage.side_effect = RuntimeError("connection lost")
+
+        mock_queue.dequeue.side_effect = ["some_task", "other_task", BreakLoop()]
+
+        try:
+            self.runner.run()
+        except BreakLoop:
+            pass
+
+        self.assertEqual(2, mock_fork.call_count)
+        mock_exception.assert_any_call("Error recording usage of task some_task")
+
+    @mock.patch("os.fork", side_effect=[1234, 4321])
+    def test_run_keeps_running_tasks(self, mock_fork, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+
+        mock_queue.dequeue.side_effect = ["some_task", "other_task", BreakLoop()]
+
+        try:
+            # Don't want a real thread.
+            self.runner.run()
+        except BreakLoop:
+            pass
+
+        redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis, None)
+
+        mock_fork.assert_has_calls([mock.call(), mock.call()])
+        self.mock_wait4.assert_has_calls([
+            mock.call(1234, os.WNOHANG), mock.call(4321, os.WNOHANG)])
+
+    @mock.patch("os.fork", side_effect=[1234, 4321, 5678])
+    def test_run_runs_tasks_concurrently(self, mock_fork, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        self.running.update([1234, 4321])
+
+        def dequeue(node_id, timeout=None):
+            if mock_queue.dequeue.call_count == 3:
+                # Both slots were busy, so we can't have been called
+                # until the first task finished.
+                self.assertNotIn(1234, self.running)
+                self.running.clear()
+                raise BreakLoop()
+
+            if mock_queue.dequeue.call_count == 2:
+                threading.Timer(0.05, self.running.discard, (1234,)).start()
+
+            return "some_task"
+
+        mock_queue.dequeue.side_effect = dequeue
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, concurrency=2)
+
+        with self.assertRaises(BreakLoop):
+            runner.run()
+
+        self.assertEqual(2, mock_fork.call_count)
+        self.assertEqual(
+            ["some_task"] * 2, [call.args[0] for call in mock_queue.record_usage.call_args_list])
+
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_reaps_tasks_which_finished_while_waiting_for_new_ones(
+            self, mock_fork, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        self.running.add(1234)
+
+        def dequeue(node_id, timeout=None):
+            if mock_queue.dequeue.call_count == 1:
+                return "some_task"
+
+            if mock_queue.dequeue.call_count == 2:
+                # The task finishes while the runner is waiting for
+                # another.
+                self.running.clear()
+                os.kill(os.getpid(), signal.SIGCHLD)
+                return None
+
+            self.assertEqual(1, mock_queue.record_usage.call_count)
+
+            raise BreakLoop()
+
+        mock_queue.dequeue.side_effect = dequeue
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, concurrency=2)
+
+        with self.assertRaises(BreakLoop):
+            runner.run()
+
+        mock_info.assert_any_call("Forked task some_task exited with status 0")
+
+    @unittest.skipUnless(hasattr(os, "waitid"), "waitid is not available")
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_does_not_count_time_waiting_for_new_tasks_as_task_duration(
+            self, mock_fork, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        self.running.add(1234)
+
+        def dequeue(node_id, timeout=None):
+            if mock_queue.dequeue.call_count == 1:
+                return "some_task"
+
+            # The task exits, without being reaped, as the runner is
+            # waiting for a new one.
+            self.running.clear()
+            with mock.patch("os.waitid", return_value=mock.Mock()) as mock_waitid:
+                os.kill(os.getpid(), signal.SIGCHLD)
+
+            mock_waitid.assert_called_once_with(
+                os.P_PID, 1234, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+
+            # The queue stays empty for a while after the task exits.
+            time.sleep(0.5)
+
+            raise BreakLoop()
+
+        mock_queue.dequeue.side_effect = dequeue
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, concurrency=2)
+
+        with self.assertRaises(BreakLoop):
+            runner.run()
+
+        duration = mock_queue.record_usage.call_args.args[4]
+        self.assertLess(duration, 0.4)
+
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_reaps_task_once_its_pidfd_is_readable(
+            self, mock_fork, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        pidfd, pidfd_write_fd = os.pipe()
+        self.addCleanup(os.close, pidfd_write_fd)
+
+        self.mock_open_pidfd.return_value = pidfd
+        self.running.add(1234)
+
+        def exit_task():
+            self.running.clear()
+            os.write(pidfd_write_fd, b"\0")
+
+        def dequeue(node_id, timeout=None):
+            if mock_queue.dequeue.call_count == 1:
+                # The task exits while it is using the only slot.
+                threading.Timer(0.05, exit_task).start()
+                return "some_task"
+
+            self.assertEqual(1, mock_queue.record_usage.call_count)
+
+            raise BreakLoop()
+
+        mock_queue.dequeue.side_effect = dequeue
+
+        runner = forking_runner.ForkingRunner(self.client, "some.queue", self.task_callback)
+
+        # It doesn't have to poll for a task with a pidfd.
+        with mock.patch.object(runner, "poll_interval", 60), self.assertRaises(BreakLoop):
+            runner.run()
+
+        self.mock_open_pidfd.assert_called_once_with(1234)
+
+    @mock.patch("logging.info")
+    @mock.patch("os.fork", return_value=1234)
+    def test_run_stops_on_sigterm_while_every_slot_is_busy(
+            self, mock_fork, mock_info, redis_queue_class):
+        self.running.add(1234)
+
+        # Never becomes readable, as the child never exits.
+        pidfd, pidfd_write_fd = os.pipe()
+        self.addCleanup(os.close, pidfd)
+        self.addCleanup(os.close, pidfd_write_fd)
+
+        self.mock_open_pidfd.return_value = pidfd
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+            mock_listener.listen.return_value = self._get_task(status="started")
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, drain_timeout=0, handoff=True)
+
+            timer = threading.Timer(0.1, os.kill, (os.getpid(), signal.SIGTERM))
+            timer.start()
+            self.addCleanup(timer.join)
+
+            runner.run()
+
+        mock_listener.listen.assert_called_once_with()
+        mock_listener.hand_off.assert_called_once_with()
+
+        mock_info.assert_any_call("Stopping, waiting for 1 running tasks")
+
+    @mock.patch("blueque.forking_runner.child_exited", return_value=False)
+    def test_is_running_task_until_its_child_exits(self, mock_child_exited, redis_queue_class):
+        self.runner._children[1234] = (self._get_task(), time.time(), None)
+
+        self.assertTrue(self.runner._is_running(1234, "some_task"))
+        self.assertFalse(self.runner._is_running(1234, "other_task"))
+
+        # It has exited, but has not been reaped yet.
+        mock_child_exited.return_value = True
+
+        self.assertFalse(self.runner._is_running(1234, "some_task"))
+
+        mock_child_exited.assert_called_with(1234)
+
+    @mock.patch("os.fork", return_value=1234)
+    def test_fork_task_returns_pid_in_parent(self, mock_fork, redis_queue_class):
+        task = self._get_task()
+
+        pid = self.runner.fork_task(task)
+
+        self.assertEqual(1234, pid)
+
+    @mock.patch("logging.shutdown")
+    @mock.patch("sys.stdout", wraps=sys.stdout)
+    @mock.patch("sys.stderr", wraps=sys.stderr)
+    @mock.patch("random.seed")
+    @mock.patch("os.getpid", return_value=2222)
+    @mock.patch("os.setsid")
+    @mock.patch("os.fork", return_value=0)
+    @mock.patch("os._exit")
+    def test_fork_task_runs_task_in_child(
+            self, mock_exit, mock_fork, mock_setsid, _, mock_seed, mock_stderr, mock_stdout,
+            mock_log_shutdown, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        self.task_callback.return_value = "some result"
+
+        task = self._get_task()
+
+        self.runner.fork_task(task)
+
+        mock_seed.assert_called_with()
+
+        mock_setsid.assert_called_with()
+
+        mock_queue.start.assert_called_with("some_task", "some.host_1111", 2222)
+
+        self.task_callback.assert_called_with(task)
+
+        mock_queue.complete.assert_called_with(
+            "some_task", "some.host_1111", 2222, "some result", None)
+
+        mock_log_shutdown.assert_called_with()
+        mock_stdout.flush.assert_called_with()
+        mock_stderr.flush.assert_called_with()
+
+        mock_exit.assert_called_with(0)
+
+    @mock.patch("logging.shutdown")
+    @mock.patch("os.getpid", return_value=2222)
+    @mock.patch("os.setsid")
+    @mock.patch("os.fork", return_value=0)
+    @mock.patch("os._exit")
+    def test_fork_task_sets_result_ttl(
+            self, mock_exit, mock_fork, mock_setsid, _, mock_log_shutdown, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        self.task_callback.return_value = "some result"
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, result_ttl=3600)
+
+        runner.fork_task(self._get_task())
+
+        mock_queue.complete.assert_called_with(
+            "some_task", "some.host_1111", 2222, "some result", 3600)
+
+    @mock.patch("logging.shutdown")
+    @mock.patch("sys.stdout", wraps=sys.stdout)
+    @mock.patch("sys.stderr", wraps=sys.stderr)
+    @mock.patch("os.getpid", return_value=2222)
+    @mock.patch("os.setsid")
+    @mock.patch("os.fork", return_value=0)
+    @mock.patch("os._exit")
+    def test_fork_task_fails_task_on_exception(
+            self, mock_exit, mock_fork, mock_setsid, _, mock_stderr, mock_stdout,
+            mock_log_shutdown, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+
+        callback_exception = Exception("some error")
+        self.task_callback.side_effect = callback_exception
+
+        task = self._get_task()
+
+        self.runner.fork_task(task)
+
+        mock_setsid.assert_called_with()
+
+        mock_queue.start.assert_called_with("some_task", "some.host_1111", 2222)
+
+        self.task_callback.assert_called_with(task)
+
+        mock_queue.fail.assert_called_with(
+            "some_task", "some.host_1111", 2222, str(callback_exception), None)
+
+        mock_log_shutdown.assert_called_with()
+        mock_stdout.flush.assert_called_with()
+        mock_stderr.flush.assert_called_with()
+
+        mock_exit.assert_called_with(0)
+
+
+@mock.patch("blueque.client.RedisQueue", autospec=True)
+class TestReusingForkingRunner(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, mock_redis_class):
+        self.mock_strict_redis = mock_redis_class.from_url.return_value
+        self.task_data = {
+            "status": "reserved",
+            "parameters": "some params",
+            "node": "some.host_1111"
+        }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [self.task_data.get(field) for field in fields]
+
+        self.task_callback = mock.Mock()
+
+        self.client = Client("redis://asdf:1234")
+        self.runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, max_tasks_per_child=2)
+
+    def _patch_workers(self, workers):
+        for target, side_effect in (("os.pipe", workers.pipe), ("os.fork", workers.fork)):
+            patcher = mock.patch(target, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @mock.patch("logging.info")
+    @mock.patch("os.waitpid", side_effect=lambda pid, options: (pid, 0))
+    def test_run_sends_tasks_to_workers_until_they_are_retired(
+            self, mock_waitpid, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        mock_queue.dequeue.side_effect = ["some_task", "other_task", "third_task", BreakLoop()]
+
+        workers = FakeWorkers([1234, 4321])
+        self._patch_workers(workers)
+
+        with self.assertRaises(BreakLoop):
+            self.runner.run()
+
+        self.assertEqual(
+            {1234: ["some_task", "other_task"], 4321: ["third_task"]}, workers.tasks)
+
+        # The first worker is retired after running two tasks
+        mock_waitpid.assert_called_once_with(1234, 0)
+
+        mock_info.assert_has_calls([
+            mock.call("Forked worker 1234"),
+            mock.call("Sent task some_task to worker 1234"),
+            mock.call("Worker 1234 finished task some_task"),
+            mock.call("Sent task other_task to worker 1234"),
+            mock.call("Worker 1234 finished task other_task")
+        ])
+        mock_info.assert_has_calls([
+            mock.call("Forked worker 4321"),
+            mock.call("Sent task third_task to worker 4321"),
+            mock.call("Worker 4321 finished task third_task")
+        ])
+        mock_info.assert_any_call("Worker 1234 exited with status 0")
+
+    @mock.patch("logging.info")
+    @mock.patch("logging.error")
+    @mock.patch("os.waitpid", return_value=(1234, 11))
+    def test_run_replaces_worker_which_exits_while_running_task(
+            self, mock_waitpid, mock_error, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        mock_queue.dequeue.side_effect = ["some_task", "other_task", BreakLoop()]
+
+        workers = FakeWorkers([1234, 4321], replies={"some_task": None})
+        self._patch_workers(workers)
+
+        with self.assertRaises(BreakLoop):
+            self.runner.run()
+
+        mock_error.assert_called_with("Worker 1234 exited while running task some_task")
+        mock_waitpid.assert_called_once_with(1234, 0)
+
+        mock_queue.fail.assert_called_once_with(
+            "some_task", "some.host_1111", None, "Worker 1234 exited while running the task",
+            None)
+
+        self.assertEqual({1234: ["some_task"], 4321: ["other_task"]}, workers.tasks)
+
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
+    @mock.patch("logging.info")
+    @mock.patch("logging.error")
+    @mock.patch("os.waitpid", return_value=(1234, 9))
+    def test_run_leaves_failing_task_of_timed_out_worker_to_watchdog(
+            self, mock_waitpid, mock_error, mock_info, mock_watchdog_class, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+        mock_watchdog = mock_watchdog_class.return_value
+
+        # The watchdog killed the worker, and fails its task itself.
+        mock_watchdog.unwatch.return_value = True
+
+        mock_queue.dequeue.side_effect = ["some_task", "other_task", BreakLoop()]
+
+        self._patch_workers(FakeWorkers([1234, 4321], replies={"some_task": None}))
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, max_tasks_per_child=2, timeout=30)
+
+        with self.assertRaises(BreakLoop):
+            runner.run()
+
+        mock_error.assert_called_with("Worker 1234 exited while running task some_task")
+        mock_watchdog.unwatch.assert_any_call(1234, "some_task")
+
+        mock_queue.fail.assert_not_called()
+
+    def test_is_running_only_the_task_a_worker_was_last_given(self, redis_queue_class):
+        done_read_fd, done_write_fd = os.pipe()
+        self.addCleanup(os.close, done_read_fd)
+        self.addCleanup(os.close, done_write_fd)
+
+        worker = forking_runner._Worker(1234, None, done_read_fd)
+        worker.task = self.client.get_task("other_task")
+        self.runner._workers[1234] = worker
+
+        self.assertTrue(self.runner._is_running(1234, "other_task"))
+        self.assertFalse(self.runner._is_running(1234, "some_task"))
+        self.assertFalse(self.runner._is_running(4321, "other_task"))
+
+        # It has finished the task, but has not been reaped yet.
+        os.write(done_write_fd, b"other_task\n")
+
+        self.assertFalse(self.runner._is_running(1234, "other_task"))
+
+        worker.task = None
+
+        self.assertFalse(self.runner._is_running(1234, "other_task"))
+
+    @mock.patch("logging.info")
+    @mock.patch("logging.error")
+    @mock.patch("os.waitpid", return_value=(1234, 0))
+    def test_run_replaces_worker_which_exits_while_idle(
+            self, mock_waitpid, mock_error, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
+
+        workers = FakeWorkers([1234, 4321], exited=[1234])
+        self._patch_workers(workers)
+
+        with self.assertRaises(BreakLoop):
+            self.runner.run()
+
+        mock_error.assert_called_with("Worker 1234 exited while idle")
+        mock_waitpid.assert_called_once_with(1234, 0)
+
+        self.assertEqual({1234: [], 4321: ["some_task"]}, workers.tasks)
+
+    @mock.patch("logging.info")
+    @mock.patch("os.waitpid", side_effect=lambda pid, options: (pid, 0))
+    def test_run_waits_for_busy_workers_and_retires_all_when_stopped(
+            self, mock_waitpid, mock_info, redis_queue_class):
+        # The task finishes once the runner is stopping.
+        stopping = threading.Event()
+        mock_info.side_effect = \
+            lambda message: message.startswith("Stopping") and stopping.set()
+
+        workers = FakeWorkers(
+            [1234], replies={"some_task": lambda: stopping.wait(5) and "some_task"})
+        self._patch_workers(workers)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, concurrency=2,
+                max_tasks_per_child=2)
+
+            actions = iter([lambda: self.client.get_task("some_task"), runner.stop])
+            mock_listener.listen.side_effect = lambda: next(actions)()
+
+            runner.run()
+
+        mock_waitpid.assert_called_once_with(1234, 0)
+
+        mock_listener.remove.assert_called_once_with()
+
+        mock_info.assert_has_calls([
+            mock.call("Stopping, waiting for 1 running tasks"),
+            mock.call("Worker 1234 finished task some_task"),
+            mock.call("Worker 1234 exited with status 0"),
+            mock.call("Stopped")
+        ])
+
+    @mock.patch("logging.info")
+    def test_run_stops_while_every_worker_is_busy(self, mock_info, redis_queue_class):
+        finish = threading.Event()
+        self.addCleanup(finish.set)
+
+        workers = FakeWorkers([1234], replies={"some_task": lambda: finish.wait(5) and None})
+        self._patch_workers(workers)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+            mock_listener.listen.return_value = self.client.get_task("some_task")
+
+            # The worker has started its task before the runner stops.
+            self.task_data["status"] = "started"
+
+            runner = forking_runner.ForkingRunner(
+                self.client, "some.queue", self.task_callback, max_tasks_per_child=2,
+                drain_timeout=0, handoff=True)
+
+            timer = threading.Timer(0.1, runner.stop)
+            timer.start()
+            self.addCleanup(timer.join)
+
+            runner.run()
+
+        mock_listener.listen.assert_called_once_with()
+        mock_listener.hand_off.assert_called_once_with()
+
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
+    @mock.patch("logging.info")
+    @mock.patch("os.waitpid", return_value=(1234, 0))
+    def test_run_watches_workers_while_they_run_tasks(
+            self, mock_waitpid, mock_info, mock_watchdog_class, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+        mock_watchdog = mock_watchdog_class.return_value
+
+        mock_queue.dequeue.side_effect = ["some_task", "other_task", BreakLoop()]
+
+        self._patch_workers(FakeWorkers([1234, 4321]))
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, max_tasks_per_child=2, timeout=30)
+
+        with self.assertRaises(BreakLoop):
+            runner.run()
+
+        self.assertEqual(
+            [mock.call(1234, mock.ANY, 30, None), mock.call(1234, mock.ANY, 30, None)],
+            mock_watchdog.watch.call_args_list)
+        self.assertEqual(
+            [mock.call(1234, "some_task"), mock.call(1234, "other_task")],
+            mock_watchdog.unwatch.call_args_list)
+
+    @mock.patch("blueque.forking_runner._Watchdog", autospec=True)
+    @mock.patch("logging.info")
+    def test_run_unwatches_workers_which_finished_while_waiting_for_new_tasks(
+            self, mock_info, mock_watchdog_class, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+        mock_watchdog = mock_watchdog_class.return_value
+
+        def is_running():
+            with runner._lock:
+                return runner._is_running(1234, "some_task")
+
+        def dequeue(node_id, timeout=None):
+            if mock_queue.dequeue.call_count == 1:
+                return "some_task"
+
+            if mock_queue.dequeue.call_count == 2:
+                # The worker is idle once it has finished, and so must
+                # not be timed out, even before it is reaped.
+                for _ in range(50):
+                    if not is_running():
+                        break
+
+                    time.sleep(0.1)
+
+                self.assertFalse(is_running())
+                mock_watchdog.unwatch.assert_not_called()
+
+                return None
+
+            raise BreakLoop()
+
+        mock_queue.dequeue.side_effect = dequeue
+
+        self._patch_workers(FakeWorkers([1234]))
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, concurrency=2, max_tasks_per_child=2,
+            timeout=1)
+
+        with self.assertRaises(BreakLoop):
+            runner.run()
+
+        mock_watchdog.unwatch.assert_called_once_with(1234, "some_task")
+
+    @mock.patch("logging.shutdown")
+    @mock.patch("sys.stdout", wraps=sys.stdout)
+    @mock.patch("sys.stderr", wraps=sys.stderr)
+    @mock.patch("random.seed")
+    @mock.patch("os.getpid", return_value=2222)
+    @mock.patch("os.setsid")
+    @mock.patch("os.fork", return_value=0)
+    @mock.patch("os._exit")
+    def test_fork_worker_runs_tasks_in_child(
+            self, mock_exit, mock_fork, mock_setsid, _, mock_seed, mock_stderr, mock_stdout,
+            mock_log_shutdown, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        self.task_callback.side_effect = ["some result", Exception("some error")]
+
+        task_read_fd, task_write_fd = os.pipe()
+        os.write(task_write_fd, b"some_task\nother_task\nthird_task\n")
+
+        real_close = os.close
+
+        def close(fd):
+            if fd not in (100, 101):
+                real_close(fd)
+
+        with mock.patch("os.pipe", side_effect=[(task_read_fd, task_write_fd), (100, 101)]), \
+                mock.patch("os.close", side_effect=close), \
+                mock.patch("os.write") as mock_write:
+            self.runner.fork_worker()
+
+        mock_seed.assert_called_with()
+        mock_setsid.assert_called_with()
+
+        mock_queue.start.assert_has_calls([
+            mock.call("some_task", "some.host_1111", 2222),
+            mock.call("other_task", "some.host_1111", 2222)
+        ])
+        mock_queue.complete.assert_called_once_with(
+            "some_task", "some.host_1111", 2222, "some result", None)
+        mock_queue.fail.assert_called_once_with(
+            "other_task", "some.host_1111", 2222, "some error", None)
+
+        # Only runs max_tasks_per_child tasks
+        self.assertEqual(2, self.task_callback.call_count)
+
+        mock_write.assert_has_calls([
+            mock.call(101, b"some_task\n"),
+            mock.call(101, b"other_task\n")
+        ])
+
+        self.assertEqual(
+            ["some_task", "other_task"],
+            [usage_call.args[0] for usage_call in mock_queue.record_usage.call_args_list])
+
+        mock_log_shutdown.assert_called_with()
+        mock_exit.assert_called_with(0)
+
+
+@mock.patch("logging.error")
+@mock.patch("blueque.client.RedisQueue", autospec=True)
+class TestWatchdog(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, mock_redis_class):
+        self.mock_strict_redis = mock_redis_class.from_url.return_value
+
+        self.task_data = {
+            "status": "started",
+            "node": "some.host_1111",
+            "pid": "1234"
+        }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [self.task_data.get(field) for field in fields]
+
+        self.client = Client("redis://asdf:1234")
+        self.is_running = mock.Mock(return_value=True)
+        self.watchdog = forking_runner._Watchdog(
+            self.client, 5, None, threading.Lock(), self.is_running)
+
+    @mock.patch("blueque.forking_runner.wait_for_exit", return_value=True)
+    @mock.patch("os.killpg")
+    def test_expire_terminates_and_fails_task(
+            self, mock_killpg, mock_wait_for_exit, redis_queue_class, mock_error):
+        mock_queue = redis_queue_class.return_value
+
+        self.watchdog._expire(1234, self.client.get_task("some_task"), 30)
+
+        mock_killpg.assert_called_once_with(1234, signal.SIGTERM)
+        mock_wait_for_exit.assert_called_once_with([1234], timeout=5)
+
+        mock_queue.fail.assert_called_once_with(
+            "some_task", "some.host_1111", 1234, "Task timed out after 30 seconds", None)
+
+        mock_error.assert_called_with(
+            "Task some_task timed out after 30 seconds, terminating pid 1234")
+
+        self.is_running.assert_called_once_with(1234, "some_task")
+
+    @mock.patch("blueque.forking_runner.wait_for_exit", return_value=True)
+    @mock.patch("os.killpg")
+    def test_expire_leaves_process_which_is_no_longer_running_task(
+            self, mock_killpg, mock_wait_for_exit, redis_queue_class, mock_error):
+        mock_queue = redis_queue_class.return_value
+
+        # It has been reaped, or given another task.
+        self.is_running.return_value = False
+
+        self.watchdog._expire(1234, self.client.get_task("some_task"), 30)
+
+        mock_killpg.assert_not_called()
+        mock_queue.fail.assert_not_called()
+
+    @mock.patch("blueque.forking_runner.wait_for_exit", return_value=False)
+    @mock.patch("os.killpg")
+    def test_expire_does_not_kill_process_which_finished_task_after_sigterm(
+            self, mock_killpg, mock_wait_for_exit, redis_queue_class, mock_error):
+        self.is_running.side_effect = [True, False]
+
+        self.watchdog._expire(1234, self.client.get_task("some_task"), 30)
+
+        mock_killpg.assert_called_once_with(1234, signal.SIGTERM)
+        mock_wait_for_exit.assert_called_once_with([1234], timeout=5)
+
+    def test_unwatch_returns_whether_task_is_being_timed_out(
+            self, redis_queue_class, mock_error):
+        task = self.client.get_task("some_task")
+
+        def wait_for_exit(pids, timeout=None):
+            self.assertTrue(self.watchdog.unwatch(1234, "some_task"))
+            self.assertFalse(self.watchdog.unwatch(1234, "other_task"))
+
+            return True
+
+        with mock.patch("os.killpg"), \
+                mock.patch("blueque.forking_runner.wait_for_exit", side_effect=wait_for_exit):
+            self.watchdog._expire(1234, task, 30)
+
+        self.assertFalse(self.watchdog.unwatch(1234, "some_task"))
+
+    @mock.patch("blueque.forking_runner.wait_for_exit", return_value=True)
+    @mock.patch("os.killpg")
+    def test_expire_fails_task_which_was_never_started(
+            self, mock_killpg, mock_wait_for_exit, redis_queue_class, mock_error):
+        mock_queue = redis_queue_class.return_value
+
+        self.task_data["status"] = "reserved"
+        del self.task_data["pid"]
+
+        self.watchdog._expire(1234, self.client.get_task("some_task"), 30)
+
+        mock_queue.fail.assert_called_once_with(
+            "some_task", "some.host_1111", None, "Task timed out after 30 seconds", None)
+
+    @mock.patch("blueque.forking_runner.wait_for_exit", side_effect=[False, True])
+    @mock.patch("os.killpg")
+    def test_expire_kills_child_which_ignores_sigterm(
+            self, mock_killpg, mock_wait_for_exit, redis_queue_class, mock_error):
+        mock_queue = redis_queue_class.return_value
+
+        self.watchdog._expire(1234, self.client.get_task("some_task"), 30)
+
+        mock_killpg.assert_has_calls([
+            mock.call(1234, signal.SIGTERM), mock.call(1234, signal.SIGKILL)])
+
+        mock_error.assert_called_with("Pid 1234 did not exit after SIGTERM, killing it")
+        self.assertEqual(1, mock_queue.fail.call_count)
+
+    @mock.patch("blueque.forking_runner.wait_for_exit", return_value=True)
+    @mock.patch("os.killpg", side_effect=ProcessLookupError)
+    def test_expire_does_not_fail_finished_task(
+            self, mock_killpg, mock_wait_for_exit, redis_queue_class, mock_error):
+        mock_queue = redis_queue_class.return_value
+
+        self.task_data["status"] = "complete"
+
+        self.watchdog._expire(1234, self.client.get_task("some_task"), 30)
+
+        mock_queue.fail.assert_not_called()
+
+    def test_expires_tasks_after_their_timeout(self, redis_queue_class, mock_error):
+        expired = threading.Event()
+        task = self.client.get_task("some_task")
+
+        with mock.patch.object(
+                self.watchdog, "_expire", side_effect=lambda *args: expired.set()) as mock_expire:
+            self.watchdog.watch(1234, task, 0.05)
+            self.watchdog.watch(4321, task, 0.01)
+            self.watchdog.unwatch(4321, "some_task")
+
+            self.assertTrue(expired.wait(5))
+
+        mock_expire.assert_called_once_with(1234, task, 0.05)
+
+    def test_expires_tasks_from_when_they_started(self, redis_queue_class, mock_error):
+        expired = threading.Event()
+        task = self.client.get_task("some_task")
+
+        with mock.patch.object(
+                self.watchdog, "_expire", side_effect=lambda *args: expired.set()) as mock_expire:
+            # It has already run for longer than its timeout.
+            self.watchdog.watch(1234, task, 30, time.time() - 31)
+
+            self.assertTrue(expired.wait(5))
+
+        mock_expire.assert_called_once_with(1234, task, 30)
+
+
+@unittest.skipUnless(Metrics is not None, "prometheus_client is not installed")
+@mock.patch("blueque.client.RedisQueue", autospec=True)
+class TestForkingRunnerMetrics(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, mock_redis_class):
+        self.mock_strict_redis = mock_redis_class.from_url.return_value
+
+        task_data = {
+            "status": "reserved",
+            "parameters": "some params",
+            "node": "some.host_1111"
+        }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
+
+        self.task_callback = mock.Mock()
+
+        self.metrics = mock.Mock(spec=Metrics)
+        self.client = Client("redis://asdf:1234", metrics=self.metrics)
+
+    def test_metrics_port_requires_client_with_metrics(self, redis_queue_class):
+        with self.assertRaisesRegex(ValueError, "metrics port requires a Client with metrics"):
+            forking_runner.ForkingRunner(
+                Client("redis://asdf:1234"), "some.queue", self.task_callback, metrics_port=9100)
+
+    @mock.patch("logging.info")
+    def test_run_serves_metrics_until_stopped(self, mock_info, redis_queue_class):
+        mock_server = self.metrics.start_http_server.return_value
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, metrics_port=9100)
+
+        with mock.patch.object(self.client, 'get_listener') as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.reclaim_all.return_value = []
+            mock_listener.listen.side_effect = lambda: runner.stop()
+
+            runner.run()
+
+        self.metrics.start_http_server.assert_called_once_with(9100, "127.0.0.1")
+        mock_server.shutdown.assert_called_once_with()
+        mock_server.server_close.assert_called_once_with()
+
+        mock_info.assert_any_call("Serving metrics on 127.0.0.1:9100")
+
+    @mock.patch("logging.info")
+    @mock.patch("os.wait4", return_value=(1234, 0, USAGE))
+    @mock.patch("blueque.forking_runner.open_pidfd", return_value=None)
+    def test_run_replays_metrics_of_forked_tasks(
+            self, _, mock_wait4, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
+
+        pipes = []
+        real_pipe = os.pipe
+
+        def pipe():
+            fds = real_pipe()
+            pipes.append(fds)
+
+            return fds
+
+        def fork():
+            # The child sends its metrics just before it exits.
+            os.write(pipes[-1][1], b'[["operation", "some.queue", "start", 0.5, 1]]')
+
+            return 1234
+
+        runner = forking_runner.ForkingRunner(self.client, "some.queue", self.task_callback)
+
+        with mock.patch("os.pipe", side_effect=pipe), mock.patch("os.fork", side_effect=fork):
+            with self.assertRaises(BreakLoop):
+                runner.run()
+
+        self.metrics.replay.assert_called_once_with(
+            [["operation", "some.queue", "start", 0.5, 1]])
+
+    @mock.patch("logging.info")
+    def test_run_replays_metrics_of_worker_tasks(self, mock_info, redis_queue_class):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
+
+        workers = FakeWorkers([1234], replies={
+            "some_task": 'some_task [["operation", "some.queue", "start", 0.5, 1]]'})
+
+        runner = forking_runner.ForkingRunner(
+            self.client, "some.queue", self.task_callback, max_tasks_per_child=2)
+
+        with mock.patch("os.pipe", side_effect=workers.pipe), \
+                mock.patch("os.fork", side_effect=workers.fork):
+            with self.assertRaises(BreakLoop):
+                runner.run()
+
+        self.metrics.replay.assert_called_once_with(
+            [["operation", "some.queue", "start", 0.5, 1]])
+
+        mock_info.assert_any_call("Worker 1234 finished task some_task")
+
+    @mock.patch("logging.shutdown")
+    @mock.patch("random.seed")
+    @mock.patch("os.getpid", return_value=2222)
+    @mock.patch("os.setsid")
+    @mock.patch("os.set_blocking")
+    @mock.patch("os.close")
+    @mock.patch("os.pipe", return_value=(20, 21))
+    @mock.patch("os.write")
+    @mock.patch("os.fork", return_value=0)
+    @mock.patch("os._exit")
+    def test_forked_task_sends_its_metrics_to_parent(
+            self, mock_exit, mock_fork, mock_write, mock_pipe, mock_close, mock_set_blocking,
+            mock_setsid, _, mock_seed, mock_log_shutdown, redis_queue_class):
+        self.metrics.stop_recording.return_value = [["operation", "some.queue", "start", 0.5, 1]]
+
+        runner = forking_runner.ForkingRunner(self.client, "some.queue", self.task_callback)
+
+        runner.fork_task(self.client.get_task("some_task"))
+
+        self.metrics.start_recording.assert_called_once_with()
+        self.metrics.stop_recording.assert_called_once_with()
+
+        mock_close.assert_called_with(20)
+        mock_set_blocking.assert_called_with(21, False)
+        mock_write.assert_called_once_with(21, b'[["operation", "some.queue", "start", 0.5, 1]]')
 
         mock_exit.assert_called_with(0)
@@ -0,0 +1,102 @@
+from blueque.heartbeat import Heartbeat
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import threading
+import unittest
+
+
+class TestHeartbeat(unittest.TestCase):
+    def setUp(self):
+        self.mock_redis_queue = mock.Mock()
+
+        self.renewed = threading.Semaphore(0)
+        self.mock_redis_queue.renew_lease.side_effect = \
+            lambda node_id, lease_timeout, register: self.renewed.release() or True
+
+    def test_start_renews_lease_immediately(self):
+        heartbeat = Heartbeat(self.mock_redis_queue, "some_node", 30)
+
+        heartbeat.start()
+        heartbeat.stop()
+
+        self.mock_redis_queue.renew_lease.assert_called_once_with("some_node", 30, False)
+
+    def test_renews_lease_until_stopped(self):
+        heartbeat = Heartbeat(self.mock_redis_queue, "some_node", 0.03)
+
+        heartbeat.start()
+
+        for _ in range(3):
+            self.assertTrue(self.renewed.acquire(timeout=5))
+
+        heartbeat.stop()
+
+        self.mock_redis_queue.renew_lease.assert_called_with("some_node", 0.03, False)
+
+        # Nothing is renewed once stopped.
+        renewals = self.mock_redis_queue.renew_lease.call_count
+        self.assertFalse(self.renewed.acquire(timeout=0.1))
+        self.assertEqual(renewals, self.mock_redis_queue.renew_lease.call_count)
+
+    @mock.patch("logging.exception", autospec=True)
+    def test_keeps_renewing_after_errors(self, mock_log_exception):
+        calls = []
+
+        def renew_lease(node_id, lease_timeout, register):
+            calls.append(node_id)
+            if len(calls) == 2:
+                raise RuntimeError("connection lost")
+            self.renewed.release()
+
+            return True
+
+        self.mock_redis_queue.renew_lease.side_effect = renew_lease
+
+        heartbeat = Heartbeat(self.mock_redis_queue, "some_node", 0.03)
+
+        heartbeat.start()
+
+        for _ in range(2):
+            self.assertTrue(self.renewed.acquire(timeout=5))
+
+        heartbeat.stop()
+
+        mock_log_exception.assert_called_with("Error renewing lease of some_node")
+
+    def test_registers_again_when_asked(self):
+        heartbeat = Heartbeat(self.mock_redis_queue, "some_node", 30, register=True)
+
+        heartbeat.start()
+        heartbeat.stop()
+
+        self.mock_redis_queue.renew_lease.assert_called_once_with("some_node", 30, True)
+
+    @mock.patch("logging.warning", autospec=True)
+    def test_stops_renewing_once_lease_is_lost(self, mock_log_warning):
+        calls = []
+
+        def renew_lease(node_id, lease_timeout, register):
+            calls.append(node_id)
+            self.renewed.release()
+
+            return len(calls) < 2
+
+        self.mock_redis_queue.renew_lease.side_effect = renew_lease
+
+        heartbeat = Heartbeat(self.mock_redis_queue, "some_node", 0.03)
+
+        heartbeat.start()
+
+        for _ in range(2):
+            self.assertTrue(self.renewed.acquire(timeout=5))
+
+        self.assertFalse(self.renewed.acquire(timeout=0.2))
+
+        heartbeat.stop()
+
+        self.assertEqual(2, len(calls))
+        mock_log_warning.assert_called_with("Lease of some_node was lost, no longer renewing it")
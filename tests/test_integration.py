@@ -1,9 +1,22 @@
+import asyncio
 import os
 import redis
+import signal
 import socket
-from unittest import mock, skipUnless, TestCase
+import subprocess
+import threading
+import time
+import warnings
+from unittest import IsolatedAsyncioTestCase, mock, skipUnless, TestCase
 
 import blueque
+import blueque.forking_runner
+import blueque.redis_scheduler
+
+try:
+    from blueque.metrics import Metrics
+except ImportError:
+    Metrics = None
 
 
 @skipUnless("REDIS_URI" in os.environ, "REDIS_URI required to run integration tests.")
@@ -20,6 +33,24 @@ class TestIntegration(TestCase):
         self.worker_client = blueque.Client(os.environ["REDIS_URI"])
         self.worker_listener = self.worker_client.get_listener("QUEUE-NAME")
 
+    def test_reserved_task_can_be_failed(self):
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        task = self.worker_listener.listen()
+
+        # As the watchdog does, when a task times out before it starts.
+        self.worker_client.get_processor(task).fail("Task timed out after 30 seconds")
+
+        task = self.producer_client.get_task(task_id)
+
+        self.assertEqual("failed", task.status)
+        self.assertIsNone(task.pid)
+
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+        self.assertEqual(
+            [], redis_client.lrange(
+                f"blueque_reserved_tasks_QUEUE-NAME_{socket.getfqdn()}_{os.getpid()}", 0, -1))
+
     def test_task_can_be_enqueued_and_return_result(self):
         task_id = self.producer_queue.enqueue("PARAMETERS")
 
@@ -68,10 +99,384 @@ class TestIntegration(TestCase):
 
         self.producer_queue.delete_task(self.producer_client.get_task(task_id))
 
+    def test_finished_tasks_expire_and_can_be_purged(self):
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+
+        task_ids = self.producer_queue.enqueue_many(["FIRST", "SECOND", "THIRD"])
+
+        for result_ttl in (None, None, 60):
+            task = self.worker_listener.listen()
+            processor = self.worker_client.get_processor(task, result_ttl=result_ttl)
+            processor.start(1234)
+            processor.fail("ERROR")
+
+        self.assertEqual(-1, redis_client.pttl(f"blueque_task_{task_ids[0]}"))
+        self.assertGreater(redis_client.pttl(f"blueque_task_{task_ids[2]}"), 0)
+
+        self.assertEqual(0, self.producer_queue.purge_finished(3600))
+        self.assertEqual(3, self.producer_queue.purge_finished(0, batch_size=2))
+
+        for task_id in task_ids:
+            self.assertIsNone(self.producer_client.get_task(task_id).status)
+
+        self.assertEqual(0, redis_client.zcard("blueque_failed_tasks_by_time_QUEUE-NAME"))
+
+    @skipUnless(Metrics is not None, "prometheus_client is not installed")
+    def test_metrics_record_operations_and_task_lifecycle(self):
+        metrics = Metrics()
+        client = blueque.Client(os.environ["REDIS_URI"], metrics=metrics)
+
+        client.get_queue("QUEUE-NAME").enqueue("PARAMETERS")
+
+        task = client.get_listener("QUEUE-NAME").listen()
+
+        processor = client.get_processor(task)
+        processor.start(1234)
+        processor.complete("RESULT")
+
+        for operation in ("enqueue", "dequeue", "start", "complete"):
+            self.assertEqual(1, metrics.registry.get_sample_value(
+                "blueque_operation_duration_seconds_count",
+                {"queue": "QUEUE-NAME", "operation": operation}))
+
+        for name in ("blueque_task_queue_wait_seconds_count",
+                     "blueque_task_start_delay_seconds_count"):
+            self.assertEqual(1, metrics.registry.get_sample_value(name, {"queue": "QUEUE-NAME"}))
+
+        self.assertEqual(1, metrics.registry.get_sample_value(
+            "blueque_task_run_seconds_count", {"queue": "QUEUE-NAME", "status": "complete"}))
+
+    def test_queue_stats(self):
+        self.producer_queue.enqueue_many(["FIRST", "SECOND", "THIRD"])
+        self.producer_queue.schedule("LATER", time.time() + 3600)
+
+        processor = self.worker_client.get_processor(self.worker_listener.listen())
+        processor.start(1234)
+        processor.complete("RESULT")
+
+        processor = self.worker_client.get_processor(self.worker_listener.listen())
+        processor.start(1234)
+
+        stats = self.producer_client.all_queue_stats()["QUEUE-NAME"]
+
+        self.assertEqual(stats["pending"], self.producer_queue.stats()["pending"])
+
+        self.assertEqual(1, stats["pending"])
+        self.assertEqual(1, stats["scheduled"])
+        self.assertEqual(1, stats["started"])
+        self.assertEqual(1, stats["complete"])
+        self.assertEqual(0, stats["failed"])
+        self.assertEqual(1, stats["listeners"])
+        self.assertGreaterEqual(stats["oldest_pending_age"], 0)
+
+    def test_finished_tasks_can_be_listed_by_time(self):
+        task_ids = self.producer_queue.enqueue_many(["FIRST", "SECOND"])
+
+        for task_id in task_ids:
+            processor = self.worker_client.get_processor(self.worker_listener.listen())
+            processor.start(1234)
+            processor.complete("RESULT")
+
+        finished = self.producer_client.get_task(task_ids[1]).updated
+
+        self.assertEqual(task_ids, self.producer_queue.get_finished("complete"))
+        self.assertEqual(task_ids[:1], self.producer_queue.get_finished("complete", limit=1))
+        self.assertEqual(
+            task_ids[1:], self.producer_queue.get_finished("complete", start=finished))
+
+    def test_finished_lists_can_be_migrated(self):
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+
+        task_ids = self.producer_queue.enqueue_many(["FIRST", "SECOND", "THIRD"])
+
+        for task_id in task_ids:
+            processor = self.worker_client.get_processor(self.worker_listener.listen())
+            processor.start(1234)
+            processor.complete("RESULT")
+
+        # Rebuild the list older versions kept, newest first, with a
+        # task which has since expired.
+        redis_client.delete("blueque_complete_tasks_by_time_QUEUE-NAME")
+        redis_client.lpush("blueque_complete_tasks_QUEUE-NAME", "EXPIRED-TASK", *task_ids)
+
+        # Unmigrated tasks can still be deleted and counted, but
+        # aren't listed.
+        self.producer_queue.delete_task(self.producer_client.get_task(task_ids[0]))
+        self.assertEqual([], self.producer_queue.get_finished("complete"))
+        self.assertEqual(0, self.producer_queue.purge_finished(0))
+        self.assertEqual(3, self.producer_client.all_queue_stats()["QUEUE-NAME"]["complete"])
+
+        self.assertEqual(3, self.producer_queue.migrate_finished(batch_size=2))
+
+        self.assertEqual(task_ids[1:], self.producer_queue.get_finished("complete"))
+        self.assertEqual(0, redis_client.exists("blueque_complete_tasks_QUEUE-NAME"))
+
+        # Processors which haven't been upgraded may keep adding to the
+        # list, so it can be migrated again.
+        redis_client.lpush("blueque_complete_tasks_QUEUE-NAME", task_ids[1])
+
+        self.assertEqual(1, self.producer_queue.migrate_finished())
+
+    def test_task_which_runs_past_its_timeout_is_killed_and_failed(self):
+        task_id = self.producer_queue.enqueue("PARAMETERS", timeout=0.1)
+
+        task = self.worker_listener.listen()
+
+        self.assertEqual(0.1, task.timeout)
+
+        process = subprocess.Popen(["sleep", "30"], start_new_session=True)
+        self.addCleanup(process.kill)
+
+        self.worker_client.get_processor(task).start(process.pid)
+
+        watchdog = blueque.forking_runner._Watchdog(
+            self.worker_client, 5, None, threading.Lock(), lambda pid, task_id: True)
+        watchdog.watch(process.pid, task, task.timeout)
+
+        self.assertEqual(-signal.SIGTERM, process.wait(5))
+
+        for _ in range(50):
+            if self.producer_client.get_task(task_id).status == "failed":
+                break
+
+            time.sleep(0.1)
+
+        self.assertEqual("failed", self.producer_client.get_task(task_id).status)
+        self.assertEqual(
+            "Task timed out after 0.1 seconds", self.producer_client.get_task(task_id).error)
+
+    def test_many_tasks_can_be_enqueued_in_order(self):
+        task_ids = self.producer_queue.enqueue_many(
+            (f"PARAMETERS {i}" for i in range(5)), chunk_size=2)
+
+        self.assertEqual(5, len(task_ids))
+
+        for i, task_id in enumerate(task_ids):
+            self.assertEqual("pending", self.producer_client.get_task(task_id).status)
+
+            task = self.worker_listener.listen()
+
+            self.assertEqual(task_id, task.id)
+            self.assertEqual(f"PARAMETERS {i}", task.parameters)
+
+    def test_producer_can_wait_for_result(self):
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+        other_id = self.producer_queue.enqueue("OTHER PARAMETERS")
+
+        self.assertIsNone(self.producer_client.wait_for_result(task_id, timeout=0.1))
+
+        def finish_task():
+            task = self.worker_listener.listen()
+            processor = self.worker_client.get_processor(task)
+            processor.start(123456)
+            processor.complete("RESULT")
+
+        timer = threading.Timer(0.1, finish_task)
+        timer.start()
+
+        task = self.producer_client.wait_for_any([other_id, task_id], timeout=10)
+
+        timer.join()
+
+        self.assertEqual(task_id, task.id)
+        self.assertEqual("complete", task.status)
+        self.assertEqual("RESULT", task.result)
+
+        self.assertEqual(task_id, self.producer_client.wait_for_result(task_id, timeout=10).id)
+
+    def test_many_tasks_can_be_fetched_at_once(self):
+        first_id, last_id = self.producer_queue.enqueue_many(["FIRST", "LAST"])
+
+        self.worker_listener.listen()
+
+        first, missing, last = self.producer_client.get_tasks(
+            [first_id, "MISSING", last_id], chunk_size=2)
+
+        self.assertIsNone(missing)
+
+        self.assertEqual("reserved", first.status)
+        self.assertEqual("FIRST", first.parameters)
+
+        self.assertEqual("pending", last.status)
+        self.assertEqual("LAST", last.parameters)
+
+        first, missing = self.producer_client.get_tasks([first_id, "MISSING"], fields=["status"])
+
+        self.assertEqual("reserved", first.status)
+        self.assertIsNone(missing)
+
+    def test_usage_is_recorded_per_task_and_queue(self):
+        first_id, second_id = self.producer_queue.enqueue_many(["FIRST", "SECOND"])
+
+        for _ in range(2):
+            task = self.worker_listener.listen()
+            processor = self.worker_client.get_processor(task)
+            processor.start(1234)
+            processor.complete("RESULT")
+
+        self.producer_queue.record_usage(first_id, 1.5, 0.5, 2048, 3.0)
+        self.producer_queue.record_usage(second_id, 2.5, 0.5, 4096, 5.0)
+
+        task = self.producer_client.get_task(first_id)
+        self.assertEqual(1.5, task.cpu_user)
+        self.assertEqual(0.5, task.cpu_system)
+        self.assertEqual(2048, task.max_rss)
+        self.assertEqual(3.0, task.duration)
+        self.assertAlmostEqual(task.started - task.created, task.queue_wait, places=3)
+
+        usage = self.producer_queue.get_usage()
+        self.assertEqual(2, usage["tasks"])
+        self.assertEqual(4.0, usage["cpu_user"])
+        self.assertEqual(0.5, usage["mean_cpu_system"])
+        self.assertEqual(4096, usage["max_rss"])
+        self.assertEqual(4.0, usage["mean_duration"])
+        self.assertGreaterEqual(usage["mean_queue_wait"], 0)
+
+        self.producer_queue.delete_task(task)
+        self.assertEqual(0, self.producer_queue.record_usage(first_id, 1.0, 1.0, 1, 1.0))
+        self.assertIsNone(self.producer_client.get_task(first_id).status)
+
+    def test_task_events_can_be_read(self):
+        reader = self.producer_client.get_event_reader(["QUEUE-NAME"], timeout=0.1)
+
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        task = self.worker_listener.listen()
+        processor = self.worker_client.get_processor(task)
+        processor.start(os.getpid())
+        processor.complete("RESULT")
+
+        self.assertEqual(
+            [("enqueued", task_id), ("reserved", task_id), ("started", task_id),
+             ("completed", task_id)],
+            [(event.type, event.task_id) for event in reader])
+
+        other_id = self.producer_queue.enqueue("OTHER")
+
+        reader = self.producer_client.get_event_reader(
+            ["QUEUE-NAME"], last_ids=reader.last_ids, timeout=0.1)
+
+        self.assertEqual([("enqueued", other_id)], [
+            (event.type, event.task_id) for event in reader])
+
+    @mock.patch("time.time")
+    def test_many_tasks_can_be_scheduled(self, mock_time):
+        mock_time.return_value = 1000
+
+        scheduled_id, due_id = self.producer_queue.schedule_many(
+            [("SCHEDULED", 1005), ("DUE", 999)])
+
+        self.assertEqual("scheduled", self.producer_client.get_task(scheduled_id).status)
+        self.assertEqual("pending", self.producer_client.get_task(due_id).status)
+
+        task = self.worker_listener.listen()
+
+        self.assertEqual(due_id, task.id)
+
+        mock_time.return_value = 1005
+
+        self.producer_queue.enqueue_due_tasks()
+
+        task = self.worker_listener.listen()
+
+        self.assertEqual(scheduled_id, task.id)
+        self.assertEqual("SCHEDULED", task.parameters)
+
+    @mock.patch("time.time")
+    def test_due_tasks_are_enqueued_in_batches(self, mock_time):
+        mock_time.return_value = 1000
+
+        task_ids = self.producer_queue.schedule_many(
+            [(f"PARAMETERS {i}", 1001 + i) for i in range(5)])
+
+        mock_time.return_value = 1010
+
+        self.assertEqual(3, self.producer_queue.enqueue_due_tasks(limit=2))
+        self.assertEqual(1, self.producer_queue.enqueue_due_tasks(limit=2))
+        self.assertEqual(0, self.producer_queue.enqueue_due_tasks(limit=2))
+        self.assertEqual(0, self.producer_queue.enqueue_due_tasks(limit=2))
+
+        for task_id in task_ids:
+            self.assertEqual(task_id, self.worker_listener.listen().id)
+
+    @mock.patch("time.time")
+    def test_scheduler_finds_next_eta_and_holds_lock(self, mock_time):
+        mock_time.return_value = 1000
+
+        self.producer_queue.schedule("PARAMETERS", 1005)
+        self.producer_queue.schedule("PARAMETERS", 1002)
+        self.producer_client.get_queue("OTHER-QUEUE").enqueue("PARAMETERS")
+
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"], decode_responses=True)
+        scheduler = blueque.redis_scheduler.RedisScheduler(redis_client)
+
+        self.assertEqual(
+            {"QUEUE-NAME": 1002, "OTHER-QUEUE": None},
+            scheduler.get_next_etas(scheduler.get_queues()))
+
+        self.assertTrue(scheduler.acquire_lock("some_node", 10))
+        self.assertFalse(scheduler.acquire_lock("other_node", 10))
+        self.assertTrue(scheduler.acquire_lock("some_node", 10))
+
+        self.assertFalse(scheduler.release_lock("other_node"))
+        self.assertTrue(scheduler.release_lock("some_node"))
+
+        self.assertTrue(scheduler.acquire_lock("other_node", 10))
+
+    def test_subscribed_listener_is_notified_of_new_task(self):
+        listener = self.worker_client.get_listener("QUEUE-NAME", dequeue_timeout=10, subscribe=True)
+
+        enqueued = []
+        timer = threading.Timer(
+            0.1, lambda: enqueued.append(self.producer_queue.enqueue("PARAMETERS")))
+        timer.start()
+
+        task = listener.listen()
+
+        timer.join()
+
+        self.assertEqual(enqueued[0], task.id)
+        self.assertEqual("PARAMETERS", task.parameters)
+
+    def test_forking_runner_runs_task_in_forked_process(self):
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        runner = blueque.forking_runner.ForkingRunner(
+            self.worker_client, "QUEUE-NAME", lambda task: task.parameters.lower(),
+            dequeue_timeout=1, timeout=30)
+
+        def stop_when_finished():
+            self.producer_client.wait_for_result(task_id, timeout=10)
+            runner.stop()
+
+        stopper = threading.Thread(target=stop_when_finished)
+        stopper.start()
+
+        # Forks while its watchdog thread, and this test's, are running,
+        # which Python 3.12 and later warn about.
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore", "This process .* is multi-threaded", DeprecationWarning)
+
+            runner.run()
+
+        stopper.join()
+
+        task = self.producer_client.get_task(task_id)
+        self.assertEqual("complete", task.status)
+        self.assertEqual("parameters", task.result)
+        self.assertNotEqual(os.getpid(), task.pid)
+
     def test_orphaned_task_can_be_claimed(self):
         task_id = self.producer_queue.enqueue("PARAMETERS")
 
-        pid = os.fork()
+        # Threads left running by other tests may still be there.
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore", "This process .* is multi-threaded", DeprecationWarning)
+
+            pid = os.fork()
+
         if pid == 0:
             listener = self.worker_client.get_listener("QUEUE-NAME")
             task = listener.listen()
@@ -84,12 +489,208 @@ class TestIntegration(TestCase):
         orphaned_task = self.worker_listener.claim_orphan()
 
         self.assertEqual(task_id, orphaned_task.id)
-        self.assertEqual(f"{socket.getfqdn()}_{pid}", self.producer_client.get_task(task_id).node)
+        self.assertEqual(
+            f"{socket.getfqdn()}_{os.getpid()}", self.producer_client.get_task(task_id).node)
         self.assertEqual("started", orphaned_task.status)
 
         self.assertCountEqual(
             [f"{socket.getfqdn()}_{os.getpid()}"], self.producer_queue._redis_queue.get_listeners())
 
+    def test_all_orphans_on_host_can_be_reclaimed_at_once(self):
+        redis_queue = self.producer_queue._redis_queue
+        orphaned_listeners = [f"{socket.getfqdn()}_{pid}" for pid in (999998, 999999)]
+
+        task_ids = self.producer_queue.enqueue_many(["FIRST", "SECOND", "THIRD"])
+
+        for listener in orphaned_listeners:
+            redis_queue.add_listener(listener)
+        redis_queue.add_listener("other.host_999999")
+
+        redis_queue.dequeue(orphaned_listeners[0])
+        redis_queue.dequeue(orphaned_listeners[1])
+        redis_queue.dequeue(orphaned_listeners[1])
+
+        tasks = self.worker_listener.reclaim_all()
+
+        self.assertCountEqual(task_ids, [task.id for task in tasks])
+        self.assertEqual([], self.worker_listener.reclaim_all())
+
+        self.assertCountEqual(
+            [f"{socket.getfqdn()}_{os.getpid()}", "other.host_999999"],
+            redis_queue.get_listeners())
+        self.assertEqual(
+            {f"{socket.getfqdn()}_{os.getpid()}"}, redis_queue.get_host_listeners(socket.getfqdn()))
+
+    def test_orphan_popped_but_not_marked_reserved_is_reclaimed_as_reserved(self):
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+        redis_queue = self.producer_queue._redis_queue
+        orphaned_listener = f"{socket.getfqdn()}_999999"
+
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        # As if the listener died between its blocking pop and marking
+        # the task reserved.
+        redis_queue.add_listener(orphaned_listener)
+        redis_client.brpoplpush(
+            "blueque_pending_tasks_QUEUE-NAME",
+            f"blueque_reserved_tasks_QUEUE-NAME_{orphaned_listener}", 1)
+
+        self.assertEqual("pending", self.producer_client.get_task(task_id).status)
+
+        tasks = self.worker_listener.reclaim_all()
+
+        self.assertEqual([task_id], [task.id for task in tasks])
+        self.assertEqual("reserved", tasks[0].status)
+        self.assertEqual(f"{socket.getfqdn()}_{os.getpid()}", tasks[0].node)
+
+    def test_orphans_of_listeners_registered_before_host_index_can_be_reclaimed(self):
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+        redis_queue = self.producer_queue._redis_queue
+        orphaned_listener = f"{socket.getfqdn()}_999999"
+
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        # As older versions registered listeners.
+        redis_client.sadd("blueque_listeners_QUEUE-NAME", orphaned_listener)
+        redis_queue.dequeue(orphaned_listener)
+
+        self.assertEqual([], self.worker_listener.reclaim_all())
+
+        self.assertEqual(1, self.producer_queue.index_host_listeners(batch_size=1))
+        self.assertEqual(0, self.producer_queue.index_host_listeners())
+
+        self.assertEqual([task_id], [task.id for task in self.worker_listener.reclaim_all()])
+
+    def test_handed_off_tasks_are_reclaimed_while_old_listener_runs(self):
+        redis_queue = self.producer_queue._redis_queue
+
+        # The parent process is certainly still running.
+        old_listener = f"{socket.getfqdn()}_{os.getppid()}"
+
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        redis_queue.add_listener(old_listener)
+        redis_queue.dequeue(old_listener)
+
+        self.assertEqual([], self.worker_listener.reclaim_all())
+
+        redis_queue.hand_off(old_listener)
+
+        self.assertEqual([task_id], [task.id for task in self.worker_listener.reclaim_all()])
+
+        self.assertEqual(set(), redis_queue.get_handed_off_listeners(socket.getfqdn()))
+        self.assertEqual(
+            {f"{socket.getfqdn()}_{os.getpid()}"}, redis_queue.get_host_listeners(socket.getfqdn()))
+
+        self.worker_listener.remove()
+
+        self.assertEqual(set(), redis_queue.get_listeners())
+
+    def test_tasks_of_expired_lease_are_recovered(self):
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        listener = self.worker_client.get_listener("QUEUE-NAME", lease_timeout=0.2)
+
+        task = listener.listen()
+        self.worker_client.get_processor(task).start(1234)
+
+        self.assertEqual([], self.producer_queue.recover_expired_leases())
+
+        # As if the whole node had gone away
+        listener._heartbeat.stop()
+        time.sleep(0.3)
+
+        self.assertEqual([task_id], self.producer_queue.recover_expired_leases())
+        self.assertEqual([], self.producer_queue.recover_expired_leases())
+
+        self.assertEqual(
+            set(), self.producer_queue._redis_queue.get_host_listeners(socket.getfqdn()))
+
+        task = self.producer_client.get_task(task_id)
+        self.assertEqual("pending", task.status)
+        self.assertIsNone(task.node)
+        self.assertIsNone(task.pid)
+
+        self.assertEqual(task_id, self.worker_listener.listen().id)
+
+    def test_listener_registers_again_after_its_lease_was_recovered(self):
+        redis_queue = self.producer_queue._redis_queue
+        listener_id = f"{socket.getfqdn()}_{os.getpid()}"
+
+        first_task_id = self.producer_queue.enqueue("FIRST")
+        redis_queue.renew_lease(listener_id, 0.2, register=True)
+        redis_queue.dequeue(listener_id)
+
+        # As if the listener had stalled for longer than its lease.
+        time.sleep(0.3)
+        self.assertEqual([first_task_id], self.producer_queue.recover_expired_leases())
+
+        # A processor's heartbeat doesn't keep the lost lease.
+        self.assertFalse(redis_queue.renew_lease(listener_id, 0.2))
+
+        # The listener's own heartbeat registers it again.
+        self.assertTrue(redis_queue.renew_lease(listener_id, 0.2, register=True))
+        self.assertEqual({listener_id}, redis_queue.get_host_listeners(socket.getfqdn()))
+
+        self.assertEqual(first_task_id, redis_queue.dequeue(listener_id))
+
+        time.sleep(0.3)
+        self.assertEqual([first_task_id], self.producer_queue.recover_expired_leases())
+
+    def test_reclaimed_tasks_are_recovered_when_lease_expires(self):
+        redis_queue = self.producer_queue._redis_queue
+        orphaned_listener = f"{socket.getfqdn()}_999999"
+
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        redis_queue.add_listener(orphaned_listener)
+        redis_queue.dequeue(orphaned_listener)
+
+        listener = self.worker_client.get_listener("QUEUE-NAME", lease_timeout=0.2)
+
+        task = listener.reclaim_all()[0]
+        self.assertEqual(f"{socket.getfqdn()}_{os.getpid()}", task.node)
+
+        self.worker_client.get_processor(task).start(1234)
+
+        # As if the whole node had gone away
+        listener._heartbeat.stop()
+        time.sleep(0.3)
+
+        self.assertEqual([task_id], self.producer_queue.recover_expired_leases())
+
+        task = self.producer_client.get_task(task_id)
+        self.assertEqual("pending", task.status)
+
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+        self.assertEqual(set(), redis_client.smembers("blueque_started_tasks_QUEUE-NAME"))
+
+    def test_reclaimed_task_can_be_finished_by_its_old_listener(self):
+        redis_queue = self.producer_queue._redis_queue
+        orphaned_listener = f"{socket.getfqdn()}_999999"
+
+        task_id = self.producer_queue.enqueue("PARAMETERS")
+
+        redis_queue.add_listener(orphaned_listener)
+        redis_queue.dequeue(orphaned_listener)
+
+        # The orphaned task keeps running, with its listener's
+        # processor, while another listener adopts it.
+        processor = self.worker_client.get_processor(self.producer_client.get_task(task_id))
+        processor.start(1234)
+
+        self.assertEqual([task_id], [task.id for task in self.worker_listener.reclaim_all()])
+
+        processor.complete("RESULT")
+
+        self.assertEqual("complete", self.producer_client.get_task(task_id).status)
+
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+        self.assertEqual(
+            [], redis_client.lrange(
+                f"blueque_reserved_tasks_QUEUE-NAME_{socket.getfqdn()}_{os.getpid()}", 0, -1))
+        self.assertEqual(set(), redis_client.smembers("blueque_started_tasks_QUEUE-NAME"))
+
     @mock.patch("time.time")
     def test_scheduled_tasks_are_enqueued(self, mock_time):
         mock_time.return_value = 1000
@@ -114,3 +715,66 @@ class TestIntegration(TestCase):
 
         self.assertEqual(task_id, task.id)
         self.assertEqual("PARAMETERS", task.parameters)
+
+
+@skipUnless("REDIS_URI" in os.environ, "REDIS_URI required to run integration tests.")
+class TestAsyncIntegration(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+
+        redis_client = redis.StrictRedis.from_url(os.environ["REDIS_URI"])
+        redis_client.flushdb()
+
+        self.sync_client = blueque.Client(os.environ["REDIS_URI"])
+
+        self.client = blueque.AsyncClient(os.environ["REDIS_URI"])
+        self.queue = self.client.get_queue("QUEUE-NAME")
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+        await super().asyncTearDown()
+
+    async def test_task_can_be_enqueued_and_return_result(self):
+        task_id = await self.queue.enqueue("PARAMETERS")
+
+        self.assertEqual("pending", (await self.client.get_task(task_id)).status)
+
+        listener = await self.client.get_listener("QUEUE-NAME")
+
+        task = await listener.listen()
+
+        self.assertEqual(task_id, task.id)
+        self.assertEqual("PARAMETERS", task.parameters)
+        self.assertEqual("reserved", task.status)
+
+        processor = self.client.get_processor(task)
+
+        await processor.start(123456)
+
+        self.assertEqual("started", self.sync_client.get_task(task_id).status)
+
+        await processor.complete("RESULT")
+
+        task = await self.client.get_task(task_id)
+
+        self.assertEqual("complete", task.status)
+        self.assertEqual("RESULT", task.result)
+
+        await self.queue.delete_task(task)
+
+        self.assertIsNone((await self.client.get_task(task_id)).status)
+
+    async def test_subscribed_listener_is_notified_of_new_task(self):
+        listener = await self.client.get_listener(
+            "QUEUE-NAME", dequeue_timeout=10, subscribe=True)
+
+        async def enqueue_later():
+            await asyncio.sleep(0.1)
+
+            return await self.queue.enqueue("PARAMETERS")
+
+        task, task_id = await asyncio.gather(listener.listen(), enqueue_later())
+
+        self.assertEqual(task_id, task.id)
+        self.assertEqual("PARAMETERS", task.parameters)
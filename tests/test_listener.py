@@ -1,4 +1,5 @@
 from blueque import Client
+from blueque.listener import Listener
 
 try:
     from unittest import mock
@@ -22,18 +23,50 @@ class TestListener(unittest.TestCase):
         self.client = Client("redis://asdf:1234")
         self.listener = self.client.get_listener("some.queue")
 
+    def _kill_all_but(self, running_pid):
+        def kill(pid, signal):
+            if pid != running_pid:
+                raise OSError()
+
+        return kill
+
     def test_listener_adds_itself(self):
         self.mock_redis_queue.add_listener.assert_called_with("somehost.example.com_2314")
 
+    def test_listener_does_not_renew_lease_by_default(self):
+        self.mock_redis_queue.renew_lease.assert_not_called()
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    @mock.patch("blueque.listener.Heartbeat", autospec=True)
+    def test_leased_listener_starts_heartbeat(self, mock_heartbeat_class, _, __):
+        Listener(self.mock_redis_queue, self.client.get_task, lease_timeout=30)
+
+        mock_heartbeat_class.assert_called_with(
+            self.mock_redis_queue, "somehost.example.com_2314", 30, register=True)
+        mock_heartbeat_class.return_value.start.assert_called_with()
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    def test_listener_rejects_dequeue_timeout_which_would_block_for_ever(self, _, __):
+        for dequeue_timeout in (0, -1):
+            with self.assertRaisesRegex(ValueError, "dequeue timeout must be greater than 0"):
+                Listener(
+                    self.mock_redis_queue, self.client.get_task, dequeue_timeout=dequeue_timeout)
+
+        self.assertEqual(1, self.mock_redis_queue.add_listener.call_count)
+
     def test_listener_calls_callback_when_task_in_queue(self):
-        self.mock_strict_redis.hgetall.return_value = {
+        task_data = {
             "parameters": "some parameters"
         }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
         self.mock_redis_queue.dequeue.side_effect = ["some_task"]
 
         task = self.listener.listen()
 
-        self.mock_redis_queue.dequeue.assert_called_with("somehost.example.com_2314")
+        self.mock_redis_queue.dequeue.assert_called_with("somehost.example.com_2314", timeout=None)
 
         self.assertEqual("some_task", task.id)
         self.assertEqual("some parameters", task.parameters)
@@ -44,62 +77,204 @@ class TestListener(unittest.TestCase):
 
         task = self.listener.listen()
 
-        self.mock_redis_queue.dequeue.assert_has_calls(
-            [mock.call("somehost.example.com_2314"), mock.call("somehost.example.com_2314")])
+        self.mock_redis_queue.dequeue.assert_has_calls([
+            mock.call("somehost.example.com_2314", timeout=None),
+            mock.call("somehost.example.com_2314", timeout=None)])
 
         mock_sleep.assert_has_calls([mock.call(1)])
 
         self.assertEqual("some_task", task.id)
 
-    def test_claim_orphan_returns_none_when_there_are_no_listeners(self):
-        self.mock_redis_queue.get_listeners.return_value = []
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    @mock.patch("time.sleep", autospec=True)
+    def test_blocking_listener_does_not_sleep_when_no_task_available(self, mock_sleep, _, __):
+        listener = Listener(self.mock_redis_queue, self.client.get_task, dequeue_timeout=30)
 
-        claimed = self.listener.claim_orphan()
+        self.mock_redis_queue.dequeue.side_effect = [None, "some_task"]
 
-        self.mock_redis_queue.get_listeners.assert_called_with()
-        self.assertIsNone(claimed)
+        task = listener.listen()
 
-    @mock.patch("os.kill")
-    def test_claim_orphan_returns_none_when_there_are_no_listeners_on_this_node(self, mock_kill):
-        self.mock_redis_queue.get_listeners.return_value = ["other-host_4321"]
+        self.mock_redis_queue.dequeue.assert_has_calls([
+            mock.call("somehost.example.com_2314", timeout=30),
+            mock.call("somehost.example.com_2314", timeout=30)])
+
+        mock_sleep.assert_not_called()
+
+        self.assertEqual("some_task", task.id)
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    def test_subscribed_listener_does_not_subscribe_when_task_available(self, _, __):
+        listener = Listener(self.mock_redis_queue, self.client.get_task, subscribe=True)
+
+        self.mock_redis_queue.dequeue.side_effect = ["some_task"]
+
+        task = listener.listen()
+
+        self.mock_redis_queue.dequeue.assert_called_with("somehost.example.com_2314")
+        self.mock_redis_queue.subscribe.assert_not_called()
+
+        self.assertEqual("some_task", task.id)
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    @mock.patch("time.sleep", autospec=True)
+    def test_subscribed_listener_waits_for_notification(self, mock_sleep, _, __):
+        listener = Listener(
+            self.mock_redis_queue, self.client.get_task, dequeue_timeout=30, subscribe=True)
+
+        self.mock_redis_queue.dequeue.side_effect = [None, None, None, "some_task"]
+
+        task = listener.listen()
+
+        self.assertEqual(4, self.mock_redis_queue.dequeue.call_count)
+        self.mock_redis_queue.dequeue.assert_called_with("somehost.example.com_2314")
+
+        subscription = self.mock_redis_queue.subscribe.return_value.__enter__.return_value
+        subscription.get_message.assert_has_calls([mock.call(timeout=1), mock.call(timeout=1)])
+        self.mock_redis_queue.subscribe.return_value.__exit__.assert_called()
+
+        mock_sleep.assert_not_called()
+
+        self.assertEqual("some_task", task.id)
+
+    @mock.patch("time.sleep", autospec=True)
+    def test_stopped_listener_returns_none(self, mock_sleep):
+        self.mock_redis_queue.dequeue.return_value = None
+        mock_sleep.side_effect = lambda _: self.listener.stop()
+
+        self.assertIsNone(self.listener.listen())
+
+        self.assertEqual(1, self.mock_redis_queue.dequeue.call_count)
+
+    @mock.patch("time.sleep", autospec=True)
+    def test_interrupted_listener_returns_none_once(self, mock_sleep):
+        self.mock_redis_queue.dequeue.side_effect = [None, "some_task"]
+        mock_sleep.side_effect = lambda _: self.listener.interrupt()
+
+        self.assertIsNone(self.listener.listen())
+        self.assertEqual("some_task", self.listener.listen().id)
+
+        self.assertEqual(2, self.mock_redis_queue.dequeue.call_count)
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    def test_interrupted_subscribed_listener_returns_none_once(self, _, __):
+        listener = Listener(self.mock_redis_queue, self.client.get_task, subscribe=True)
+
+        self.mock_redis_queue.dequeue.side_effect = [None, None, "some_task"]
+
+        subscription = self.mock_redis_queue.subscribe.return_value.__enter__.return_value
+        subscription.get_message.side_effect = lambda timeout: listener.interrupt()
+
+        self.assertIsNone(listener.listen())
+        self.assertEqual("some_task", listener.listen().id)
+
+        self.assertEqual(3, self.mock_redis_queue.dequeue.call_count)
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    def test_stopped_subscribed_listener_returns_none(self, _, __):
+        listener = Listener(self.mock_redis_queue, self.client.get_task, subscribe=True)
+
+        self.mock_redis_queue.dequeue.return_value = None
+
+        subscription = self.mock_redis_queue.subscribe.return_value.__enter__.return_value
+        subscription.get_message.side_effect = lambda timeout: listener.stop()
+
+        self.assertIsNone(listener.listen())
+
+        self.assertEqual(2, self.mock_redis_queue.dequeue.call_count)
+        self.mock_redis_queue.subscribe.return_value.__exit__.assert_called()
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    def test_subscribed_listener_notices_stop_while_waiting(self, _, __):
+        listener = Listener(self.mock_redis_queue, self.client.get_task, subscribe=True)
+
+        self.mock_redis_queue.dequeue.return_value = None
+
+        def get_message(timeout):
+            if subscription.get_message.call_count == 2:
+                listener.stop()
+
+            return None
+
+        subscription = self.mock_redis_queue.subscribe.return_value.__enter__.return_value
+        subscription.get_message.side_effect = get_message
+
+        self.assertIsNone(listener.listen())
+
+        # It doesn't dequeue again until the notification timeout.
+        self.assertEqual(2, self.mock_redis_queue.dequeue.call_count)
+        subscription.get_message.assert_has_calls([mock.call(timeout=1), mock.call(timeout=1)])
+
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    @mock.patch("blueque.listener.Heartbeat", autospec=True)
+    def test_remove_stops_heartbeat_and_removes_listener(self, mock_heartbeat_class, _, __):
+        listener = Listener(self.mock_redis_queue, self.client.get_task, lease_timeout=30)
+
+        listener.remove()
+
+        mock_heartbeat_class.return_value.stop.assert_called_with()
+        self.mock_redis_queue.remove_listener.assert_called_with("somehost.example.com_2314")
+
+        self.assertIsNone(listener.listen())
+
+    def test_hand_off_leaves_listener_for_next_listener_on_host(self):
+        self.listener.hand_off()
+
+        self.mock_redis_queue.hand_off.assert_called_with("somehost.example.com_2314")
+        self.mock_redis_queue.remove_listener.assert_not_called()
+
+    def test_claim_orphan_returns_none_when_there_are_no_listeners(self):
+        self.mock_redis_queue.get_host_listeners.return_value = []
 
         claimed = self.listener.claim_orphan()
 
-        self.mock_redis_queue.get_listeners.assert_called_with()
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
         self.assertIsNone(claimed)
 
-        mock_kill.assert_not_called()
+    def test_claim_orphan_only_reads_listeners_on_this_node(self):
+        self.mock_redis_queue.get_host_listeners.return_value = []
+
+        self.listener.claim_orphan()
+
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
+        self.mock_redis_queue.get_listeners.assert_not_called()
 
     @mock.patch("os.kill")
     def test_claim_orphan_returns_none_when_listener_is_self(self, mock_kill):
-        self.mock_redis_queue.get_listeners.return_value = ["somehost.example.com_2314"]
+        self.mock_redis_queue.get_host_listeners.return_value = ["somehost.example.com_2314"]
 
         claimed = self.listener.claim_orphan()
 
-        self.mock_redis_queue.get_listeners.assert_called_with()
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
         self.assertIsNone(claimed)
 
         mock_kill.assert_not_called()
 
     @mock.patch("os.kill", return_value=None)
     def test_claim_orphan_returns_none_when_listener_is_running(self, mock_kill):
-        self.mock_redis_queue.get_listeners.return_value = ["somehost.example.com_4321"]
+        self.mock_redis_queue.get_host_listeners.return_value = ["somehost.example.com_4321"]
 
         claimed = self.listener.claim_orphan()
 
-        self.mock_redis_queue.get_listeners.assert_called_with()
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
         self.assertIsNone(claimed)
 
         mock_kill.assert_called_with(4321, 0)
 
     @mock.patch("os.kill", side_effect=OSError)
     def test_claim_orphan_returns_none_when_orphan_claimed(self, mock_kill):
-        self.mock_redis_queue.get_listeners.return_value = ["somehost.example.com_4321"]
+        self.mock_redis_queue.get_host_listeners.return_value = ["somehost.example.com_4321"]
         self.mock_redis_queue.remove_listener.return_value = 0
 
         claimed = self.listener.claim_orphan()
 
-        self.mock_redis_queue.get_listeners.assert_called_with()
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
         self.mock_redis_queue.remove_listener.assert_called_with("somehost.example.com_4321")
         mock_kill.assert_called_with(4321, 0)
 
@@ -107,38 +282,118 @@ class TestListener(unittest.TestCase):
 
     @mock.patch("os.kill", side_effect=OSError)
     def test_claim_orphan_returns_none_when_no_tasks_reserved(self, mock_kill):
-        self.mock_redis_queue.get_listeners.return_value = ["somehost.example.com_4321"]
+        self.mock_redis_queue.get_host_listeners.return_value = ["somehost.example.com_4321"]
         self.mock_redis_queue.remove_listener.return_value = 1
-        self.mock_redis_queue.reclaim_task.return_value = None
+        self.mock_redis_queue.reclaim_tasks.return_value = []
 
         claimed = self.listener.claim_orphan()
 
-        self.mock_redis_queue.get_listeners.assert_called_with()
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
         self.mock_redis_queue.remove_listener.assert_called_with("somehost.example.com_4321")
         mock_kill.assert_called_with(4321, 0)
-        self.mock_redis_queue.reclaim_task.assert_called_with(
+        self.mock_redis_queue.reclaim_tasks.assert_called_with(
             "somehost.example.com_4321", "somehost.example.com_2314")
 
         self.assertIsNone(claimed)
 
     @mock.patch("os.kill", side_effect=OSError)
     def test_claim_orphan_returns_task_when_reclaimed(self, mock_kill):
-        self.mock_redis_queue.get_listeners.return_value = ["somehost.example.com_4321"]
+        self.mock_redis_queue.get_host_listeners.return_value = ["somehost.example.com_4321"]
         self.mock_redis_queue.remove_listener.return_value = 1
-        self.mock_redis_queue.reclaim_task.return_value = "some_task"
+        self.mock_redis_queue.reclaim_tasks.return_value = ["some_task"]
 
-        self.mock_strict_redis.hgetall.return_value = {
+        task_data = {
             "parameters": "some parameters"
         }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
 
         claimed = self.listener.claim_orphan()
 
-        self.mock_redis_queue.get_listeners.assert_called_with()
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
         self.mock_redis_queue.remove_listener.assert_called_with("somehost.example.com_4321")
         mock_kill.assert_called_with(4321, 0)
-        self.mock_redis_queue.reclaim_task.assert_called_with(
+        self.mock_redis_queue.reclaim_tasks.assert_called_with(
             "somehost.example.com_4321", "somehost.example.com_2314")
-        self.mock_strict_redis.hgetall.assert_called_with("blueque_task_some_task")
 
         self.assertIsNotNone(claimed)
         self.assertEqual("some parameters", claimed.parameters)
+
+        self.mock_strict_redis.hmget.assert_called_with("blueque_task_some_task", ["parameters"])
+
+    @mock.patch("os.kill", side_effect=OSError)
+    def test_claim_orphan_returns_each_task_reclaimed_from_listener(self, mock_kill):
+        self.mock_redis_queue.get_host_listeners.return_value = ["somehost.example.com_4321"]
+        self.mock_redis_queue.remove_listener.side_effect = [1, 0]
+        self.mock_redis_queue.reclaim_tasks.return_value = ["some_task", "other_task"]
+
+        first = self.listener.claim_orphan()
+        second = self.listener.claim_orphan()
+        third = self.listener.claim_orphan()
+
+        self.assertEqual("some_task", first.id)
+        self.assertEqual("other_task", second.id)
+        self.assertIsNone(third)
+
+        self.mock_redis_queue.reclaim_tasks.assert_called_once_with(
+            "somehost.example.com_4321", "somehost.example.com_2314")
+
+    @mock.patch("os.kill")
+    def test_reclaim_all_returns_nothing_when_there_are_no_orphans(self, mock_kill):
+        mock_kill.side_effect = self._kill_all_but(4321)
+        self.mock_redis_queue.get_host_listeners.return_value = [
+            "somehost.example.com_2314", "somehost.example.com_4321"]
+
+        self.assertEqual([], self.listener.reclaim_all())
+
+        self.mock_redis_queue.get_host_listeners.assert_called_with("somehost.example.com")
+        self.mock_redis_queue.reclaim_listeners.assert_not_called()
+
+    @mock.patch("os.kill")
+    def test_reclaim_all_reclaims_every_orphaned_listener_at_once(self, mock_kill):
+        mock_kill.side_effect = self._kill_all_but(4321)
+        self.mock_redis_queue.get_host_listeners.return_value = [
+            "somehost.example.com_1111", "somehost.example.com_4321", "somehost.example.com_2222"]
+        self.mock_redis_queue.reclaim_listeners.return_value = [
+            "some_task", "other_task", "third_task"]
+
+        tasks = self.listener.reclaim_all()
+
+        self.assertEqual(["some_task", "other_task", "third_task"], [task.id for task in tasks])
+
+        self.mock_redis_queue.reclaim_listeners.assert_called_once_with(
+            ["somehost.example.com_1111", "somehost.example.com_2222"],
+            "somehost.example.com_2314")
+        self.mock_redis_queue.remove_listener.assert_not_called()
+
+    @mock.patch("os.kill")
+    def test_reclaim_all_reclaims_handed_off_listeners_which_are_still_running(
+            self, mock_kill):
+        self.mock_redis_queue.get_host_listeners.return_value = [
+            "somehost.example.com_1111", "somehost.example.com_4321"]
+        self.mock_redis_queue.get_handed_off_listeners.return_value = {
+            "somehost.example.com_4321"}
+        self.mock_redis_queue.reclaim_listeners.return_value = ["some_task"]
+
+        tasks = self.listener.reclaim_all()
+
+        self.assertEqual(["some_task"], [task.id for task in tasks])
+
+        self.mock_redis_queue.get_handed_off_listeners.assert_called_with("somehost.example.com")
+        self.mock_redis_queue.reclaim_listeners.assert_called_once_with(
+            ["somehost.example.com_4321"], "somehost.example.com_2314")
+
+    @mock.patch("os.kill", side_effect=OSError)
+    def test_reclaim_all_includes_tasks_already_claimed(self, mock_kill):
+        self.mock_redis_queue.get_host_listeners.side_effect = [
+            ["somehost.example.com_1111"], ["somehost.example.com_2222"], []]
+        self.mock_redis_queue.remove_listener.return_value = 1
+        self.mock_redis_queue.reclaim_tasks.return_value = ["some_task", "other_task"]
+        self.mock_redis_queue.reclaim_listeners.return_value = ["third_task"]
+
+        self.assertEqual("some_task", self.listener.claim_orphan().id)
+
+        tasks = self.listener.reclaim_all()
+
+        self.assertEqual(["other_task", "third_task"], [task.id for task in tasks])
+        self.assertIsNone(self.listener.claim_orphan())
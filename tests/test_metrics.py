@@ -0,0 +1,82 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import unittest
+
+try:
+    import prometheus_client
+    from blueque.metrics import Metrics
+except ImportError:
+    prometheus_client = None
+
+
+@unittest.skipUnless(prometheus_client is not None, "prometheus_client is not installed")
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = prometheus_client.CollectorRegistry()
+        self.metrics = Metrics(self.registry)
+
+    def _sample(self, name, **labels):
+        return self.registry.get_sample_value(name, labels)
+
+    def test_observe_operation(self):
+        self.metrics.observe_operation("some.queue", "dequeue", 0.002, 2)
+
+        self.assertEqual(1, self._sample(
+            "blueque_operation_duration_seconds_count", queue="some.queue", operation="dequeue"))
+        self.assertEqual(0.002, self._sample(
+            "blueque_operation_duration_seconds_sum", queue="some.queue", operation="dequeue"))
+        self.assertEqual(2, self._sample(
+            "blueque_redis_round_trips_total", queue="some.queue", operation="dequeue"))
+
+    def test_observe_task_start(self):
+        self.metrics.observe_task_start("some.queue", 10.0, 12.5, 13.0)
+
+        self.assertEqual(
+            2.5, self._sample("blueque_task_queue_wait_seconds_sum", queue="some.queue"))
+        self.assertEqual(
+            0.5, self._sample("blueque_task_start_delay_seconds_sum", queue="some.queue"))
+
+    def test_observe_task_run(self):
+        self.metrics.observe_task_run("some.queue", "failed", 30.0)
+
+        self.assertEqual(30.0, self._sample(
+            "blueque_task_run_seconds_sum", queue="some.queue", status="failed"))
+
+    def test_recorded_observations_are_only_applied_when_replayed(self):
+        self.metrics.start_recording()
+        self.metrics.observe_operation("some.queue", "start", 0.001, 1)
+        self.metrics.observe_task_run("some.queue", "complete", 5.0)
+        recorded = self.metrics.stop_recording()
+
+        self.assertIsNone(self._sample(
+            "blueque_operation_duration_seconds_count", queue="some.queue", operation="start"))
+
+        self.metrics.replay(recorded)
+
+        self.assertEqual(1, self._sample(
+            "blueque_operation_duration_seconds_count", queue="some.queue", operation="start"))
+        self.assertEqual(5.0, self._sample(
+            "blueque_task_run_seconds_sum", queue="some.queue", status="complete"))
+
+    @mock.patch("logging.warning")
+    def test_recording_drops_observations_over_limit(self, mock_warning):
+        self.metrics.max_recorded = 2
+
+        self.metrics.start_recording()
+        for _ in range(5):
+            self.metrics.observe_operation("some.queue", "enqueue", 0.001, 1)
+
+        self.assertEqual(2, len(self.metrics.stop_recording()))
+
+        mock_warning.assert_called_with("Dropped 3 metrics observations")
+
+    @mock.patch("prometheus_client.start_http_server", return_value=(mock.Mock(), mock.Mock()))
+    def test_start_http_server(self, mock_start_http_server):
+        server = self.metrics.start_http_server(9100)
+
+        self.assertEqual(mock_start_http_server.return_value[0], server)
+
+        mock_start_http_server.assert_called_with(9100, "127.0.0.1", registry=self.registry)
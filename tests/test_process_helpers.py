@@ -0,0 +1,92 @@
+from blueque.process_helpers import child_exited, process_running, wait_for_exit
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import errno
+import os
+import subprocess
+import threading
+import time
+import unittest
+
+
+class TestProcessHelpers(unittest.TestCase):
+    def _start_process(self, seconds):
+        process = subprocess.Popen(["sleep", str(seconds)])
+
+        # Reap it as soon as it exits, as its parent would, so that it
+        # doesn't linger as a zombie.
+        reaper = threading.Thread(target=process.wait)
+        reaper.start()
+        self.addCleanup(reaper.join)
+        self.addCleanup(process.kill)
+
+        return process.pid
+
+    def test_process_running(self):
+        self.assertTrue(process_running(os.getpid()))
+
+    @mock.patch("os.kill", side_effect=OSError)
+    def test_process_not_running(self, mock_kill):
+        self.assertFalse(process_running(1234))
+
+        mock_kill.assert_called_with(1234, 0)
+
+    @unittest.skipUnless(hasattr(os, "waitid"), "waitid is not available")
+    def test_child_exited_does_not_reap_child(self):
+        process = subprocess.Popen(["sleep", "0.1"])
+        self.addCleanup(process.kill)
+
+        self.assertFalse(child_exited(process.pid))
+
+        wait_for_exit([process.pid], timeout=5)
+
+        self.assertTrue(child_exited(process.pid))
+        self.assertTrue(child_exited(process.pid))
+
+        self.assertEqual(0, process.wait(5))
+
+    def test_child_exited_is_false_for_other_processes(self):
+        self.assertFalse(child_exited(os.getppid()))
+
+    def test_wait_for_exit_returns_when_nothing_to_wait_for(self):
+        wait_for_exit([])
+
+    @unittest.skipUnless(hasattr(os, "pidfd_open"), "pidfd_open is not available")
+    def test_wait_for_exit_waits_for_all_processes_together(self):
+        pids = [self._start_process(0.2), self._start_process(0.3)]
+
+        start = time.time()
+
+        with mock.patch("time.sleep") as mock_sleep:
+            wait_for_exit(pids)
+
+        # Until the last one exits, but not 0.5 seconds, as it would
+        # be waiting for one, then the other.
+        self.assertGreaterEqual(time.time() - start, 0.25)
+        self.assertLess(time.time() - start, 0.45)
+
+        mock_sleep.assert_not_called()
+
+    def test_wait_for_exit_returns_whether_processes_exited_before_timeout(self):
+        pids = [self._start_process(0.1), self._start_process(5)]
+
+        start = time.time()
+
+        self.assertFalse(wait_for_exit(pids, timeout=0.3))
+        self.assertLess(time.time() - start, 1)
+
+        self.assertTrue(wait_for_exit(pids[:1], timeout=1))
+
+    @mock.patch("os.pidfd_open", create=True, side_effect=OSError(errno.ENOSYS, "ENOSYS"))
+    @mock.patch("time.sleep", autospec=True)
+    @mock.patch("os.kill", side_effect=[None, None, OSError, None, OSError])
+    def test_wait_for_exit_polls_without_pidfds(self, mock_kill, mock_sleep, _):
+        wait_for_exit([1111, 2222], poll_interval=0.5)
+
+        self.assertEqual(5, mock_kill.call_count)
+        mock_sleep.assert_has_calls([mock.call(0.5), mock.call(0.5)])
+        self.assertEqual(2, mock_sleep.call_count)
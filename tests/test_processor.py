@@ -1,4 +1,5 @@
 from blueque import Client
+from blueque.processor import Processor
 
 try:
     from unittest import mock
@@ -15,12 +16,14 @@ class TestProcessor(unittest.TestCase):
         self.mock_redis_queue = mock_redis_queue_class.return_value
         self.mock_strict_redis = mock_strict_redis.from_url.return_value
 
-        self.mock_strict_redis.hgetall.return_value = {
+        task_data = {
             "queue": "some.queue",
             "status": "reserved",
             "node": "host_1234",
             "parameters": "some parameters"
         }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
 
         self.client = Client("redis://asdf:1234")
         self.task = self.client.get_task("some_task")
@@ -38,7 +41,7 @@ class TestProcessor(unittest.TestCase):
         self.processor.complete("some result")
 
         self.mock_redis_queue.complete.assert_called_with(
-            "some_task", "host_1234", 4321, "some result")
+            "some_task", "host_1234", 4321, "some result", None)
 
     def test_fail_marks_task_failed(self):
         # Can't complete an unstarted process
@@ -47,7 +50,87 @@ class TestProcessor(unittest.TestCase):
         self.processor.fail("some error")
 
         self.mock_redis_queue.fail.assert_called_with(
-            "some_task", "host_1234", 4321, "some error")
+            "some_task", "host_1234", 4321, "some error", None)
+
+    def test_start_does_not_renew_lease_by_default(self):
+        self.processor.start(4321)
+
+        self.mock_redis_queue.renew_lease.assert_not_called()
+
+    @mock.patch("blueque.processor.Heartbeat", autospec=True)
+    def test_leased_processor_renews_lease_while_running(self, mock_heartbeat_class):
+        processor = Processor(self.task, self.mock_redis_queue, lease_timeout=30)
+
+        processor.start(4321)
+
+        mock_heartbeat_class.assert_called_with(self.mock_redis_queue, "host_1234", 30)
+        mock_heartbeat_class.return_value.start.assert_called_with()
+
+        processor.complete("some result")
+
+        mock_heartbeat_class.return_value.stop.assert_called_with()
+        self.mock_redis_queue.complete.assert_called_with(
+            "some_task", "host_1234", 4321, "some result", None)
+
+    def test_processor_passes_result_ttl(self):
+        processor = Processor(self.task, self.mock_redis_queue, result_ttl=3600)
+
+        processor.start(4321)
+        processor.fail("some error")
+
+        self.mock_redis_queue.fail.assert_called_with(
+            "some_task", "host_1234", 4321, "some error", 3600)
+
+
+@mock.patch("blueque.client.RedisQueue", autospec=True)
+class TestProcessorMetrics(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, mock_strict_redis):
+        self.mock_strict_redis = mock_strict_redis.from_url.return_value
+
+        self.task_data = {
+            "queue": "some.queue",
+            "status": "reserved",
+            "node": "host_1234",
+            "created": "10",
+            "updated": "12.5"
+        }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [self.task_data.get(field) for field in fields]
+
+        self.metrics = mock.Mock()
+        self.client = Client("redis://asdf:1234", metrics=self.metrics)
+
+    @mock.patch("time.time", side_effect=[13.0, 20.0])
+    def test_observes_task_lifecycle(self, _, redis_queue_class):
+        processor = self.client.get_processor(self.client.get_task("some_task"))
+
+        processor.start(4321)
+        processor.complete("some result")
+
+        self.metrics.observe_task_start.assert_called_once_with("some.queue", 10.0, 12.5, 13.0)
+        self.metrics.observe_task_run.assert_called_once_with("some.queue", "complete", 7.0)
+
+    @mock.patch("time.time", side_effect=[13.0, 20.0])
+    def test_scheduled_task_waits_from_its_eta(self, _, redis_queue_class):
+        self.task_data["eta"] = "11.5"
+
+        processor = self.client.get_processor(self.client.get_task("some_task"))
+
+        processor.start(4321)
+        processor.fail("some error")
+
+        self.metrics.observe_task_start.assert_called_once_with("some.queue", 11.5, 12.5, 13.0)
+        self.metrics.observe_task_run.assert_called_once_with("some.queue", "failed", 7.0)
+
+    def test_does_not_observe_run_time_unless_started(self, redis_queue_class):
+        self.task_data.update({"status": "started", "pid": "4321"})
+
+        processor = self.client.get_processor(self.client.get_task("some_task"))
+
+        processor.fail("some error")
+
+        self.metrics.observe_task_run.assert_not_called()
 
 
 class TestProcessorWithStartedTask(unittest.TestCase):
@@ -63,13 +146,15 @@ class TestProcessorWithStartedTask(unittest.TestCase):
         self.mock_redis_queue = mock_redis_queue_class.return_value
         self.mock_strict_redis = mock_strict_redis.from_url.return_value
 
-        self.mock_strict_redis.hgetall.return_value = {
+        task_data = {
             "queue": "some.queue",
             "status": "reserved",
             "node": "host_1234",
             "pid": 4321,
             "parameters": "some parameters"
         }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
 
         self.client = Client("redis://asdf:1234")
         self.task = self.client.get_task("some_task")
@@ -79,10 +164,10 @@ class TestProcessorWithStartedTask(unittest.TestCase):
         self.processor.complete("some result")
 
         self.mock_redis_queue.complete.assert_called_with(
-            "some_task", "host_1234", 4321, "some result")
+            "some_task", "host_1234", 4321, "some result", None)
 
     def test_fail_marks_task_failed(self):
         self.processor.fail("some error")
 
         self.mock_redis_queue.fail.assert_called_with(
-            "some_task", "host_1234", 4321, "some error")
+            "some_task", "host_1234", 4321, "some error", None)
@@ -21,7 +21,7 @@ class TestQueue(unittest.TestCase):
         self.queue = self.client.get_queue("some.queue")
 
     def test_name_passed_to_redis_queue(self):
-        self.mock_redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis)
+        self.mock_redis_queue_class.assert_called_with("some.queue", self.mock_strict_redis, None)
 
     def test_enqueue_enqueues_task(self):
         self.mock_redis_queue.enqueue.return_value = "task_id"
@@ -29,7 +29,26 @@ class TestQueue(unittest.TestCase):
         task_id = self.queue.enqueue("the parameters")
 
         self.assertEqual("task_id", task_id)
-        self.mock_redis_queue.enqueue.assert_called_with("the parameters")
+        self.mock_redis_queue.enqueue.assert_called_with("the parameters", None)
+
+    def test_enqueue_many_enqueues_tasks(self):
+        self.mock_redis_queue.enqueue_many.return_value = ["task_id", "other_task_id"]
+
+        task_ids = self.queue.enqueue_many(["the parameters", "other parameters"])
+
+        self.assertEqual(["task_id", "other_task_id"], task_ids)
+        self.mock_redis_queue.enqueue_many.assert_called_with(
+            ["the parameters", "other parameters"], 1000, None)
+
+    def test_enqueue_many_passes_chunk_size(self):
+        self.queue.enqueue_many(["the parameters"], chunk_size=10)
+
+        self.mock_redis_queue.enqueue_many.assert_called_with(["the parameters"], 10, None)
+
+    def test_enqueue_passes_timeout(self):
+        self.queue.enqueue("the parameters", timeout=30)
+
+        self.mock_redis_queue.enqueue.assert_called_with("the parameters", 30)
 
     def test_schedule_schedules_task(self):
         self.mock_redis_queue.schedule.return_value = "task_id"
@@ -37,18 +56,97 @@ class TestQueue(unittest.TestCase):
         task_id = self.queue.schedule("some parameters", 24.3)
 
         self.assertEqual("task_id", task_id)
-        self.mock_redis_queue.schedule.assert_called_with("some parameters", 24.3)
+        self.mock_redis_queue.schedule.assert_called_with("some parameters", 24.3, None)
+
+    def test_schedule_many_schedules_tasks(self):
+        self.mock_redis_queue.schedule_many.return_value = ["task_id", "other_task_id"]
+
+        task_ids = self.queue.schedule_many([("some parameters", 24.3), ("other parameters", 1)])
+
+        self.assertEqual(["task_id", "other_task_id"], task_ids)
+        self.mock_redis_queue.schedule_many.assert_called_with(
+            [("some parameters", 24.3), ("other parameters", 1)], 1000, None)
+
+    def test_schedule_many_passes_chunk_size(self):
+        self.queue.schedule_many([("some parameters", 24.3)], chunk_size=10)
+
+        self.mock_redis_queue.schedule_many.assert_called_with(
+            [("some parameters", 24.3)], 10, None)
 
     def test_enqueue_due_tasks_enqueues_due_tasks(self):
-        self.queue.enqueue_due_tasks()
+        self.mock_redis_queue.enqueue_due_tasks.return_value = 0
+
+        remaining = self.queue.enqueue_due_tasks()
+
+        self.assertEqual(0, remaining)
+        self.mock_redis_queue.enqueue_due_tasks.assert_called_with(1000)
+
+    def test_enqueue_due_tasks_passes_limit(self):
+        self.mock_redis_queue.enqueue_due_tasks.return_value = 5
+
+        remaining = self.queue.enqueue_due_tasks(limit=10)
+
+        self.assertEqual(5, remaining)
+        self.mock_redis_queue.enqueue_due_tasks.assert_called_with(10)
+
+    def test_record_usage(self):
+        self.queue.record_usage("some_task", 1.5, 0.25, 2048, 3.75)
+
+        self.mock_redis_queue.record_usage.assert_called_with("some_task", 1.5, 0.25, 2048, 3.75)
+
+    def test_get_usage(self):
+        self.mock_redis_queue.get_usage.return_value = {"tasks": 4}
+
+        self.assertEqual({"tasks": 4}, self.queue.get_usage())
+
+    def test_stats(self):
+        self.mock_redis_queue.get_stats.return_value = {"pending": 4}
+
+        self.assertEqual({"pending": 4}, self.queue.stats())
+
+    def test_recover_expired_leases(self):
+        self.mock_redis_queue.recover_expired_leases.return_value = ["some_task"]
+
+        task_ids = self.queue.recover_expired_leases()
+
+        self.assertEqual(["some_task"], task_ids)
+        self.mock_redis_queue.recover_expired_leases.assert_called_with()
+
+    def test_purge_finished(self):
+        self.mock_redis_queue.purge_finished.return_value = 12
+
+        self.assertEqual(12, self.queue.purge_finished(86400))
+
+        self.mock_redis_queue.purge_finished.assert_called_with(86400, 1000)
+
+    def test_get_finished(self):
+        self.mock_redis_queue.get_finished.return_value = ["some_task"]
+
+        self.assertEqual(["some_task"], self.queue.get_finished("failed", start=10))
+
+        self.mock_redis_queue.get_finished.assert_called_with("failed", 10, "+inf", None)
+
+    def test_migrate_finished(self):
+        self.mock_redis_queue.migrate_finished.return_value = 3
+
+        self.assertEqual(3, self.queue.migrate_finished())
+
+        self.mock_redis_queue.migrate_finished.assert_called_with(1000)
+
+    def test_index_host_listeners(self):
+        self.mock_redis_queue.index_host_listeners.return_value = 2
+
+        self.assertEqual(2, self.queue.index_host_listeners())
 
-        self.mock_redis_queue.enqueue_due_tasks.assert_called_with()
+        self.mock_redis_queue.index_host_listeners.assert_called_with(1000)
 
     def test_delete_deletes_task(self):
-        self.mock_strict_redis.hgetall.return_value = {
+        task_data = {
             "status": "complete",
             "queue": "some.queue"
         }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
 
         task = self.client.get_task("some_task")
 
@@ -57,10 +155,12 @@ class TestQueue(unittest.TestCase):
         self.mock_redis_queue.delete_task.assert_called_with("some_task", "complete")
 
     def test_delete_errors_on_wrong_queue(self):
-        self.mock_strict_redis.hgetall.return_value = {
+        task_data = {
             "status": "complete",
             "queue": "other.queue"
         }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
 
         task = self.client.get_task("some_task")
 
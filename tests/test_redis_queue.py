@@ -1,3 +1,4 @@
+from blueque import redis_scripts
 from blueque.redis_queue import RedisQueue
 
 try:
@@ -31,6 +32,10 @@ class TestRedisQueue(unittest.TestCase):
         self.log_debug = self.log_debug_patch.start()
         self.addCleanup(self.log_debug_patch.stop)
 
+        self.scripts = {}
+        self.mock_redis.register_script.side_effect = \
+            lambda script: self.scripts.setdefault(script, mock.Mock())
+
         self.queue = RedisQueue("some.queue", self.mock_redis)
 
     def _get_pipeline(self):
@@ -39,40 +44,100 @@ class TestRedisQueue(unittest.TestCase):
     def test_add_listener(self):
         pipeline = self._get_pipeline()
 
-        self.queue.add_listener("some_node")
+        self.queue.add_listener("some.host_1234")
 
-        pipeline.sadd.assert_called_with("blueque_listeners_some.queue", "some_node")
+        pipeline.sadd.assert_has_calls([
+            mock.call("blueque_listeners_some.queue", "some.host_1234"),
+            mock.call("blueque_host_listeners_some.queue_some.host", "some.host_1234")
+        ])
         pipeline.zincrby.assert_called_with("blueque_queues", 1, "some.queue")
 
         pipeline.execute.assert_called_with()
 
-        self.log_info.assert_called_with("Blueque queue some.queue: adding listener some_node")
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: adding listener some.host_1234")
 
     def test_remove_listener(self):
-        self.mock_redis.srem.return_value = 1
+        remove_script = self.scripts[redis_scripts.REMOVE_LISTENER]
+        remove_script.return_value = 1
 
-        removed = self.queue.remove_listener("some_node")
+        removed = self.queue.remove_listener("some.host_1234")
 
         self.assertEqual(1, removed, "Returns one removed listener")
 
-        self.mock_redis.zincrby.assert_called_with("blueque_queues", -1, "some.queue")
-        self.mock_redis.srem.assert_called_with("blueque_listeners_some.queue", "some_node")
+        remove_script.assert_called_with(
+            keys=[
+                "blueque_listeners_some.queue",
+                "blueque_host_listeners_some.queue_some.host",
+                "blueque_queues",
+                "blueque_handed_off_listeners_some.queue_some.host"
+            ],
+            args=["some.host_1234", "some.queue"])
 
         self.log_info.assert_has_calls([
-            mock.call("Blueque queue some.queue: removing listener some_node"),
+            mock.call("Blueque queue some.queue: removing listener some.host_1234"),
             mock.call("Blueque queue some.queue: removed listener")])
 
     def test_remove_missing_listener(self):
-        self.mock_redis.srem.return_value = 0
+        self.scripts[redis_scripts.REMOVE_LISTENER].return_value = 0
 
-        removed = self.queue.remove_listener("some_node")
+        removed = self.queue.remove_listener("some.host_1234")
 
         self.assertEqual(0, removed, "Returns no nodes removed")
 
-        self.mock_redis.zincrby.assert_not_called()
-        self.mock_redis.srem.assert_called_with("blueque_listeners_some.queue", "some_node")
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: removing listener some.host_1234")
+
+    def test_get_host_listeners(self):
+        self.mock_redis.smembers.return_value = {"some.host_1234"}
+
+        listeners = self.queue.get_host_listeners("some.host")
+
+        self.assertEqual({"some.host_1234"}, listeners)
+        self.mock_redis.smembers.assert_called_with("blueque_host_listeners_some.queue_some.host")
+
+    def test_index_host_listeners_indexes_listeners_in_batches(self):
+        index_script = self.scripts[redis_scripts.INDEX_HOST_LISTENERS]
+        index_script.side_effect = [2, 0]
+
+        self.mock_redis.sscan_iter.return_value = iter(
+            ["some.host_1234", "other.host_4321", "some.host_5678"])
+
+        indexed = self.queue.index_host_listeners(2)
+
+        self.assertEqual(2, indexed)
+
+        self.mock_redis.sscan_iter.assert_called_with("blueque_listeners_some.queue", count=2)
+
+        index_script.assert_has_calls([
+            mock.call(
+                keys=["blueque_listeners_some.queue"],
+                args=["blueque_host_listeners_some.queue_", "some.host_1234", "other.host_4321"]),
+            mock.call(
+                keys=["blueque_listeners_some.queue"],
+                args=["blueque_host_listeners_some.queue_", "some.host_5678"])
+        ])
 
-        self.log_info.assert_called_with("Blueque queue some.queue: removing listener some_node")
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: indexed 2 listeners by host")
+
+    def test_hand_off(self):
+        self.queue.hand_off("some.host_1234")
+
+        self.mock_redis.sadd.assert_called_with(
+            "blueque_handed_off_listeners_some.queue_some.host", "some.host_1234")
+
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: handing off listener some.host_1234")
+
+    def test_get_handed_off_listeners(self):
+        self.mock_redis.smembers.return_value = {"some.host_1234"}
+
+        listeners = self.queue.get_handed_off_listeners("some.host")
+
+        self.assertEqual({"some.host_1234"}, listeners)
+        self.mock_redis.smembers.assert_called_with(
+            "blueque_handed_off_listeners_some.queue_some.host")
 
     def test_get_listeners(self):
         self.mock_redis.smembers.return_value = ["some-listener_1234", "other-listener_4321"]
@@ -82,26 +147,171 @@ class TestRedisQueue(unittest.TestCase):
         self.mock_redis.smembers.assert_called_with("blueque_listeners_some.queue")
         self.assertEqual(["some-listener_1234", "other-listener_4321"], listeners)
 
+    def test_subscribe(self):
+        pubsub = self.queue.subscribe()
+
+        self.mock_redis.pubsub.assert_called_with(ignore_subscribe_messages=True)
+        self.assertEqual(self.mock_redis.pubsub.return_value, pubsub)
+
+        pubsub.subscribe.assert_called_with("blueque_task_channel_some.queue")
+
     def test_reclaim_task_when_empty(self):
-        self.mock_redis.lindex.return_value = None
+        self.scripts[redis_scripts.RECLAIM_TASKS].return_value = []
 
         task_id = self.queue.reclaim_task("some-listener_1", "some-listener_2")
 
-        self.mock_redis.lindex.assert_called_with(
-            "blueque_reserved_tasks_some.queue_some-listener_1", 0)
         self.assertIsNone(task_id)
 
-    def test_reclaim_task_marks_task_reclaimed(self):
-        self.mock_redis.lindex.return_value = "some_task"
+    def test_renew_lease(self):
+        renew_script = self.scripts[redis_scripts.RENEW_LEASE]
+        renew_script.return_value = 1
+
+        self.assertTrue(self.queue.renew_lease("some.host_1234", 30))
+
+        renew_script.assert_called_with(
+            keys=[
+                "blueque_listeners_some.queue",
+                "blueque_host_listeners_some.queue_some.host",
+                "blueque_queues",
+                "blueque_heartbeat_some.queue_some.host_1234",
+                "blueque_leased_listeners_some.queue"
+            ],
+            args=["some.host_1234", "some.queue", 12.34, 30000, 0])
+
+    def test_renew_lease_registers_listener_again(self):
+        renew_script = self.scripts[redis_scripts.RENEW_LEASE]
+        renew_script.return_value = 2
+
+        self.assertTrue(self.queue.renew_lease("some.host_1234", 30, register=True))
+
+        self.assertEqual(1, renew_script.call_args.kwargs["args"][4])
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: listener some.host_1234 lost its lease, "
+            "and registered again")
+
+    def test_renew_lease_when_lost(self):
+        self.scripts[redis_scripts.RENEW_LEASE].return_value = 0
+
+        self.assertFalse(self.queue.renew_lease("some.host_1234", 30))
+
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: lease of some.host_1234 was lost")
+
+    def test_recover_expired_leases(self):
+        recover_script = self.scripts[redis_scripts.RECOVER_EXPIRED_LEASES]
+        recover_script.return_value = ["some_task", "other_task"]
+
+        task_ids = self.queue.recover_expired_leases()
+
+        recover_script.assert_called_with(
+            keys=[
+                "blueque_leased_listeners_some.queue",
+                "blueque_listeners_some.queue",
+                "blueque_queues",
+                "blueque_pending_tasks_some.queue",
+                "blueque_started_tasks_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "blueque_heartbeat_some.queue_",
+                "blueque_reserved_tasks_some.queue_",
+                "blueque_task_",
+                12.34,
+                "some.queue",
+                "blueque_task_channel_some.queue",
+                10000,
+                "blueque_host_listeners_some.queue_",
+                "blueque_handed_off_listeners_some.queue_"
+            ])
+
+        self.assertEqual(["some_task", "other_task"], task_ids)
+
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: recovered tasks with expired leases: "
+            "['some_task', 'other_task']")
+
+    def test_reclaim_listeners(self):
+        reclaim_script = self.scripts[redis_scripts.RECLAIM_LISTENERS]
+        reclaim_script.return_value = ["some_task", "other_task"]
+
+        task_ids = self.queue.reclaim_listeners(
+            ["some.host_1111", "some.host_2222"], "some.host_3333")
+
+        reclaim_script.assert_called_with(
+            keys=[
+                "blueque_listeners_some.queue",
+                "blueque_queues",
+                "blueque_events_some.queue",
+                "blueque_started_tasks_some.queue"
+            ],
+            args=[
+                "some.host_3333",
+                "blueque_host_listeners_some.queue_",
+                "blueque_reserved_tasks_some.queue_",
+                "blueque_task_",
+                12.34,
+                "some.queue",
+                10000,
+                "blueque_handed_off_listeners_some.queue_",
+                "some.host_1111",
+                "some.host_2222"
+            ])
+
+        self.assertEqual(["some_task", "other_task"], task_ids)
+
+    def test_reclaim_task_moves_first_task(self):
+        reclaim_script = self.scripts[redis_scripts.RECLAIM_TASKS]
+        reclaim_script.return_value = ["some_task"]
 
         task_id = self.queue.reclaim_task("some-listener_1", "some-listener_2")
 
-        self.mock_redis.lindex.assert_called_with(
-            "blueque_reserved_tasks_some.queue_some-listener_1", 0)
-        self.mock_redis.hset.assert_called_with(
-            "blueque_task_some_task", "reclaimed_node", "some-listener_2")
+        reclaim_script.assert_called_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some-listener_1",
+                "blueque_started_tasks_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "some-listener_1",
+                "some-listener_2",
+                "blueque_reserved_tasks_some.queue_",
+                "blueque_task_",
+                12.34,
+                10000,
+                1
+            ])
         self.assertEqual("some_task", task_id)
 
+    def test_reclaim_tasks_when_empty(self):
+        self.scripts[redis_scripts.RECLAIM_TASKS].return_value = []
+
+        task_ids = self.queue.reclaim_tasks("some-listener_1", "some-listener_2")
+
+        self.assertEqual([], task_ids)
+
+    def test_reclaim_tasks_moves_all_tasks(self):
+        reclaim_script = self.scripts[redis_scripts.RECLAIM_TASKS]
+        reclaim_script.return_value = ["some_task", "other_task"]
+
+        task_ids = self.queue.reclaim_tasks("some-listener_1", "some-listener_2")
+
+        reclaim_script.assert_called_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some-listener_1",
+                "blueque_started_tasks_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "some-listener_1",
+                "some-listener_2",
+                "blueque_reserved_tasks_some.queue_",
+                "blueque_task_",
+                12.34,
+                10000,
+                0
+            ])
+        self.assertEqual(["some_task", "other_task"], task_ids)
+
     def test_enqueue(self):
         pipeline = self._get_pipeline()
 
@@ -119,27 +329,127 @@ class TestRedisQueue(unittest.TestCase):
                 "updated": 12.34
             })
 
+        pipeline.xadd.assert_called_with(
+            "blueque_events_some.queue",
+            {"event": "enqueued", "task": "12345678-1234-1234-1234-123456781234", "time": 12.34},
+            maxlen=10000, approximate=True)
+
         pipeline.zincrby.assert_called_with("blueque_queues", 0, "some.queue")
         pipeline.lpush.assert_called_with(
             "blueque_pending_tasks_some.queue", "12345678-1234-1234-1234-123456781234")
+        pipeline.publish.assert_called_with("blueque_task_channel_some.queue", "some.queue")
         pipeline.execute.assert_called_with()
 
         self.log_info.assert_called_with(
             "Blueque queue some.queue: adding pending task "
             "12345678-1234-1234-1234-123456781234, parameters: some parameter")
 
+    def test_enqueue_with_timeout(self):
+        pipeline = self._get_pipeline()
+
+        self.queue.enqueue("some parameter", 30)
+
+        pipeline.hset.assert_called_with(
+            "blueque_task_12345678-1234-1234-1234-123456781234",
+            mapping={
+                "status": "pending",
+                "queue": "some.queue",
+                "parameters": "some parameter",
+                "created": 12.34,
+                "updated": 12.34,
+                "timeout": 30
+            })
+
+    def test_registers_scripts(self):
+        self.assertCountEqual(
+            [
+                redis_scripts.DEQUEUE,
+                redis_scripts.START,
+                redis_scripts.FINISH,
+                redis_scripts.ENQUEUE_DUE,
+                redis_scripts.RECOVER_EXPIRED_LEASES,
+                redis_scripts.REMOVE_LISTENER,
+                redis_scripts.RENEW_LEASE,
+                redis_scripts.RECLAIM_TASKS,
+                redis_scripts.RECLAIM_LISTENERS,
+                redis_scripts.INDEX_HOST_LISTENERS,
+                redis_scripts.RECORD_USAGE,
+                redis_scripts.PURGE_FINISHED,
+                redis_scripts.MIGRATE_FINISHED
+            ],
+            self.scripts.keys())
+
+    def test_enqueue_many(self):
+        pipeline = self._get_pipeline()
+
+        uuid4 = mock.patch("uuid.uuid4", side_effect=[
+            uuid.UUID(int=1), uuid.UUID(int=2), uuid.UUID(int=3)])
+        uuid4.start()
+        self.addCleanup(uuid4.stop)
+
+        first_id = "00000000-0000-0000-0000-000000000001"
+        second_id = "00000000-0000-0000-0000-000000000002"
+        third_id = "00000000-0000-0000-0000-000000000003"
+
+        task_ids = self.queue.enqueue_many(
+            (parameters for parameters in ["first", "second", "third"]), 2)
+
+        self.assertEqual([first_id, second_id, third_id], task_ids)
+
+        self.assertEqual(2, self.mock_redis.pipeline.call_count)
+
+        pipeline.hset.assert_has_calls([
+            mock.call(
+                "blueque_task_" + task_id,
+                mapping={
+                    "status": "pending",
+                    "queue": "some.queue",
+                    "parameters": parameters,
+                    "created": 12.34,
+                    "updated": 12.34
+                })
+            for task_id, parameters in [
+                (first_id, "first"), (second_id, "second"), (third_id, "third")]
+        ])
+
+        pipeline.zincrby.assert_has_calls([
+            mock.call("blueque_queues", 0, "some.queue"),
+            mock.call("blueque_queues", 0, "some.queue")
+        ])
+        self.assertEqual(2, pipeline.zincrby.call_count)
+
+        pipeline.lpush.assert_has_calls([
+            mock.call("blueque_pending_tasks_some.queue", first_id, second_id),
+            mock.call("blueque_pending_tasks_some.queue", third_id)
+        ])
+        self.assertEqual(2, pipeline.lpush.call_count)
+
+        self.assertEqual(2, pipeline.publish.call_count)
+        self.assertEqual(2, pipeline.execute.call_count)
+
+    def test_enqueue_many_does_nothing_when_empty(self):
+        task_ids = self.queue.enqueue_many([], 2)
+
+        self.assertEqual([], task_ids)
+
+        self.mock_redis.pipeline.assert_not_called()
+
     def test_dequeue(self):
-        self.mock_redis.rpoplpush.return_value = "1234"
+        self.scripts[redis_scripts.DEQUEUE].return_value = "1234"
 
         task_id = self.queue.dequeue("some_node")
 
         self.assertEqual("1234", task_id)
 
-        self.mock_redis.rpoplpush.assert_called_with(
-            "blueque_pending_tasks_some.queue", "blueque_reserved_tasks_some.queue_some_node")
-        self.mock_redis.hset.assert_called_with(
-            "blueque_task_1234",
-            mapping={"status": "reserved", "node": "some_node", "updated": 12.34})
+        self.scripts[redis_scripts.DEQUEUE].assert_called_with(
+            keys=[
+                "blueque_pending_tasks_some.queue",
+                "blueque_reserved_tasks_some.queue_some_node",
+                "blueque_events_some.queue"
+            ],
+            args=["blueque_task_", "some_node", 12.34, 10000])
+        self.mock_redis.rpoplpush.assert_not_called()
+        self.mock_redis.hset.assert_not_called()
 
         self.log_debug.assert_has_calls([
             mock.call("Blueque queue some.queue: reserving task on some_node")
@@ -150,34 +460,172 @@ class TestRedisQueue(unittest.TestCase):
         ])
 
     def test_dequeue_returns_null_when_empty(self):
-        self.mock_redis.rpoplpush.return_value = None
+        self.scripts[redis_scripts.DEQUEUE].return_value = None
 
         task_id = self.queue.dequeue("some_node")
 
         self.assertEqual(None, task_id)
 
-        self.mock_redis.rpoplpush.assert_called_with(
-            "blueque_pending_tasks_some.queue", "blueque_reserved_tasks_some.queue_some_node")
-        self.mock_redis.hset.assert_not_called()
+        self.scripts[redis_scripts.DEQUEUE].assert_called_with(
+            keys=[
+                "blueque_pending_tasks_some.queue",
+                "blueque_reserved_tasks_some.queue_some_node",
+                "blueque_events_some.queue"
+            ],
+            args=["blueque_task_", "some_node", 12.34, 10000])
 
         self.log_debug.assert_has_calls([
             mock.call("Blueque queue some.queue: reserving task on some_node")
         ])
 
-    def test_start_task(self):
+    def test_blocking_dequeue(self):
+        self.mock_redis.brpoplpush.return_value = "1234"
+
+        task_id = self.queue.dequeue("some_node", timeout=30)
+
+        self.assertEqual("1234", task_id)
+
+        self.mock_redis.brpoplpush.assert_called_with(
+            "blueque_pending_tasks_some.queue", "blueque_reserved_tasks_some.queue_some_node", 30)
+        self.mock_redis.rpoplpush.assert_not_called()
         pipeline = self._get_pipeline()
+        pipeline.hset.assert_called_with(
+            "blueque_task_1234",
+            mapping={"status": "reserved", "node": "some_node", "updated": 12.34})
+        pipeline.xadd.assert_called_with(
+            "blueque_events_some.queue",
+            {"event": "reserved", "task": "1234", "time": 12.34, "node": "some_node"},
+            maxlen=10000, approximate=True)
+        pipeline.execute.assert_called_with()
 
-        pipeline.execute.return_value = [1, True, "some parameter"]
+    def test_blocking_dequeue_returns_null_on_timeout(self):
+        self.mock_redis.brpoplpush.return_value = None
 
-        self.queue.start("some_task", "some_node", 4321)
+        task_id = self.queue.dequeue("some_node", timeout=30)
 
-        pipeline.sadd.assert_called_with(
-            "blueque_started_tasks_some.queue", "some_node 4321 some_task")
+        self.assertEqual(None, task_id)
 
-        pipeline.hset.assert_called_with(
-            "blueque_task_some_task", mapping={"status": "started", "pid": 4321, "updated": 12.34})
+        self.mock_redis.pipeline.assert_not_called()
+
+    def test_record_usage(self):
+        self.queue.record_usage("some_task", 1.5, 0.25, 2048, 3.75)
+
+        self.scripts[redis_scripts.RECORD_USAGE].assert_called_with(
+            keys=["blueque_task_some_task", "blueque_usage_some.queue"],
+            args=[1.5, 0.25, 2048, 3.75])
+
+    def test_get_usage(self):
+        self.mock_redis.hgetall.return_value = {
+            "tasks": "4",
+            "started_tasks": "2",
+            "cpu_user": "6.5",
+            "cpu_system": "1",
+            "duration": "10",
+            "queue_wait": "3",
+            "max_rss": "2048"
+        }
+
+        usage = self.queue.get_usage()
+
+        self.mock_redis.hgetall.assert_called_with("blueque_usage_some.queue")
+
+        self.assertEqual({
+            "tasks": 4,
+            "max_rss": 2048,
+            "cpu_user": 6.5,
+            "mean_cpu_user": 1.625,
+            "cpu_system": 1.0,
+            "mean_cpu_system": 0.25,
+            "duration": 10.0,
+            "mean_duration": 2.5,
+            "queue_wait": 3.0,
+            "mean_queue_wait": 1.5
+        }, usage)
+
+    def test_get_usage_when_nothing_recorded(self):
+        self.mock_redis.hgetall.return_value = {}
+
+        usage = self.queue.get_usage()
+
+        self.assertEqual(0, usage["tasks"])
+        self.assertEqual(0.0, usage["cpu_user"])
+        self.assertIsNone(usage["mean_cpu_user"])
+        self.assertIsNone(usage["mean_queue_wait"])
+
+    def test_get_stats(self):
+        stats_script = self.scripts.setdefault(redis_scripts.QUEUE_STATS, mock.Mock())
+        stats_script.return_value = [["some.queue", 3, 2, 1, 10, 4, 2, "2.34"]]
+
+        stats = self.queue.get_stats()
+
+        stats_script.assert_called_once_with(
+            keys=["blueque_queues"],
+            args=[
+                "blueque_pending_tasks_",
+                "blueque_scheduled_tasks_",
+                "blueque_started_tasks_",
+                "blueque_complete_tasks_by_time_",
+                "blueque_complete_tasks_",
+                "blueque_failed_tasks_by_time_",
+                "blueque_failed_tasks_",
+                "blueque_listeners_",
+                "blueque_task_",
+                "some.queue"
+            ])
+
+        self.assertEqual({
+            "pending": 3,
+            "scheduled": 2,
+            "started": 1,
+            "complete": 10,
+            "failed": 4,
+            "listeners": 2,
+            "oldest_pending_age": 10.0
+        }, stats)
+
+    def test_get_stats_with_nothing_pending(self):
+        self.scripts.setdefault(redis_scripts.QUEUE_STATS, mock.Mock()).return_value = [
+            ["some.queue", 0, 0, 0, 0, 0, 1, None]]
+
+        stats = self.queue.get_stats()
+
+        self.assertEqual(0, stats["pending"])
+        self.assertIsNone(stats["oldest_pending_age"])
+
+    def test_get_many_stats_reads_every_queue_with_one_call(self):
+        stats_script = self.scripts.setdefault(redis_scripts.QUEUE_STATS, mock.Mock())
+        stats_script.return_value = [
+            ["some.queue", 1, 0, 0, 0, 0, 1, "10.34"],
+            ["empty.queue", 0, 0, 0, 0, 0, 0, None],
+            ["other.queue", 2, 0, 0, 0, 0, 1, "12.34"]
+        ]
+
+        stats = RedisQueue.get_many_stats(self.mock_redis)
+
+        self.assertEqual(["some.queue", "empty.queue", "other.queue"], list(stats))
+        self.assertEqual([1, 0, 2], [queue_stats["pending"] for queue_stats in stats.values()])
+        self.assertEqual(
+            [2.0, None, 0.0],
+            [queue_stats["oldest_pending_age"] for queue_stats in stats.values()])
 
-        pipeline.execute.assert_called_with()
+        stats_script.assert_called_once_with(keys=["blueque_queues"], args=mock.ANY)
+        self.assertEqual(9, len(stats_script.call_args.kwargs["args"]))
+
+    def test_get_many_stats_of_no_queues(self):
+        self.assertEqual({}, RedisQueue.get_many_stats(self.mock_redis, []))
+
+        self.assertNotIn(redis_scripts.QUEUE_STATS, self.scripts)
+
+    def test_start_task(self):
+        self.queue.start("some_task", "some_node", 4321)
+
+        self.scripts[redis_scripts.START].assert_called_with(
+            keys=[
+                "blueque_started_tasks_some.queue",
+                "blueque_task_some_task",
+                "blueque_events_some.queue"
+            ],
+            args=["some_node 4321 some_task", 4321, 12.34, "some_task", "some_node", 10000])
 
         self.log_info.assert_has_calls([
             mock.call(
@@ -185,56 +633,141 @@ class TestRedisQueue(unittest.TestCase):
         ])
 
     def test_complete_task(self):
-        pipeline = self._get_pipeline()
-
         self.queue.complete("some_task", "some_node", 1234, "a result")
 
-        pipeline.lrem.assert_called_with(
-            "blueque_reserved_tasks_some.queue_some_node", 1, "some_task")
-        pipeline.srem.assert_called_with(
-            "blueque_started_tasks_some.queue", "some_node 1234 some_task")
-
-        pipeline.hset.assert_called_with(
-            "blueque_task_some_task",
-            mapping={
-                "status": "complete",
-                "result": "a result",
-                "updated": 12.34
-            })
-
-        pipeline.lpush.assert_called_with("blueque_complete_tasks_some.queue", "some_task")
-
-        pipeline.execute.assert_called_with()
+        self.scripts[redis_scripts.FINISH].assert_called_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some_node",
+                "blueque_started_tasks_some.queue",
+                "blueque_task_some_task",
+                "blueque_complete_tasks_by_time_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "some_task", "some_node 1234 some_task", "complete", "result", "a result", 12.34,
+                "blueque_finished_channel_some_task", "completed", 10000, 0, "some_node", "1234",
+                "blueque_reserved_tasks_some.queue_"
+            ])
 
         self.log_info.assert_called_with(
             "Blueque queue some.queue: completing task some_task on some_node, "
             "pid: 1234, result: a result")
 
-    def test_fail_task(self):
-        pipeline = self._get_pipeline()
+    def test_complete_task_with_result_ttl(self):
+        self.queue.complete("some_task", "some_node", 1234, "a result", 86400)
 
+        self.assertEqual(86400000, self.scripts[redis_scripts.FINISH].call_args.kwargs["args"][9])
+
+    def test_fail_task(self):
         self.queue.fail("some_task", "some_node", 1234, "error message")
 
-        pipeline.lrem.assert_called_with(
-            "blueque_reserved_tasks_some.queue_some_node", 1, "some_task")
-        pipeline.srem.assert_called_with(
-            "blueque_started_tasks_some.queue", "some_node 1234 some_task")
+        self.scripts[redis_scripts.FINISH].assert_called_with(
+            keys=[
+                "blueque_reserved_tasks_some.queue_some_node",
+                "blueque_started_tasks_some.queue",
+                "blueque_task_some_task",
+                "blueque_failed_tasks_by_time_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "some_task", "some_node 1234 some_task", "failed", "error", "error message", 12.34,
+                "blueque_finished_channel_some_task", "failed", 10000, 0, "some_node", "1234",
+                "blueque_reserved_tasks_some.queue_"
+            ])
 
-        pipeline.hset.assert_called_with(
-            "blueque_task_some_task",
-            mapping={
-                "status": "failed",
-                "error": "error message",
-                "updated": 12.34
-            })
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: failed task some_task on some_node, "
+            "pid: 1234, error: error message")
 
-        pipeline.lpush.assert_called_with("blueque_failed_tasks_some.queue", "some_task")
+    def test_fail_task_which_was_never_started(self):
+        self.queue.fail("some_task", "some_node", None, "error message")
 
-        pipeline.execute.assert_called_with()
+        self.assertEqual(
+            "some_node None some_task",
+            self.scripts[redis_scripts.FINISH].call_args.kwargs["args"][1])
 
         self.log_info.assert_called_with(
             "Blueque queue some.queue: failed task some_task on some_node, "
-            "pid: 1234, error: error message")
+            "pid: None, error: error message")
+
+    def test_purge_finished_purges_each_finished_list_in_batches(self):
+        purge_script = self.scripts[redis_scripts.PURGE_FINISHED]
+        purge_script.side_effect = [2, 2, 1, 0]
+
+        purged = self.queue.purge_finished(3600, 2)
+
+        self.assertEqual(5, purged)
+
+        purge_script.assert_has_calls([
+            mock.call(
+                keys=["blueque_complete_tasks_by_time_some.queue"],
+                args=["blueque_task_", 12.34 - 3600, 2]),
+            mock.call(
+                keys=["blueque_complete_tasks_by_time_some.queue"],
+                args=["blueque_task_", 12.34 - 3600, 2]),
+            mock.call(
+                keys=["blueque_complete_tasks_by_time_some.queue"],
+                args=["blueque_task_", 12.34 - 3600, 2]),
+            mock.call(
+                keys=["blueque_failed_tasks_by_time_some.queue"],
+                args=["blueque_task_", 12.34 - 3600, 2])
+        ])
+        self.assertEqual(4, purge_script.call_count)
+
+        self.log_info.assert_called_with(
+            "Blueque queue some.queue: purged 5 tasks finished before %f" % (12.34 - 3600))
+
+    def test_get_finished(self):
+        self.mock_redis.zrangebyscore.return_value = ["some_task", "other_task"]
+
+        task_ids = self.queue.get_finished("failed", 10, 20, None)
+
+        self.assertEqual(["some_task", "other_task"], task_ids)
+
+        self.mock_redis.zrangebyscore.assert_called_with(
+            "blueque_failed_tasks_by_time_some.queue", 10, 20)
+
+    def test_get_finished_with_limit(self):
+        self.queue.get_finished("complete", "-inf", "+inf", 5)
+
+        self.mock_redis.zrangebyscore.assert_called_with(
+            "blueque_complete_tasks_by_time_some.queue", "-inf", "+inf", start=0, num=5)
+
+    def test_cannot_get_unfinished_tasks(self):
+        with self.assertRaisesRegex(ValueError, "Cannot list task with status pending"):
+            self.queue.get_finished("pending", "-inf", "+inf", None)
+
+    def test_migrate_finished_migrates_each_finished_list_in_batches(self):
+        migrate_script = self.scripts[redis_scripts.MIGRATE_FINISHED]
+        migrate_script.side_effect = [[2, 1], [1, 0], [0, 0]]
+
+        migrated = self.queue.migrate_finished(2)
+
+        self.assertEqual(3, migrated)
+
+        migrate_script.assert_has_calls([
+            mock.call(
+                keys=[
+                    "blueque_complete_tasks_some.queue",
+                    "blueque_complete_tasks_by_time_some.queue"
+                ],
+                args=["blueque_task_", 2]),
+            mock.call(
+                keys=[
+                    "blueque_complete_tasks_some.queue",
+                    "blueque_complete_tasks_by_time_some.queue"
+                ],
+                args=["blueque_task_", 2]),
+            mock.call(
+                keys=[
+                    "blueque_failed_tasks_some.queue",
+                    "blueque_failed_tasks_by_time_some.queue"
+                ],
+                args=["blueque_task_", 2])
+        ])
+        self.assertEqual(3, migrate_script.call_count)
+
+        self.log_info.assert_called_with("Blueque queue some.queue: migrated 3 finished tasks")
 
     def test_delete_completed_task(self):
         pipeline = self._get_pipeline()
@@ -242,7 +775,12 @@ class TestRedisQueue(unittest.TestCase):
         self.queue.delete_task("some_task", "complete")
 
         pipeline.delete.assert_called_with("blueque_task_some_task")
+        pipeline.zrem.assert_called_with("blueque_complete_tasks_by_time_some.queue", "some_task")
         pipeline.lrem.assert_called_with("blueque_complete_tasks_some.queue", 1, "some_task")
+        pipeline.xadd.assert_called_with(
+            "blueque_events_some.queue",
+            {"event": "deleted", "task": "some_task", "time": 12.34},
+            maxlen=10000, approximate=True)
 
         pipeline.execute.assert_called_with()
 
@@ -255,6 +793,7 @@ class TestRedisQueue(unittest.TestCase):
         self.queue.delete_task("some_task", "failed")
 
         pipeline.delete.assert_called_with("blueque_task_some_task")
+        pipeline.zrem.assert_called_with("blueque_failed_tasks_by_time_some.queue", "some_task")
         pipeline.lrem.assert_called_with("blueque_failed_tasks_some.queue", 1, "some_task")
 
         pipeline.execute.assert_called_with()
@@ -284,12 +823,18 @@ class TestRedisQueue(unittest.TestCase):
                 "updated": 12.34
             }
         )
+        pipeline.xadd.assert_called_with(
+            "blueque_events_some.queue",
+            {"event": "scheduled", "task": "12345678-1234-1234-1234-123456781234", "time": 12.34},
+            maxlen=10000, approximate=True)
 
         pipeline.zincrby.assert_called_with("blueque_queues", 0, "some.queue")
 
         pipeline.zadd.assert_called_with(
             "blueque_scheduled_tasks_some.queue", {"12345678-1234-1234-1234-123456781234": 13.5})
 
+        pipeline.publish.assert_called_with("blueque_schedule_channel", "some.queue")
+
         pipeline.execute.assert_called_with()
 
         self.log_info.assert_called_with(
@@ -304,65 +849,179 @@ class TestRedisQueue(unittest.TestCase):
 
         self.assertEqual("some_task", task_id)
 
-        self.queue.enqueue.assert_called_with("some parameters")
+        self.queue.enqueue.assert_called_with("some parameters", None)
 
         self.assertFalse(self._get_pipeline().zadd.called)
 
-    def test_enqueue_due_enqueues_all_due_tasks(self):
-        pipeline = mock.MagicMock(spec=redis.client.Pipeline)
+    def test_schedule_many(self):
+        pipeline = self._get_pipeline()
 
-        pipeline.zrangebyscore.return_value = ["some_task", "other_task"]
+        uuid4 = mock.patch("uuid.uuid4", side_effect=[
+            uuid.UUID(int=1), uuid.UUID(int=2), uuid.UUID(int=3), uuid.UUID(int=4)])
+        uuid4.start()
+        self.addCleanup(uuid4.stop)
 
-        self.mock_redis.transaction.side_effect = lambda c, *args: c(pipeline)
+        first_id = "00000000-0000-0000-0000-000000000001"
+        second_id = "00000000-0000-0000-0000-000000000002"
+        third_id = "00000000-0000-0000-0000-000000000003"
+        fourth_id = "00000000-0000-0000-0000-000000000004"
 
-        # make sure that we're snapshotting the current time, instead
-        # of calling it multiple times.
-        self.mock_time.side_effect = [10, 11, 12, 13]
+        task_ids = self.queue.schedule_many(
+            [("first", 13.5), ("second", 1.0), ("third", 20.0), ("fourth", 2.0)], 3)
 
-        self.queue.enqueue_due_tasks()
+        self.assertEqual([first_id, second_id, third_id, fourth_id], task_ids)
 
-        # don't care about the first argument, just that we're watching the right keys
-        self.assertEqual(1, self.mock_redis.transaction.call_count)
-        self.assertEqual(
-            ("blueque_scheduled_tasks_some.queue",),
-            self.mock_redis.transaction.call_args[0][1:])
+        self.assertEqual(2, self.mock_redis.pipeline.call_count)
 
-        pipeline.zrangebyscore.assert_called_with("blueque_scheduled_tasks_some.queue", 0, 10)
+        pipeline.hset.assert_has_calls([
+            mock.call(
+                "blueque_task_" + first_id,
+                mapping={
+                    "status": "scheduled",
+                    "queue": "some.queue",
+                    "parameters": "first",
+                    "eta": 13.5,
+                    "created": 12.34,
+                    "updated": 12.34
+                }),
+            mock.call(
+                "blueque_task_" + second_id,
+                mapping={
+                    "status": "pending",
+                    "queue": "some.queue",
+                    "parameters": "second",
+                    "created": 12.34,
+                    "updated": 12.34
+                })
+        ])
+
+        self.assertEqual(2, pipeline.zincrby.call_count)
+        pipeline.zincrby.assert_called_with("blueque_queues", 0, "some.queue")
+
+        pipeline.zadd.assert_called_once_with(
+            "blueque_scheduled_tasks_some.queue", {first_id: 13.5, third_id: 20.0})
 
-        pipeline.multi.assert_called_with()
-        pipeline.zremrangebyscore.assert_called_with("blueque_scheduled_tasks_some.queue", 0, 10)
         pipeline.lpush.assert_has_calls([
-            mock.call("blueque_pending_tasks_some.queue", "some_task"),
-            mock.call("blueque_pending_tasks_some.queue", "other_task")
+            mock.call("blueque_pending_tasks_some.queue", second_id),
+            mock.call("blueque_pending_tasks_some.queue", fourth_id)
         ])
 
-        pipeline.hset.assert_has_calls([
-            mock.call("blueque_task_some_task", mapping={"status": "pending", "updated": 10}),
-            mock.call("blueque_task_other_task", mapping={"status": "pending", "updated": 10})
+        pipeline.publish.assert_has_calls([
+            mock.call("blueque_task_channel_some.queue", "some.queue"),
+            mock.call("blueque_schedule_channel", "some.queue"),
+            mock.call("blueque_task_channel_some.queue", "some.queue")
         ])
+        self.assertEqual(3, pipeline.publish.call_count)
+
+        self.assertEqual(2, pipeline.execute.call_count)
+
+    def test_schedule_many_does_not_notify_listeners_when_nothing_is_due(self):
+        pipeline = self._get_pipeline()
+
+        self.queue.schedule_many([("first", 13.5)], 3)
+
+        pipeline.zadd.assert_called_once_with(
+            "blueque_scheduled_tasks_some.queue",
+            {"12345678-1234-1234-1234-123456781234": 13.5})
+
+        pipeline.lpush.assert_not_called()
+        pipeline.publish.assert_called_once_with("blueque_schedule_channel", "some.queue")
+
+    def test_enqueue_due_enqueues_due_tasks(self):
+        self.scripts[redis_scripts.ENQUEUE_DUE].return_value = [["some_task", "other_task"], 3]
+
+        remaining = self.queue.enqueue_due_tasks(100)
+
+        self.assertEqual(3, remaining)
+
+        self.scripts[redis_scripts.ENQUEUE_DUE].assert_called_with(
+            keys=[
+                "blueque_scheduled_tasks_some.queue",
+                "blueque_pending_tasks_some.queue",
+                "blueque_events_some.queue"
+            ],
+            args=[
+                "blueque_task_", 12.34, 100, "blueque_task_channel_some.queue", "some.queue", 10000
+            ])
 
         self.log_info.assert_called_with(
-            "Blueque queue some.queue: enqueuing due tasks: ['some_task', 'other_task']")
+            "Blueque queue some.queue: enqueued due tasks: ['some_task', 'other_task'], "
+            "3 still due")
 
     def test_enqueue_due_does_nothing_when_nothing_is_due(self):
-        pipeline = mock.MagicMock(spec=redis.client.Pipeline)
+        self.scripts[redis_scripts.ENQUEUE_DUE].return_value = [[], 0]
 
-        pipeline.zrangebyscore.return_value = []
+        remaining = self.queue.enqueue_due_tasks(100)
 
-        self.mock_redis.transaction.side_effect = lambda c, *args: c(pipeline)
+        self.assertEqual(0, remaining)
 
-        # make sure that we're snapshotting the current time, instead
-        # of calling it multiple times.
-        self.mock_time.side_effect = [10, 11, 12, 13]
+        self.log_debug.assert_called_with("Blueque queue some.queue: no due tasks")
 
-        self.queue.enqueue_due_tasks()
 
-        # don't care about the first argument, just that we're watching the right keys
-        self.assertEqual(1, self.mock_redis.transaction.call_count)
-        self.assertEqual(
-            ("blueque_scheduled_tasks_some.queue",),
-            self.mock_redis.transaction.call_args[0][1:])
+class TestRedisQueueMetrics(unittest.TestCase):
+    def setUp(self):
+        self.mock_redis = mock.MagicMock(spec=redis.StrictRedis)
+        self.mock_redis.register_script.side_effect = lambda script: mock.Mock()
 
-        self.assertFalse(pipeline.zremrangebyscore.called)
+        self.log_info_patch = mock.patch("logging.info", autospec=True)
+        self.log_info_patch.start()
+        self.addCleanup(self.log_info_patch.stop)
 
-        self.log_debug.assert_called_with("Blueque queue some.queue: no due tasks")
+        self.perf_counter_patch = mock.patch("time.perf_counter", side_effect=[1.0, 1.25])
+        self.perf_counter_patch.start()
+        self.addCleanup(self.perf_counter_patch.stop)
+
+        self.metrics = mock.Mock()
+        self.queue = RedisQueue("some.queue", self.mock_redis, self.metrics)
+
+    def test_enqueue_is_observed(self):
+        self.queue.enqueue("some parameters")
+
+        self.metrics.observe_operation.assert_called_once_with(
+            "some.queue", "enqueue", 0.25, 1)
+
+    def test_enqueue_many_counts_a_round_trip_per_chunk(self):
+        self.queue.enqueue_many(["first", "second", "third"], 2)
+
+        self.metrics.observe_operation.assert_called_once_with(
+            "some.queue", "enqueue_many", 0.25, 2)
+
+    def test_blocking_dequeue_takes_two_round_trips(self):
+        self.mock_redis.brpoplpush.return_value = "some_task"
+
+        self.queue.dequeue("some_node", timeout=10)
+
+        self.metrics.observe_operation.assert_called_once_with(
+            "some.queue", "dequeue", 0.25, 2)
+
+    def test_blocking_dequeue_without_task_takes_one_round_trip(self):
+        self.mock_redis.brpoplpush.return_value = None
+
+        self.queue.dequeue("some_node", timeout=10)
+
+        self.metrics.observe_operation.assert_called_once_with(
+            "some.queue", "dequeue", 0.25, 1)
+
+    def test_start_is_observed(self):
+        self.queue.start("some_task", "some_node", 1234)
+
+        self.metrics.observe_operation.assert_called_once_with("some.queue", "start", 0.25, 1)
+
+    def test_complete_is_observed(self):
+        self.queue.complete("some_task", "some_node", 1234, "some result")
+
+        self.metrics.observe_operation.assert_called_once_with(
+            "some.queue", "complete", 0.25, 1)
+
+    def test_fail_is_observed(self):
+        self.queue.fail("some_task", "some_node", 1234, "some error")
+
+        self.metrics.observe_operation.assert_called_once_with("some.queue", "fail", 0.25, 1)
+
+    def test_enqueue_due_tasks_is_observed(self):
+        self.queue._enqueue_due_script.return_value = [[], 0]
+
+        self.queue.enqueue_due_tasks(10)
+
+        self.metrics.observe_operation.assert_called_once_with(
+            "some.queue", "enqueue_due_tasks", 0.25, 1)
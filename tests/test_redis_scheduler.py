@@ -0,0 +1,84 @@
+from blueque import redis_scripts
+from blueque.redis_scheduler import RedisScheduler
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import redis
+import unittest
+
+
+class TestRedisScheduler(unittest.TestCase):
+    def setUp(self):
+        self.mock_redis = mock.MagicMock(spec=redis.StrictRedis)
+
+        self.scripts = {}
+        self.mock_redis.register_script.side_effect = \
+            lambda script: self.scripts.setdefault(script, mock.Mock())
+
+        self.scheduler = RedisScheduler(self.mock_redis)
+
+    def _get_pipeline(self):
+        return self.mock_redis.pipeline.return_value.__enter__.return_value
+
+    def test_acquire_lock(self):
+        self.scripts[redis_scripts.ACQUIRE_LOCK].return_value = 1
+
+        self.assertTrue(self.scheduler.acquire_lock("some_node", 1.5))
+
+        self.scripts[redis_scripts.ACQUIRE_LOCK].assert_called_with(
+            keys=["blueque_scheduler_lock"], args=["some_node", 1500])
+
+    def test_acquire_lock_when_locked(self):
+        self.scripts[redis_scripts.ACQUIRE_LOCK].return_value = 0
+
+        self.assertFalse(self.scheduler.acquire_lock("some_node", 1.5))
+
+    def test_release_lock(self):
+        self.scripts[redis_scripts.RELEASE_LOCK].return_value = 1
+
+        self.assertTrue(self.scheduler.release_lock("some_node"))
+
+        self.scripts[redis_scripts.RELEASE_LOCK].assert_called_with(
+            keys=["blueque_scheduler_lock"], args=["some_node"])
+
+    def test_subscribe(self):
+        pubsub = self.scheduler.subscribe()
+
+        self.mock_redis.pubsub.assert_called_with(ignore_subscribe_messages=True)
+        self.assertEqual(self.mock_redis.pubsub.return_value, pubsub)
+
+        pubsub.subscribe.assert_called_with("blueque_schedule_channel")
+
+    def test_get_queues(self):
+        self.mock_redis.zrange.return_value = ["some.queue", "other.queue"]
+
+        self.assertEqual(["some.queue", "other.queue"], self.scheduler.get_queues())
+
+        self.mock_redis.zrange.assert_called_with("blueque_queues", 0, -1)
+
+    def test_get_next_etas(self):
+        pipeline = self._get_pipeline()
+        pipeline.execute.return_value = [[("some_task", 12.5)], []]
+
+        next_etas = self.scheduler.get_next_etas(["some.queue", "other.queue"])
+
+        self.assertEqual({"some.queue": 12.5, "other.queue": None}, next_etas)
+
+        self.mock_redis.pipeline.assert_called_with(transaction=False)
+        pipeline.zrange.assert_has_calls([
+            mock.call("blueque_scheduled_tasks_some.queue", 0, 0, withscores=True),
+            mock.call("blueque_scheduled_tasks_other.queue", 0, 0, withscores=True)
+        ])
+
+    @mock.patch("blueque.redis_scheduler.RedisQueue", autospec=True)
+    def test_enqueue_due_tasks(self, mock_redis_queue_class):
+        mock_redis_queue_class.return_value.enqueue_due_tasks.return_value = 3
+
+        self.assertEqual(3, self.scheduler.enqueue_due_tasks("some.queue", 100))
+        self.scheduler.enqueue_due_tasks("some.queue", 100)
+
+        mock_redis_queue_class.assert_called_once_with("some.queue", self.mock_redis, None)
+        mock_redis_queue_class.return_value.enqueue_due_tasks.assert_called_with(100)
@@ -42,3 +42,41 @@ class TestRedisTask(unittest.TestCase):
             "created": 23.45,
             "updated": 34.56
         }, task_data)
+
+    def test_get_task_fields(self):
+        self.mock_redis.hmget.return_value = ["pending", "1234", None]
+
+        task_data = self.redis_task.get_task_fields(["status", "pid", "result"])
+
+        self.mock_redis.hmget.assert_called_with(
+            "blueque_task_some_task", ["status", "pid", "result"])
+
+        self.assertEqual({"status": "pending", "pid": 1234, "result": None}, task_data)
+
+    def test_get_many_task_data_pipelines_hgetall(self):
+        pipeline = self.mock_redis.pipeline.return_value.__enter__.return_value
+        pipeline.execute.return_value = [{"status": "pending", "pid": "1234"}, {}]
+
+        task_data = RedisTask.get_many_task_data(self.mock_redis, ["some_task", "missing_task"])
+
+        self.mock_redis.pipeline.assert_called_with(transaction=False)
+        pipeline.hgetall.assert_has_calls([
+            mock.call("blueque_task_some_task"), mock.call("blueque_task_missing_task")])
+
+        self.assertEqual([{"status": "pending", "pid": 1234}, None], task_data)
+
+    def test_get_many_task_data_pipelines_hmget_for_fields(self):
+        pipeline = self.mock_redis.pipeline.return_value.__enter__.return_value
+        pipeline.execute.return_value = [1, ["pending", None], 0, [None, None]]
+
+        task_data = RedisTask.get_many_task_data(
+            self.mock_redis, ["some_task", "missing_task"], ["status", "pid"])
+
+        pipeline.exists.assert_has_calls([
+            mock.call("blueque_task_some_task"), mock.call("blueque_task_missing_task")])
+        pipeline.hmget.assert_has_calls([
+            mock.call("blueque_task_some_task", ["status", "pid"]),
+            mock.call("blueque_task_missing_task", ["status", "pid"])])
+        pipeline.hgetall.assert_not_called()
+
+        self.assertEqual([{"status": "pending", "pid": None}, None], task_data)
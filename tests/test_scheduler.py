@@ -0,0 +1,161 @@
+from blueque import Client
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import unittest
+
+
+class BreakLoop(RuntimeError):
+    pass
+
+
+class TestScheduler(unittest.TestCase):
+    @mock.patch("socket.getfqdn", return_value="somehost.example.com")
+    @mock.patch("os.getpid", return_value=2314)
+    @mock.patch("redis.StrictRedis", autospec=True)
+    @mock.patch("blueque.client.RedisScheduler", autospec=True)
+    def setUp(self, mock_redis_scheduler_class, mock_strict_redis, _, __):
+        self.mock_strict_redis = mock_strict_redis.from_url.return_value
+
+        self.mock_redis_scheduler_class = mock_redis_scheduler_class
+        self.mock_redis_scheduler = mock_redis_scheduler_class.return_value
+        self.mock_redis_scheduler.get_queues.return_value = ["some.queue", "other.queue"]
+
+        self.subscription = self.mock_redis_scheduler.subscribe.return_value.__enter__.return_value
+        self.subscription.get_message.return_value = None
+
+        self.time_patch = mock.patch("time.time", return_value=100.0)
+        self.mock_time = self.time_patch.start()
+        self.addCleanup(self.time_patch.stop)
+
+        self.sleep_patch = mock.patch("time.sleep", autospec=True)
+        self.mock_sleep = self.sleep_patch.start()
+        self.addCleanup(self.sleep_patch.stop)
+
+        self.client = Client("redis://asdf:1234")
+        self.scheduler = self.client.get_scheduler(batch_size=10, lock_timeout=30)
+
+    def _run(self):
+        try:
+            self.scheduler.run()
+        except BreakLoop:
+            pass
+
+    def test_redis_scheduler_uses_client_connection(self):
+        self.mock_redis_scheduler_class.assert_called_with(self.mock_strict_redis, None)
+
+    def test_waits_for_lock(self):
+        self.mock_redis_scheduler.acquire_lock.return_value = False
+        self.mock_sleep.side_effect = [None, BreakLoop()]
+
+        self._run()
+
+        self.mock_redis_scheduler.acquire_lock.assert_called_with(
+            "somehost.example.com_2314", 30)
+        self.mock_sleep.assert_has_calls([mock.call(10.0), mock.call(10.0)])
+
+        self.mock_redis_scheduler.get_next_etas.assert_not_called()
+
+        self.mock_redis_scheduler.release_lock.assert_called_with("somehost.example.com_2314")
+
+    def test_enqueues_due_tasks_until_none_are_due(self):
+        self.mock_redis_scheduler.acquire_lock.return_value = True
+        self.mock_redis_scheduler.get_next_etas.side_effect = [
+            {"some.queue": 99.0, "other.queue": 100.0},
+            {"some.queue": 99.5, "other.queue": 105.0},
+            {"some.queue": 104.0, "other.queue": 105.0}
+        ]
+        self.subscription.get_message.side_effect = BreakLoop()
+
+        self._run()
+
+        self.mock_redis_scheduler.get_next_etas.assert_called_with(["some.queue", "other.queue"])
+        self.mock_redis_scheduler.enqueue_due_tasks.assert_has_calls([
+            mock.call("some.queue", 10),
+            mock.call("other.queue", 10),
+            mock.call("some.queue", 10)
+        ])
+        self.assertEqual(3, self.mock_redis_scheduler.enqueue_due_tasks.call_count)
+
+        self.subscription.get_message.assert_called_with(timeout=4.0)
+
+        self.mock_redis_scheduler.release_lock.assert_called_with("somehost.example.com_2314")
+
+    def test_sleeps_until_lock_must_be_renewed_when_nothing_is_scheduled(self):
+        self.mock_redis_scheduler.acquire_lock.return_value = True
+        self.mock_redis_scheduler.get_next_etas.return_value = {
+            "some.queue": None, "other.queue": None
+        }
+        self.subscription.get_message.side_effect = BreakLoop()
+
+        self._run()
+
+        self.mock_redis_scheduler.enqueue_due_tasks.assert_not_called()
+
+        self.subscription.get_message.assert_called_with(timeout=10.0)
+
+    def test_wakes_up_when_task_is_scheduled(self):
+        self.mock_redis_scheduler.acquire_lock.return_value = True
+        self.mock_redis_scheduler.get_next_etas.side_effect = [
+            {"some.queue": None, "other.queue": None},
+            {"some.queue": None, "other.queue": 101.0}
+        ]
+        self.subscription.get_message.side_effect = [
+            {"type": "message", "data": "other.queue"},
+            {"type": "message", "data": "other.queue"},
+            None,
+            BreakLoop()
+        ]
+
+        self._run()
+
+        self.subscription.get_message.assert_has_calls([
+            mock.call(timeout=10.0),
+            mock.call(),
+            mock.call(),
+            mock.call(timeout=1.0)
+        ])
+
+    def test_recovers_expired_leases_once_per_renew_interval(self):
+        self.mock_redis_scheduler.acquire_lock.return_value = True
+        self.mock_redis_scheduler.get_next_etas.return_value = {
+            "some.queue": None, "other.queue": None
+        }
+        wakes = []
+
+        def get_message(timeout=None):
+            if timeout is not None:
+                # Each wait takes 6 seconds, so leases are only
+                # recovered on every other pass.
+                wakes.append(timeout)
+                if len(wakes) > 3:
+                    raise BreakLoop()
+
+                self.mock_time.return_value += 6.0
+
+        self.subscription.get_message.side_effect = get_message
+
+        self._run()
+
+        self.mock_redis_scheduler.recover_expired_leases.assert_has_calls([
+            mock.call("some.queue"),
+            mock.call("other.queue"),
+            mock.call("some.queue"),
+            mock.call("other.queue")
+        ])
+        self.assertEqual(4, self.mock_redis_scheduler.recover_expired_leases.call_count)
+
+    def test_stops_enqueuing_when_lock_is_lost(self):
+        self.mock_redis_scheduler.acquire_lock.side_effect = [True, False, False]
+        self.mock_redis_scheduler.get_next_etas.return_value = {
+            "some.queue": 99.0, "other.queue": None
+        }
+        self.mock_sleep.side_effect = BreakLoop()
+
+        self._run()
+
+        self.mock_redis_scheduler.enqueue_due_tasks.assert_called_once_with("some.queue", 10)
+        self.subscription.get_message.assert_any_call(timeout=10.0)
@@ -17,24 +17,35 @@ FULL_TASK_DATA = {
     "node": "some_node",
     "pid": "1234",
     "created": "1234.5",
-    "updated": "4567.89"
+    "updated": "4567.89",
+    "started": "1240.5",
+    "queue_wait": "6.0",
+    "duration": "12.25",
+    "cpu_user": "10.5",
+    "cpu_system": "0.75",
+    "max_rss": "204800"
 }
 
+SMALL_FIELDS = [
+    "status", "queue", "node", "pid", "created", "updated", "eta", "timeout", "started",
+    "queue_wait", "duration", "cpu_user", "cpu_system", "max_rss"
+]
+
 
 class TestTask(unittest.TestCase):
     @mock.patch("redis.StrictRedis", autospec=True)
     def setUp(self, redis_class):
         self.mock_redis = redis_class.from_url.return_value
 
+        self.task_data = FULL_TASK_DATA
+        self.mock_redis.hmget.side_effect = \
+            lambda key, fields: [self.task_data.get(field) for field in fields]
+
         self.client = Client("redis://asdf:1234")
 
     def test_can_get_task_with_all_attributes(self):
-        self.mock_redis.hgetall.return_value = FULL_TASK_DATA
-
         task = self.client.get_task("some_task")
 
-        self.mock_redis.hgetall.assert_called_with("blueque_task_some_task")
-
         self.assertEqual("some_task", task.id)
 
         self.assertEqual("complete", task.status)
@@ -46,10 +57,14 @@ class TestTask(unittest.TestCase):
         self.assertEqual(1234, task.pid)
         self.assertEqual(1234.5, task.created)
         self.assertEqual(4567.89, task.updated)
+        self.assertEqual(1240.5, task.started)
+        self.assertEqual(6.0, task.queue_wait)
+        self.assertEqual(12.25, task.duration)
+        self.assertEqual(10.5, task.cpu_user)
+        self.assertEqual(0.75, task.cpu_system)
+        self.assertEqual(204800, task.max_rss)
 
     def test_cannot_set_properties(self):
-        self.mock_redis.hgetall.return_value = FULL_TASK_DATA
-
         task = self.client.get_task("some_task")
 
         with self.assertRaises(AttributeError):
@@ -82,8 +97,14 @@ class TestTask(unittest.TestCase):
         with self.assertRaises(AttributeError):
             task.updated = 2.3
 
+    def test_cannot_set_other_attributes(self):
+        task = self.client.get_task("some_task")
+
+        with self.assertRaises(AttributeError):
+            task.foo = "bar"
+
     def test_missing_attributes_are_none(self):
-        self.mock_redis.hgetall.return_value = {}
+        self.task_data = {}
 
         task = self.client.get_task("some_task")
 
@@ -96,3 +117,132 @@ class TestTask(unittest.TestCase):
         self.assertEqual(None, task.pid)
         self.assertEqual(None, task.created)
         self.assertEqual(None, task.updated)
+        self.assertEqual(None, task.started)
+        self.assertEqual(None, task.max_rss)
+
+    def test_does_not_load_fields_until_used(self):
+        task = self.client.get_task("some_task")
+
+        self.mock_redis.hmget.assert_not_called()
+        self.mock_redis.hgetall.assert_not_called()
+
+        self.assertEqual("complete", task.status)
+
+        self.mock_redis.hmget.assert_called_once_with("blueque_task_some_task", SMALL_FIELDS)
+
+    def test_loads_small_fields_together(self):
+        task = self.client.get_task("some_task")
+
+        self.assertEqual("complete", task.status)
+        self.assertEqual("some.queue", task.queue)
+        self.assertEqual("some_node", task.node)
+        self.assertEqual(1234, task.pid)
+        self.assertEqual(204800, task.max_rss)
+
+        self.assertEqual(1, self.mock_redis.hmget.call_count)
+
+    def test_loads_large_fields_separately(self):
+        task = self.client.get_task("some_task")
+
+        self.assertEqual("some parameters", task.parameters)
+
+        self.mock_redis.hmget.assert_called_once_with("blueque_task_some_task", ["parameters"])
+
+        self.assertEqual("complete", task.status)
+
+        self.mock_redis.hmget.assert_called_with("blueque_task_some_task", SMALL_FIELDS)
+
+    def test_caches_fields(self):
+        task = self.client.get_task("some_task")
+
+        self.assertEqual("complete", task.status)
+
+        self.task_data = {"status": "failed"}
+
+        self.assertEqual("complete", task.status)
+        self.assertEqual(1, self.mock_redis.hmget.call_count)
+
+    def test_caches_missing_fields(self):
+        self.task_data = {}
+
+        task = self.client.get_task("some_task")
+
+        self.assertIsNone(task.result)
+        self.assertIsNone(task.result)
+
+        self.assertEqual(1, self.mock_redis.hmget.call_count)
+
+    def test_refresh_reloads_fields(self):
+        task = self.client.get_task("some_task")
+
+        self.assertEqual("complete", task.status)
+
+        self.task_data = {"status": "failed"}
+
+        task.refresh()
+
+        self.mock_redis.hmget.assert_called_once_with("blueque_task_some_task", SMALL_FIELDS)
+
+        self.assertEqual("failed", task.status)
+        self.assertEqual(2, self.mock_redis.hmget.call_count)
+
+
+class TestGetTasks(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, redis_class):
+        self.mock_redis = redis_class.from_url.return_value
+        self.mock_pipeline = self.mock_redis.pipeline.return_value.__enter__.return_value
+
+        self.client = Client("redis://asdf:1234")
+
+    def test_get_tasks_returns_tasks_in_order(self):
+        self.mock_pipeline.execute.return_value = [
+            {"status": "pending"}, {}, FULL_TASK_DATA]
+
+        tasks = self.client.get_tasks(["first_task", "missing_task", "last_task"])
+
+        self.assertEqual(3, len(tasks))
+
+        self.assertEqual("first_task", tasks[0].id)
+        self.assertEqual("pending", tasks[0].status)
+        self.assertIsNone(tasks[0].result)
+
+        self.assertIsNone(tasks[1])
+
+        self.assertEqual("last_task", tasks[2].id)
+        self.assertEqual(1234, tasks[2].pid)
+
+        self.mock_redis.hmget.assert_not_called()
+
+    def test_get_tasks_fetches_in_chunks(self):
+        self.mock_pipeline.execute.side_effect = [
+            [{"status": "pending"}, {"status": "started"}], [{"status": "failed"}]]
+
+        tasks = self.client.get_tasks(iter(["one", "two", "three"]), chunk_size=2)
+
+        self.assertEqual(["pending", "started", "failed"], [task.status for task in tasks])
+        self.assertEqual(2, self.mock_pipeline.execute.call_count)
+
+    def test_get_tasks_fetches_only_requested_fields(self):
+        self.mock_pipeline.execute.return_value = [1, ["complete", "1234"], 0, [None, None]]
+
+        tasks = self.client.get_tasks(["some_task", "missing_task"], fields=["status", "pid"])
+
+        self.mock_pipeline.hmget.assert_called_with("blueque_task_missing_task", ["status", "pid"])
+        self.mock_pipeline.hgetall.assert_not_called()
+
+        self.assertEqual("complete", tasks[0].status)
+        self.assertEqual(1234, tasks[0].pid)
+        self.assertIsNone(tasks[1])
+
+        self.mock_redis.hmget.assert_not_called()
+
+    def test_get_tasks_loads_other_fields_lazily(self):
+        self.mock_pipeline.execute.return_value = [1, ["complete"]]
+        self.mock_redis.hmget.return_value = ["some result"]
+
+        task, = self.client.get_tasks(["some_task"], fields=["status"])
+
+        self.assertEqual("some result", task.result)
+
+        self.mock_redis.hmget.assert_called_with("blueque_task_some_task", ["result"])
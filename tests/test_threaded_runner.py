@@ -0,0 +1,180 @@
+from blueque import Client
+from blueque import threaded_runner
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import threading
+import unittest
+
+
+class BreakLoop(RuntimeError):
+    pass
+
+
+@mock.patch("os.getpid", return_value=2222)
+@mock.patch("blueque.client.RedisQueue", autospec=True)
+class TestThreadedRunner(unittest.TestCase):
+    @mock.patch("redis.StrictRedis", autospec=True)
+    def setUp(self, mock_redis_class):
+        self.mock_strict_redis = mock_redis_class.from_url.return_value
+        task_data = {
+            "status": "reserved",
+            "parameters": "some params",
+            "node": "some.host_1111"
+        }
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
+
+        self.task_callback = mock.Mock(return_value="some result")
+
+        self.client = Client("redis://asdf:1234")
+        self.runner = threaded_runner.ThreadedRunner(
+            self.client, "some.queue", self.task_callback, max_workers=2)
+
+    def _get_task(self, **kwargs):
+        task_data = {
+            "status": "reserved",
+            "parameters": "some params",
+            "node": "some.host_1111"
+        }
+
+        task_data.update(kwargs)
+
+        self.mock_strict_redis.hmget.side_effect = \
+            lambda key, fields: [task_data.get(field) for field in fields]
+
+        return self.client.get_task("some_task")
+
+    def test_run_runs_tasks_in_threads(self, redis_queue_class, _):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+        mock_queue.dequeue.side_effect = ["some_task", "other_task", BreakLoop()]
+
+        threads = []
+        self.task_callback.side_effect = \
+            lambda task: threads.append(threading.current_thread()) or "some result"
+
+        with self.assertRaises(BreakLoop):
+            self.runner.run()
+
+        self.assertEqual(2, self.task_callback.call_count)
+        self.assertNotIn(threading.main_thread(), threads)
+
+        mock_queue.start.assert_has_calls([
+            mock.call("some_task", "some.host_1111", 2222),
+            mock.call("other_task", "some.host_1111", 2222)
+        ], any_order=True)
+        mock_queue.complete.assert_has_calls([
+            mock.call("some_task", "some.host_1111", 2222, "some result", None),
+            mock.call("other_task", "some.host_1111", 2222, "some result", None)
+        ], any_order=True)
+
+    def test_run_fails_task_on_exception(self, redis_queue_class, _):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+        mock_queue.dequeue.side_effect = ["some_task", BreakLoop()]
+
+        self.task_callback.side_effect = Exception("some error")
+
+        with self.assertRaises(BreakLoop):
+            self.runner.run()
+
+        mock_queue.fail.assert_called_with("some_task", "some.host_1111", 2222, "some error", None)
+
+    def test_run_only_dequeues_when_a_thread_is_free(self, redis_queue_class, _):
+        mock_queue = redis_queue_class.return_value
+        mock_queue.get_host_listeners.return_value = []
+
+        release = threading.Event()
+        self.task_callback.side_effect = lambda task: release.wait(5)
+
+        def dequeue(node_id, timeout=None):
+            if mock_queue.dequeue.call_count == 3:
+                # Both threads are busy, so we can't have been called
+                # until one of them finished.
+                self.assertTrue(release.is_set())
+                raise BreakLoop()
+
+            if mock_queue.dequeue.call_count == 2:
+                threading.Timer(0.1, release.set).start()
+
+            return "some_task"
+
+        mock_queue.dequeue.side_effect = dequeue
+
+        with self.assertRaises(BreakLoop):
+            self.runner.run()
+
+        self.assertEqual(3, mock_queue.dequeue.call_count)
+
+    def test_run_runs_reserved_orphan(self, redis_queue_class, _):
+        mock_queue = redis_queue_class.return_value
+
+        with mock.patch.object(self.client, "get_listener") as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.listen.side_effect = BreakLoop()
+            mock_listener.reclaim_all.return_value = [self._get_task(status="reserved")]
+
+            with self.assertRaises(BreakLoop):
+                self.runner.run()
+
+            mock_get_listener.assert_called_with(
+                "some.queue", dequeue_timeout=None, subscribe=False, lease_timeout=None)
+
+        mock_queue.complete.assert_called_with(
+            "some_task", "some.host_1111", 2222, "some result", None)
+
+    def test_run_passes_listener_options(self, redis_queue_class, _):
+        runner = threaded_runner.ThreadedRunner(
+            self.client, "some.queue", self.task_callback, lease_timeout=30, dequeue_timeout=5,
+            subscribe=True)
+
+        with mock.patch.object(self.client, "get_listener") as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.listen.side_effect = BreakLoop()
+            mock_listener.reclaim_all.return_value = []
+
+            with self.assertRaises(BreakLoop):
+                runner.run()
+
+            mock_get_listener.assert_called_with(
+                "some.queue", dequeue_timeout=5, subscribe=True, lease_timeout=30)
+
+    @mock.patch("os.kill", side_effect=OSError)
+    def test_run_fails_started_orphan_when_its_process_is_gone(
+            self, mock_kill, redis_queue_class, _):
+        mock_queue = redis_queue_class.return_value
+
+        with mock.patch.object(self.client, "get_listener") as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.listen.side_effect = BreakLoop()
+            mock_listener.reclaim_all.return_value = [
+                self._get_task(status="started", pid="1111")]
+
+            with self.assertRaises(BreakLoop):
+                self.runner.run()
+
+        mock_kill.assert_called_with(1111, 0)
+        mock_queue.fail.assert_called_with(
+            "some_task", "some.host_1111", 1111, "Task was orphaned while running", None)
+        self.task_callback.assert_not_called()
+
+    @mock.patch("os.kill", return_value=None)
+    def test_run_leaves_started_orphan_when_its_process_is_running(
+            self, mock_kill, redis_queue_class, _):
+        mock_queue = redis_queue_class.return_value
+
+        with mock.patch.object(self.client, "get_listener") as mock_get_listener:
+            mock_listener = mock_get_listener.return_value
+            mock_listener.listen.side_effect = BreakLoop()
+            mock_listener.reclaim_all.return_value = [
+                self._get_task(status="started", pid="1111")]
+
+            with self.assertRaises(BreakLoop):
+                self.runner.run()
+
+        mock_queue.fail.assert_not_called()
+        self.task_callback.assert_not_called()